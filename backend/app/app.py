@@ -1,37 +1,93 @@
 import os
+import sys
 import mne
 import numpy as np
 import matplotlib.pyplot as plt
-import shutil
+from contextlib import nullcontext
 from model.main import annotate_edf
+from model.edf_utils import signals_to_volts
+from model.edf_stream import save_annotations_streaming
 from model.annotation_utils import seconds_to_hms
+from model.profiling import normalize_profile_mode, profile_mode_from_env, profile_run
+from view_utils import MinMaxPyramid, LOD_THRESHOLD, interleave_envelope
 from matplotlib.widgets import Slider
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import (
     QApplication, QFileDialog, QMainWindow, QPushButton,
-    QLabel, QVBoxLayout, QWidget, QMessageBox, QSplitter, QListWidget, QHBoxLayout, QInputDialog, QLineEdit
+    QLabel, QVBoxLayout, QWidget, QMessageBox, QSplitter, QListWidget, QHBoxLayout, QInputDialog, QLineEdit,
+    QProgressDialog
 )
 
-def process_edf(file_path):
-    return mne.io.read_raw_edf(file_path, preload=False)
+def recording_to_raw(recording):
+    """
+    Создаёт mne.io.Raw из результата annotate_edf без записи на диск.
+    Если в памяти сигналы всех каналов - RawArray по ним; иначе (annotate_edf декодирует только
+    каналы этапов обработки) исходный файл открывается без preload, и каналы читаются по мере отрисовки.
+    """
+    signals = recording.get('signals')
+    if signals is not None and len(signals) == len(recording['signal_labels']):
+        data = signals_to_volts(signals, recording['signal_headers'])
+        info = mne.create_info(ch_names=list(recording['signal_labels']), sfreq=recording['sfreq'], ch_types='eeg')
+        raw = mne.io.RawArray(data, info, verbose=False)
+    else:
+        raw = mne.io.read_raw_edf(recording['file_path'], preload=False, verbose=False)
+    onsets, durations, descriptions = zip(*recording['annotations']) if recording['annotations'] else ([], [], [])
+    raw.set_annotations(mne.Annotations(onsets, durations, descriptions))
+    return raw
+
+
+class SaveWorker(QThread):
+    """
+    Фоновая запись EDF-файла с аннотациями.\n
+    Записи данных исходного файла копируются без декодирования,
+    заново формируется только аннотационный канал EDF+.
+    """
+    progress = pyqtSignal(int, int)
+    finished_saving = pyqtSignal(bool, str)
+
+    def __init__(self, recording, annotations, file_path):
+        super().__init__()
+        self.recording = recording
+        self.annotations = annotations
+        self.file_path = file_path
+
+    def run(self):
+        success = save_annotations_streaming(
+            self.recording['file_path'],
+            self.file_path,
+            self.annotations,
+            progress_callback=self.progress.emit,
+            atomic=True
+        )
+        self.finished_saving.emit(bool(success), self.file_path)
 
 class MainWindow(QMainWindow):
     file_path = "" # Пуль к файлу
     step_size = 1   
-    def __init__(self):
+    def __init__(self, profile_mode=None):
         """
         Инициализация окна, отрисовка основных эл-тов интерфейса
+
+        Параметры:
+            profile_mode (str): Режим профилирования обработки файла (cprofile | sampling); None - выключено.
         """
         super().__init__()
+        self.profile_mode = profile_mode
         self.setWindowTitle("Классификация ЭКоГ по EDF") # Имя окна
         self.setWindowIcon(QIcon("rat.ico")) # Иконка для окна
         self.setMinimumSize(1024, 768) # Минимальный размер
         self.showMaximized() # Разворачиет окно на весь экран (в окне)
 
         self.raw = None # Наполнитель для данных с EDF
+        self.recording = None # Результат annotate_edf (сигналы и аннотации в памяти)
+        self.save_worker = None # Поток фонового сохранения
+        self.save_progress = None # Индикатор прогресса сохранения
         self.predictions = None # Наполнитель для предсказания
+        self.pyramid = None # Min/max-огибающая для отрисовки при отдалении
+        self.window_width = 10 # Ширина видимого окна, сек.
+        self.y_limit = 1.5 # Предел оси Y для нормализованных каналов
 
         # Верхний лейбл (информационный)
         self.label_info = QLabel('Файл формата .edf не загружен', self)
@@ -123,34 +179,17 @@ class MainWindow(QMainWindow):
         control_panel = QWidget()
         control_panel.setLayout(control_layout)
 
-        # График
-        self.figure, self.ax = plt.subplots(figsize=(10, 6))
-        self.ax.axis('off') # Убираем отображение осей для большого графика
-        self.canvas = FigureCanvas(self.figure) # КАНВАС
-
-        # Разделение на три оси
-        self.ax1 = self.figure.add_subplot(3, 1, 1, position=[0.05, 0.7, 0.9, 0.25])
-        self.ax2 = self.figure.add_subplot(3, 1, 2, position=[0.05, 0.4, 0.9, 0.25])
-        self.ax3 = self.figure.add_subplot(3, 1, 3, position=[0.05, 0.1, 0.9, 0.25])
-
-        # Включаем отображение для осей
-        for ax in [self.ax1, self.ax2, self.ax3]:
-            ax.axis('on')
-
-        # Установка цвета для каждого канала
+        # Установка цвета для каждого канала и маркеров
         self.channel_colors = ['red', 'green', 'blue']
+        self.marker_colors = {'is': 'orange', 'swd': 'purple', 'ds': 'teal'}
 
-        # Слайдер
-        self.slider_ax = self.figure.add_axes([0.1, 0.02, 0.8, 0.04], facecolor='lightgoldenrodyellow')
-        # Изначально макс. размер указывается на 0, после загрузки файла,
-        # в зависимости от файлаУстанавливается размер слайдера
-        self.slider = Slider(self.slider_ax, 'Время, сек.', 0, 0, valinit=0, valstep=1)
-        self.slider.on_changed(self.update_plot)
+        # График
+        plot_widget = self.init_canvas()
 
         # Разделитель
         splitter = QSplitter()
         splitter.addWidget(control_panel)
-        splitter.addWidget(self.canvas)
+        splitter.addWidget(plot_widget)
         splitter.setStretchFactor(0, 1)
         splitter.setStretchFactor(1, 5)
 
@@ -164,6 +203,40 @@ class MainWindow(QMainWindow):
         container.setLayout(main_layout)
         self.setCentralWidget(container)
 
+    def init_canvas(self):
+        """
+        Создание области графиков (matplotlib): три канала,
+        обзорная полоса и слайдер. Возвращает виджет для разделителя.
+        """
+        # График
+        self.figure, self.ax = plt.subplots(figsize=(10, 6))
+        self.ax.axis('off') # Убираем отображение осей для большого графика
+        self.canvas = FigureCanvas(self.figure) # КАНВАС
+
+        # Разделение на три оси
+        self.ax1 = self.figure.add_subplot(3, 1, 1, position=[0.05, 0.73, 0.9, 0.22])
+        self.ax2 = self.figure.add_subplot(3, 1, 2, position=[0.05, 0.47, 0.9, 0.22])
+        self.ax3 = self.figure.add_subplot(3, 1, 3, position=[0.05, 0.21, 0.9, 0.22])
+
+        # Включаем отображение для осей
+        for ax in [self.ax1, self.ax2, self.ax3]:
+            ax.axis('on')
+
+        # Обзорная полоса всей записи (огибающая + плотность маркеров)
+        self.ax_overview = self.figure.add_axes([0.05, 0.08, 0.9, 0.08])
+        self.ax_overview_markers = self.ax_overview.twinx()
+        self.overview_span = None
+        self.canvas.mpl_connect('button_press_event', self.on_overview_click)
+
+        # Слайдер
+        self.slider_ax = self.figure.add_axes([0.1, 0.01, 0.8, 0.03], facecolor='lightgoldenrodyellow')
+        # Изначально макс. размер указывается на 0, после загрузки файла,
+        # в зависимости от файлаУстанавливается размер слайдера
+        self.slider = Slider(self.slider_ax, 'Время, сек.', 0, 0, valinit=0, valstep=1)
+        self.slider.on_changed(self.update_plot)
+
+        return self.canvas
+
     def zoom_in_height(self):
         self.adjust_axes(scale_x=1.0, scale_y=1.2)
 
@@ -190,21 +263,20 @@ class MainWindow(QMainWindow):
         scale_y : float
             Коэффициент масштабирования по оси Y.
         """
-        for ax in [self.ax1, self.ax2, self.ax3]:
-            xlim = ax.get_xlim()
-            ylim = ax.get_ylim()
-
-            # Вычисление новых пределов
-            new_xlim = [(xlim[0] + (xlim[1] - xlim[0]) * (1 - scale_x) / 2),
-                        (xlim[1] - (xlim[1] - xlim[0]) * (1 - scale_x) / 2)]
-            new_ylim = [(ylim[0] + (ylim[1] - ylim[0]) * (1 - scale_y) / 2),
-                        (ylim[1] - (ylim[1] - ylim[0]) * (1 - scale_y) / 2)]
+        self.y_limit = self.y_limit * scale_y
+        if self.raw is None:
+            return
 
-            ax.set_xlim(new_xlim)
-            ax.set_ylim(new_ylim)
+        # Ширина окна меняется вокруг его центра, данные перерисовываются
+        # под новую ширину (при отдалении - через огибающую)
+        total_duration = self.raw.times[-1]
+        center = self.slider.val + self.window_width / 2
+        self.window_width = min(max(self.window_width * scale_x, 1), max(total_duration, 1))
+        new_start = min(max(0, center - self.window_width / 2), max(0, total_duration - self.window_width))
 
-        # Обновление графика
-        self.canvas.draw()
+        self.set_slider_range(max(0, total_duration - self.window_width))
+        self.slider.set_val(new_start)
+        self.update_plot(new_start)
 
     def load_file(self):
         """
@@ -219,25 +291,30 @@ class MainWindow(QMainWindow):
             # Обновление лейбла с информацией о загружаемом файле
             self.label_info.setText(f"Загрузка файла: {os.path.basename(self.file_path)}...")
 
-            # Вызываем функцию annotate_edf
-            status = annotate_edf(self.file_path)
+            # Вызываем функцию annotate_edf: сигналы и аннотации возвращаются в памяти
+            profiler = profile_run(os.path.basename(self.file_path), mode=self.profile_mode) if self.profile_mode else nullcontext([])
+            with profiler as profile_paths:
+                status, self.recording = annotate_edf(self.file_path)
+            if profile_paths:
+                print(f"Профиль обработки сохранён: {', '.join(profile_paths)}")
 
             # Проверяем статус выполнения
             if status == "success":
                 try:
-                    file_name, file_extension = os.path.splitext(self.file_path)
-                    self.raw = process_edf(f"{file_name}_annotated{file_extension}")
+                    self.raw = recording_to_raw(self.recording)
                     self.label_info.setText(f"Загруженный файл: {os.path.basename(self.file_path)}")
 
+                    # Огибающая строится один раз на файл и берётся из кэша
+                    self.pyramid = MinMaxPyramid.cached(self.file_path, self.raw)
+
                     total_duration = self.raw.times[-1]
-                    max_time = max(0, total_duration - 10)
+                    max_time = max(0, total_duration - self.window_width)
 
-                    self.slider.valmin = 0
-                    self.slider.valmax = max_time
+                    self.set_slider_range(max_time)
                     self.slider.set_val(0)
-                    self.slider.ax.set_xlim(0, max_time)
 
                     self.init_plot()
+                    self.plot_overview()
                     self.update_annotation_list()
 
                     self.button_save.setEnabled(True)
@@ -286,6 +363,7 @@ class MainWindow(QMainWindow):
                         self.annotation_list.item(index).setText(updated_item_text)
 
                         # Обновляем графическое отображение
+                        self.plot_overview_markers()
                         self.plot_annotations()
                     except ValueError:
                         QMessageBox.warning(self, "Ошибка ввода", "Неправильный формат времени. Введите время в формате HH:MM:SS.")
@@ -296,6 +374,8 @@ class MainWindow(QMainWindow):
         """
         # Очищаем текущий список аннотаций
         self.annotation_list.clear()
+        # Плотность маркеров на обзорной полосе зависит от списка аннотаций
+        self.plot_overview_markers()
         # Проверяем, существуют ли аннотации в raw-данных
         if not self.raw.annotations or len(self.raw.annotations) == 0:
             return  # Если аннотаций нет, завершаем выполнение функции
@@ -326,7 +406,14 @@ class MainWindow(QMainWindow):
 
         # Определение области видимого времени
         start_time = self.slider.val
-        end_time = start_time + 10
+        end_time = start_time + self.window_width
+
+        # Текущее окно на обзорной полосе
+        if self.overview_span is not None:
+            self.overview_span.remove()
+            self.overview_span = None
+        if self.pyramid is not None:
+            self.overview_span = self.ax_overview.axvspan(start_time, end_time, color='gold', alpha=0.4)
         # Добавление аннотации для видимых временных меток
         for onset, description in zip(self.raw.annotations.onset, self.raw.annotations.description):
             if start_time <= onset <= end_time:
@@ -335,7 +422,7 @@ class MainWindow(QMainWindow):
 
                 # Создаем вертикальную линию через всю высоту фигуры
                 line = plt.Line2D(
-                    [x_coord, x_coord], [0.08, 0.96],  # Используем пропорции Figure по оси Y
+                    [x_coord, x_coord], [0.19, 0.96],  # Используем пропорции Figure по оси Y (над обзорной полосой)
                     color="purple", linestyle="--", zorder=10,
                     transform=self.figure.transFigure  # Преобразование по Figure, чтобы покрыть все оси
                 )
@@ -440,18 +527,111 @@ class MainWindow(QMainWindow):
         onset_time_str = text.split(" - ")[1]
         hours, minutes, seconds = map(int, onset_time_str.split(":"))
         onset_time = hours * 3600 + minutes * 60 + seconds
-        # Определяем временные границы окна отображения (10 секунд)
-        window_width = 10
+        # Определяем временные границы окна отображения
+        window_width = self.window_width
         start_time = max(0, onset_time - window_width / 2)
         end_time = start_time + window_width
         # Обновляем положение слайдера и оси графика
         self.slider.set_val(start_time)
-        self.ax.set_xlim(start_time, end_time)
-        self.ax.set_ylim(-20, 20)
         # Обновляем график
         self.update_plot(start_time)
         self.button_edit_annotation.setEnabled(True)
 
+    def plot_overview(self):
+        """
+        Отрисовка огибающей всей записи на обзорной полосе.\n
+        Данные берутся из кэшированной пирамиды, EDF повторно не читается.
+        """
+        self.ax_overview.clear()
+        self.overview_span = None
+        if self.pyramid is None:
+            return
+
+        times, mins, maxs = self.pyramid.overview()
+        # Для обзора используется огибающая первого канала
+        self.ax_overview.fill_between(times, mins[0], maxs[0], color=self.channel_colors[0], linewidth=0)
+        self.ax_overview.set_xlim(0, self.pyramid.n_times / self.pyramid.sfreq)
+        self.ax_overview.set_yticks([])
+        self.ax_overview.xaxis.set_major_formatter(plt.FuncFormatter(lambda x, _: seconds_to_hms(x)))
+        self.ax_overview.tick_params(axis='x', labelsize=8)
+
+    def plot_overview_markers(self):
+        """
+        Гистограмма плотности маркеров IS/SWD/DS на обзорной полосе.
+        """
+        self.ax_overview_markers.clear()
+        self.ax_overview_markers.set_yticks([])
+        if self.raw is None or self.pyramid is None:
+            return
+
+        duration = self.pyramid.n_times / self.pyramid.sfreq
+        bins = np.linspace(0, duration, 201)
+        onsets = np.asarray(self.raw.annotations.onset)
+        descriptions = np.asarray(self.raw.annotations.description)
+        for marker_type, color in self.marker_colors.items():
+            mask = np.char.startswith(descriptions.astype(str), marker_type) if len(descriptions) else []
+            if not np.any(mask):
+                continue
+            counts, _ = np.histogram(onsets[mask], bins=bins)
+            self.ax_overview_markers.stairs(counts, bins, color=color, label=marker_type.upper())
+        self.ax_overview_markers.set_xlim(0, duration)
+        self.canvas.draw_idle()
+
+    def on_overview_click(self, event):
+        """
+        Переход к месту записи по клику на обзорной полосе.\n
+        Использует тот же путь отрисовки окна, что и слайдер.
+        """
+        if self.raw is None or event.xdata is None:
+            return
+        if event.inaxes not in (self.ax_overview, self.ax_overview_markers):
+            return
+        start_time = min(max(0, event.xdata - self.window_width / 2), self.slider.valmax)
+        self.slider.set_val(start_time)
+
+    def set_slider_range(self, max_time):
+        """
+        Устанавливает диапазон слайдера [0, max_time].
+        """
+        self.slider.valmin = 0
+        self.slider.valmax = max_time
+        self.slider.ax.set_xlim(0, max_time)
+
+    def get_view_width_px(self):
+        """
+        Ширина области отрисовки канала в пикселях.
+        """
+        return self.canvas.width() * self.ax1.get_position().width
+
+    def get_view_data(self, start_time, end_time):
+        """
+        Возвращает данные каналов для отображаемого интервала.\n
+        Если на один пиксель приходится больше LOD_THRESHOLD отсчётов,
+        вместо сырых данных возвращается min/max-огибающая из кэша,
+        поэтому объём отрисовки зависит только от ширины экрана.
+
+        start_time : float
+            Начало интервала, сек.
+        end_time : float
+            Конец интервала, сек.
+        """
+        width_px = self.get_view_width_px()
+        if self.pyramid is not None and \
+                self.pyramid.samples_per_pixel(start_time, end_time, width_px) > LOD_THRESHOLD:
+            times, mins, maxs = self.pyramid.envelope(start_time, end_time, width_px)
+            return interleave_envelope(times, mins, maxs)
+
+        # Переводим время в сэмплы с учётом границ записи
+        sfreq = self.raw.info['sfreq']
+        start_sample = max(int(start_time * sfreq), 0)
+        end_sample = min(int(end_time * sfreq), self.raw.n_times)
+        if start_sample >= end_sample:
+            return np.empty(0), np.empty((0, 0))
+
+        times = self.raw.times[start_sample:end_sample]
+        channels = self.raw.get_data(start=start_sample, stop=end_sample)
+        return times, channels
+
     def init_plot(self):
         """
         Инициализация графика и отрисовка данных каналов ЭКоГ.
@@ -460,13 +640,8 @@ class MainWindow(QMainWindow):
         for ax in [self.ax1, self.ax2, self.ax3]:
             ax.clear()
 
-        # Получаем частоту дискретизации сигнала (sfreq) и определяем начальные и конечные сэмплы (10 секунд)
-        sfreq = self.raw.info['sfreq']
-        start_sample = 0
-        end_sample = int(10 * sfreq)
-        # Извлекаем данные каналов и временные метки
-        channels = self.raw.get_data(start=start_sample, stop=end_sample)
-        times = self.raw.times[start_sample:end_sample]
+        # Извлекаем данные каналов и временные метки для первого окна
+        times, channels = self.get_view_data(0, self.window_width)
         # Получаем имена каналов и отображаем данные на графике
         channel_names = self.raw.ch_names[:len(channels)]
         for i, ax in enumerate([self.ax1, self.ax2, self.ax3]):
@@ -477,7 +652,7 @@ class MainWindow(QMainWindow):
                 ax.plot(times, norm_channel, label=channel_names[i], color=self.channel_colors[i])
                 # Устанавливаем границы оси X и Y
                 ax.set_xlim(times[0], times[-1])
-                ax.set_ylim(-1.5, 1.5)
+                ax.set_ylim(-self.y_limit, self.y_limit)
                 # Добавляем заголовок и форматируем ось X
                 ax.set_title(f"Канал {channel_names[i]}")
                 ax.xaxis.set_major_formatter(plt.FuncFormatter(lambda x, _: seconds_to_hms(x)))
@@ -496,24 +671,14 @@ class MainWindow(QMainWindow):
             Текущее значение слайдера, определяющее\n
             начало отображаемого интервала времени.
         """
-        # Определяем начальное и конечное время отображаемого интервала (10 секунд)
+        # Определяем начальное и конечное время отображаемого интервала
         start_time = self.slider.val
-        end_time = start_time + 10
-        # Получаем частоту дискретизации (sfreq) и переводим время в сэмплы
-        sfreq = self.raw.info['sfreq']
-        start_sample = int(start_time * sfreq)
-        end_sample = int(end_time * sfreq)
-        # Проверяем, чтобы конечный сэмпл не выходил за пределы данных
-        if end_sample > self.raw.n_times:
-            end_sample = self.raw.n_times
-
-        # Если начальный сэмпл больше или равен конечному, выходим из функции
-        if start_sample >= end_sample:
+        end_time = start_time + self.window_width
+        # Извлекаем временные метки и данные каналов для текущего интервала
+        times, channels = self.get_view_data(start_time, end_time)
+        if len(times) == 0:
             return
 
-        # Извлекаем временные метки и данные каналов для текущего интервала
-        times = self.raw.times[start_sample:end_sample]
-        channels = self.raw.get_data(start=start_sample, stop=end_sample)
         # Обновляем каждый из трёх графиков
         for i, ax in enumerate([self.ax1, self.ax2, self.ax3]):
             if i < len(channels):
@@ -524,7 +689,7 @@ class MainWindow(QMainWindow):
                 ax.plot(times, norm_channel, label=self.raw.ch_names[i], color=self.channel_colors[i])
                 # Устанавливаем границы осей
                 ax.set_xlim(times[0], times[-1])
-                ax.set_ylim(-1.5, 1.5)
+                ax.set_ylim(-self.y_limit, self.y_limit)
                 # Форматируем ось X для отображения времени в формате "часы:минуты:секунды"
                 ax.xaxis.set_major_formatter(plt.FuncFormatter(lambda x, _: seconds_to_hms(x)))
                 # Добавляем легенду и включаем сетку
@@ -535,43 +700,59 @@ class MainWindow(QMainWindow):
         self.plot_annotations()
 
     def save_file(self):
-        if self.raw is not None:
-            # Получаем путь для сохранения файла
-            file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить аннотации", self.file_path, "Все файлы (*.*)")
+        """
+        Сохраняет текущие аннотации в выбранный файл.\n
+        Запись выполняется в фоновом потоке с индикатором прогресса,
+        сигналы переносятся из исходного файла без перекодирования.
+        """
+        if self.raw is None or self.recording is None:
+            return
+        if self.save_worker is not None and self.save_worker.isRunning():
+            QMessageBox.information(self, "Сохранение", "Предыдущее сохранение ещё не завершено.")
+            return
 
-            if file_path:
-                # Получаем имя файла и расширение из пути
-                base_name, extension = os.path.splitext(file_path)
-                annotated_file_path = f"{base_name}_annotated{extension}"
+        # Получаем путь для сохранения файла
+        base_name, extension = os.path.splitext(self.file_path)
+        file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить аннотации", f"{base_name}_annotated{extension}", "Все файлы (*.*)")
+        if not file_path:
+            return
 
-                # Удаляем файл с аннотациями, если он уже существует
-                if os.path.exists(annotated_file_path):
-                    try:
-                        os.remove(annotated_file_path)
-                        print(f"Файл {annotated_file_path} был удалён.")
-                    except Exception as e:
-                        QMessageBox.warning(self, "Предупреждение", f"Не удалось удалить старый файл с аннотациями: {str(e)}")
-                        print(f"Ошибка при удалении файла: {e}")
-
-                # Проверяем, совпадает ли путь с исходным файлом с аннотациями
-                if file_path == annotated_file_path:
-                    # Если файл с аннотациями уже существует, перезаписываем его
-                    try:
-                        self.raw.save(annotated_file_path, overwrite=True)  # Сохраняем файл с аннотациями
-                        QMessageBox.information(self, "Успех", f"Аннотации успешно перезаписаны в {annotated_file_path}")
-                    except Exception as e:
-                        QMessageBox.critical(self, "Ошибка", f"Не удалось перезаписать файл с аннотациями: {str(e)}")
-                        print(f"Ошибка при сохранении: {e}")
-                else:
-                    # Если путь отличается, перемещаем файл с аннотациями в новое место
-                    try:
-                        # Перемещаем файл с аннотациями в новое место
-                        shutil.move(self.file_path, annotated_file_path)
-                        QMessageBox.information(self, "Успех", f"Аннотации успешно перемещены в {annotated_file_path}")
-                    except Exception as e:
-                        QMessageBox.critical(self, "Ошибка", f"Не удалось переместить файл с аннотациями: {str(e)}")
-                        print(f"Ошибка при перемещении: {e}")
-        os.remove("annotated_is_file.edf")
+        annotations = [
+            (float(onset), float(duration), str(description))
+            for onset, duration, description in zip(
+                self.raw.annotations.onset, self.raw.annotations.duration, self.raw.annotations.description
+            )
+        ]
+
+        self.button_save.setEnabled(False)
+        self.label_info.setText(f"Сохранение: {os.path.basename(file_path)}...")
+        self.save_progress = QProgressDialog("Сохранение аннотаций...", None, 0, 100, self)
+        self.save_progress.setWindowModality(Qt.NonModal)
+        self.save_progress.setMinimumDuration(500)
+        self.save_worker = SaveWorker(self.recording, annotations, file_path)
+        self.save_worker.progress.connect(self.on_save_progress)
+        self.save_worker.finished_saving.connect(self.on_save_finished)
+        self.save_worker.start()
+
+    def on_save_progress(self, done, total):
+        """
+        Обновление индикатора прогресса сохранения (в записях данных EDF).
+        """
+        self.save_progress.setMaximum(total)
+        self.save_progress.setValue(done)
+
+    def on_save_finished(self, success, file_path):
+        """
+        Вызывается в потоке интерфейса после завершения фонового сохранения.
+        """
+        self.button_save.setEnabled(True)
+        self.save_progress.close()
+        if success:
+            self.label_info.setText(f"Загруженный файл: {os.path.basename(self.file_path)}")
+            QMessageBox.information(self, "Успех", f"Аннотации успешно сохранены в {file_path}")
+        else:
+            self.label_info.setText(f"Ошибка при сохранении: {os.path.basename(file_path)}")
+            QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить файл с аннотациями: {file_path}")
 
     def keyPressEvent(self, event):
             """
@@ -648,7 +829,51 @@ class MainWindow(QMainWindow):
             self.setStyleSheet("")
             self.button_toggle_theme.setText('Сменить тему')
 
-app = QApplication([]) 
-window = MainWindow()
-window.show()
-app.exec_()
+def select_window_class(argv):
+    """
+    Выбор бэкенда отрисовки при запуске.\n
+    Бэкенд задаётся флагом --backend (matplotlib | pyqtgraph) или
+    переменной окружения ECOG_PLOT_BACKEND. Если pyqtgraph не установлен,
+    выводится предупреждение и используется matplotlib.
+    """
+    backend = os.environ.get("ECOG_PLOT_BACKEND", "matplotlib")
+    for i, arg in enumerate(argv):
+        if arg == "--backend" and i + 1 < len(argv):
+            backend = argv[i + 1]
+        elif arg.startswith("--backend="):
+            backend = arg.split("=", 1)[1]
+
+    if backend == "pyqtgraph":
+        try:
+            from pg_view import PgMainWindow
+            return PgMainWindow
+        except ImportError as e:
+            message = (f"Бэкенд pyqtgraph недоступен: {e}.\n"
+                       "Установите пакет командой 'pip install pyqtgraph'. Используется matplotlib.")
+            print(message)
+            QMessageBox.warning(None, "Бэкенд отрисовки", message)
+    return MainWindow
+
+
+def select_profile_mode(argv):
+    """
+    Режим профилирования обработки файла при загрузке.\n
+    Задаётся флагом --profile (cprofile | sampling) или переменной окружения
+    ECOG_PROFILE; результаты пишутся в ECOG_PROFILE_DIR (по умолчанию data/profiles).
+    """
+    mode = profile_mode_from_env()
+    for i, arg in enumerate(argv):
+        if arg == "--profile":
+            following = argv[i + 1] if i + 1 < len(argv) and not argv[i + 1].startswith("--") else "cprofile"
+            mode = normalize_profile_mode(following)
+        elif arg.startswith("--profile="):
+            mode = normalize_profile_mode(arg.split("=", 1)[1])
+    return mode
+
+
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+    # Режим профилирования передаётся окну явно: pg_view импортирует модуль app заново
+    window = select_window_class(sys.argv)(profile_mode=select_profile_mode(sys.argv))
+    window.show()
+    app.exec_()
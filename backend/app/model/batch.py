@@ -0,0 +1,292 @@
+# batch.py
+#
+# Пакетная аннотация EDF-файлов без графического интерфейса.
+#
+# Запуск из директории backend/app:
+#     python -m model.batch "D:/recordings/*.edf" --output D:/annotated --workers 8
+#     python -m model.batch D:/recordings --output D:/annotated
+#     python -m model.batch D:/recordings --output D:/annotated --chunk-seconds 600   # записи больше памяти
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from .edf_stream import save_annotations_streaming
+from .feature_cache import FEATURE_CACHE_DIR, file_sha256
+from .detector_cache import DETECTOR_CACHE_DIR
+from .main import annotate_edf
+from .chunked import annotate_edf_chunked
+from .model_utils import load_model_file
+from .profiling import PROFILE_MODES, profile_run
+
+MANIFEST_NAME = "manifest.json"
+
+# Модель загружается один раз в каждом процессе-обработчике
+_worker_model = None
+# Хэш файла модели - часть ключа кэша вероятностей классов
+_worker_model_hash = None
+
+
+def collect_files(pattern):
+    """
+    Собирает список EDF-файлов по директории или glob-шаблону.
+
+    Параметры:
+        pattern (str): Путь к директории или glob-шаблон.
+
+    Возвращает:
+        list: Отсортированный список абсолютных путей.
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.edf")
+    files = glob.glob(pattern, recursive=True)
+    files = [f for f in files if f.lower().endswith(".edf") and not f.lower().endswith("_annotated.edf")]
+    return sorted(os.path.abspath(f) for f in files)
+
+
+def load_manifest(manifest_path):
+    """
+    Загружает манифест предыдущего запуска или возвращает пустой.
+    """
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Не удалось прочитать манифест {manifest_path}: {e}. Начинаем заново.")
+    return {"files": {}}
+
+
+def save_manifest(manifest, manifest_path):
+    """
+    Атомарно сохраняет манифест (запись во временный файл и переименование).
+    """
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def common_root(files):
+    """
+    Общая директория входных файлов: относительно неё структура поддиректорий
+    повторяется в директории результатов.
+
+    Параметры:
+        files (list): Абсолютные пути к файлам.
+
+    Возвращает:
+        str: Общая директория или None, если файлов нет или они на разных дисках.
+    """
+    if not files:
+        return None
+    try:
+        return os.path.commonpath([os.path.dirname(f) for f in files])
+    except ValueError:
+        return None
+
+
+def output_path_for(file_path, output_dir, root=None):
+    """
+    Путь итогового файла: <output_dir>/<путь относительно root>/<имя>_annotated.edf.
+    Без root файл кладётся прямо в output_dir. Рекурсивный шаблон находит одноимённые файлы
+    в разных поддиректориях (a/rec.edf и b/rec.edf), поэтому run_batch передаёт общую
+    директорию входных файлов, и результаты не перезаписывают друг друга.
+    """
+    relative = os.path.relpath(file_path, root) if root else os.path.basename(file_path)
+    name, extension = os.path.splitext(relative)
+    return os.path.join(output_dir, f"{name}_annotated{extension}")
+
+
+def _init_worker(model_path, threads):
+    """
+    Инициализация процесса-обработчика: ограничение потоков TF и загрузка модели.
+    """
+    global _worker_model, _worker_model_hash
+    import tensorflow as tf
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    _worker_model = load_model_file(model_path)
+    _worker_model_hash = file_sha256(model_path) if _worker_model is not None else None
+
+
+def _process_file(file_path, output_path, profile=None, profile_dir=None, feature_cache_dir=FEATURE_CACHE_DIR,
+                  detector_cache_dir=DETECTOR_CACHE_DIR, chunk_seconds=None):
+    """
+    Аннотирует один файл в процессе-обработчике и сохраняет результат.
+    При profile='cprofile'|'sampling' прогон профилируется, файлы профиля пишутся в profile_dir.
+    Признаки и промежуточные данные детекторов берутся из кэшей feature_cache_dir
+    и detector_cache_dir (None - без кэша).
+    При chunk_seconds запись обрабатывается блоками этой длительности (annotate_edf_chunked).
+
+    Возвращает:
+        dict: Статус, длительность записи и время этапов.
+    """
+    started = time.perf_counter()
+    if _worker_model is None:
+        return {"status": "failed", "error": "Модель не загружена"}
+
+    profiler = profile_run(os.path.basename(file_path), mode=profile, output_dir=profile_dir) if profile else nullcontext([])
+    with profiler as profile_paths:
+        if chunk_seconds:
+            status, recording = annotate_edf_chunked(file_path, model=_worker_model, chunk_seconds=chunk_seconds,
+                                                     feature_cache_dir=feature_cache_dir,
+                                                     detector_cache_dir=detector_cache_dir,
+                                                     model_hash=_worker_model_hash)
+        else:
+            status, recording = annotate_edf(file_path, model=_worker_model, feature_cache_dir=feature_cache_dir,
+                                             detector_cache_dir=detector_cache_dir, model_hash=_worker_model_hash)
+        annotated = time.perf_counter()
+        if status != "success":
+            return {"status": "failed", "error": status, "annotate_seconds": annotated - started}
+
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        if not save_annotations_streaming(file_path, output_path, recording["annotations"]):
+            return {"status": "failed", "error": "Не удалось сохранить файл", "annotate_seconds": annotated - started}
+        finished = time.perf_counter()
+
+    result = {
+        "status": "done",
+        "output": output_path,
+        "recording_hours": recording["n_samples"] / recording["sfreq"] / 3600,
+        "annotations": len(recording["annotations"]),
+        "annotate_seconds": annotated - started,
+        "save_seconds": finished - annotated,
+        "total_seconds": finished - started,
+    }
+    if profile_paths:
+        result["profile"] = profile_paths
+    return result
+
+
+def run_batch(pattern, output_dir, workers=None, model_path=None, threads=1, retry_failed=True,
+              profile=None, profile_dir=None, feature_cache_dir=FEATURE_CACHE_DIR,
+              detector_cache_dir=DETECTOR_CACHE_DIR, chunk_seconds=None):
+    """
+    Аннотирует все файлы по шаблону на пуле процессов с возобновляемым манифестом.
+
+    Параметры:
+        pattern (str): Директория или glob-шаблон EDF-файлов.
+        output_dir (str): Директория для аннотированных файлов и манифеста.
+        workers (int): Количество процессов (по умолчанию - число ядер).
+        model_path (str): Путь к файлу модели.
+        threads (int): Потоков TensorFlow на процесс.
+        retry_failed (bool): Повторять файлы, завершившиеся ошибкой в прошлом запуске.
+        profile (str): 'cprofile' или 'sampling' - профилировать обработку каждого файла.
+        profile_dir (str): Директория для файлов профиля (по умолчанию <output_dir>/profiles).
+        feature_cache_dir (str): Директория кэша признаков; None - пересчитывать признаки.
+        detector_cache_dir (str): Директория кэша промежуточных данных SWD/DS; None - без кэша.
+        chunk_seconds (int): Обрабатывать записи блоками этой длительности, сек. (None - целиком в памяти).
+
+    Возвращает:
+        dict: Итоговый манифест.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    files = collect_files(pattern)
+    root = common_root(files)
+
+    # Пропускаем файлы, уже обработанные в предыдущих запусках
+    pending = []
+    for file_path in files:
+        entry = manifest["files"].get(file_path)
+        if entry and entry.get("status") == "done" and os.path.exists(entry.get("output", "")):
+            continue
+        if entry and entry.get("status") == "failed" and not retry_failed:
+            continue
+        pending.append(file_path)
+
+    print(f"Файлов найдено: {len(files)}, к обработке: {len(pending)}")
+    if not pending:
+        return manifest
+
+    workers = workers or os.cpu_count() or 1
+    model_path = model_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "cnn_classifier.h5")
+    if profile:
+        profile_dir = profile_dir or os.path.join(output_dir, "profiles")
+
+    started = time.perf_counter()
+    processed_hours = 0.0
+    done_count = 0
+    failed_count = 0
+    # spawn: TensorFlow не переносит fork после инициализации
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(model_path, threads)) as pool:
+        futures = {
+            pool.submit(_process_file, file_path, output_path_for(file_path, output_dir, root), profile, profile_dir,
+                        feature_cache_dir, detector_cache_dir, chunk_seconds): file_path
+            for file_path in pending
+        }
+        for future in as_completed(futures):
+            file_path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"status": "failed", "error": str(e)}
+
+            result["finished_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            manifest["files"][file_path] = result
+            save_manifest(manifest, manifest_path)
+
+            if result["status"] == "done":
+                done_count += 1
+                processed_hours += result["recording_hours"]
+                print(f"[{done_count + failed_count}/{len(pending)}] {os.path.basename(file_path)}: "
+                      f"{result['recording_hours']:.2f} ч. записи за {result['total_seconds']:.1f} с")
+            else:
+                failed_count += 1
+                print(f"[{done_count + failed_count}/{len(pending)}] {os.path.basename(file_path)}: ошибка - {result['error']}")
+
+    wall_minutes = (time.perf_counter() - started) / 60
+    throughput = processed_hours / wall_minutes if wall_minutes > 0 else 0.0
+    print(f"Готово: {done_count}, с ошибкой: {failed_count}. "
+          f"Обработано {processed_hours:.2f} ч. записи за {wall_minutes:.2f} мин. "
+          f"({throughput:.2f} ч. записи / мин.)")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная аннотация EDF-файлов (IS, SWD, DS)")
+    parser.add_argument("input", help="Директория с EDF-файлами или glob-шаблон")
+    parser.add_argument("--output", "-o", required=True, help="Директория для аннотированных файлов и манифеста")
+    parser.add_argument("--workers", "-j", type=int, default=None, help="Количество процессов (по умолчанию - число ядер)")
+    parser.add_argument("--model", default=None, help="Путь к cnn_classifier.h5 (или модели, сохранённой joblib)")
+    parser.add_argument("--threads-per-worker", type=int, default=1, help="Потоков TensorFlow на процесс")
+    parser.add_argument("--skip-failed", action="store_true", help="Не повторять файлы, завершившиеся ошибкой ранее")
+    parser.add_argument("--profile", choices=PROFILE_MODES, default=None,
+                        help="Профилировать обработку каждого файла (cProfile или выборка стеков) и tracemalloc")
+    parser.add_argument("--profile-dir", default=None, help="Директория для файлов профиля (по умолчанию <output>/profiles)")
+    parser.add_argument("--feature-cache-dir", default=FEATURE_CACHE_DIR,
+                        help="Кэш признаков: при смене модели фильтрация и извлечение признаков пропускаются")
+    parser.add_argument("--no-feature-cache", action="store_true", help="Всегда пересчитывать признаки")
+    parser.add_argument("--detector-cache-dir", default=DETECTOR_CACHE_DIR,
+                        help="Кэш огибающих и таблиц пиков SWD/DS для повторной детекции (model.redetect)")
+    parser.add_argument("--no-detector-cache", action="store_true", help="Не сохранять промежуточные данные детекторов")
+    parser.add_argument("--chunk-seconds", type=int, default=None,
+                        help="Обрабатывать записи блоками этой длительности, сек. (для записей больше памяти)")
+    args = parser.parse_args(argv)
+
+    run_batch(
+        args.input,
+        args.output,
+        workers=args.workers,
+        model_path=args.model,
+        threads=args.threads_per_worker,
+        retry_failed=not args.skip_failed,
+        profile=args.profile,
+        profile_dir=args.profile_dir,
+        feature_cache_dir=None if args.no_feature_cache else args.feature_cache_dir,
+        detector_cache_dir=None if args.no_detector_cache else args.detector_cache_dir,
+        chunk_seconds=args.chunk_seconds
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+# chunked.py
+#
+# Аннотация записей, не помещающихся в память (например, недельных многоканальных).
+# EDF читается блоками по CHUNK_SECONDS, пиковая память зависит от длины блока, а не записи:
+# Блок читается с частотой записи и передискретизируется (resample_segment) к частоте модели
+# для IS и SWD; DS получает сигналы с частотой записи и прореживает их сам.
+#   IS  - OnlineFeatureExtractor переносит состояние фильтра между блоками и собирает окна,
+#         пересекающие границу блоков, - признаки совпадают с extract_features;
+#   SWD - фильтр и огибающая считаются по блоку с запасом CHUNK_HALO_SECONDS с каждой стороны
+#         (переходный процесс FIR-фильтра и краевые эффекты преобразования Гильберта),
+#         огибающая и таблица пиков пишутся прямо в файлы кэша детектора;
+#   DS  - filtfilt по блоку с тем же запасом, высоты пиков секунд пишутся на диск по каналам.
+# Читаются только каналы, нужные этапам, которые ещё не взяты из кэша (channels_to_read).
+# Серии секунд, пересекающие границы блоков, группируются детекторами уже по всей записи
+# (промежуточные данные на диске читаются через mmap).
+# Сигналы в результат не попадают: аннотации сохраняются save_annotations_streaming.
+#
+# Запуск из директории backend/app:
+#     python -m model.batch D:/recordings --output D:/annotated --chunk-seconds 600
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import pyedflib
+from .model_utils import load_model_keras
+from .data_processing import IS_CHANNELS, WINDOW_SECONDS, STEP_SECONDS, OnlineFeatureExtractor
+from .edf_utils import channels_to_read, load_edf_info, signals_to_volts
+from .resampling import resample_segment, resampled_length, resampling_margin, signal_rate
+from .feature_cache import FEATURE_CACHE_DIR, feature_cache_key, file_sha256, load_cached_features, save_cached_features
+from .swd_detection import SWD_PRODUCT_PARAMS, swd_envelope, swd_peak_table
+from .ds_detection import DS_PRODUCT_PARAMS, ds_peak_heights
+from .detector_cache import (DETECTOR_CACHE_DIR, commit_products, create_product_array, detector_cache_key,
+                             load_products)
+from .prediction_cache import PREDICTION_CACHE_DIR, prediction_cache_key, save_probabilities
+from .main import MODEL_PATH, SAMPLING_RATE, LOWCUT, HIGHCUT, combine_annotations, postprocess_predictions
+
+# Длительность блока, сек. (3 канала по 600 с при 400 Гц - около 6 МБ float64)
+CHUNK_SECONDS = 600
+# Запас сигнала с каждой стороны блока для фильтров SWD/DS и огибающей, сек.
+CHUNK_HALO_SECONDS = 10
+
+# Блок копирования высот пиков DS из временных файлов, элементов
+COPY_BLOCK = 1 << 20
+
+
+def iter_edf_chunks(file_path, chunk_samples, halo_samples, channels=None):
+    """
+    Читает сигналы EDF-файла блоками с запасом с обеих сторон.
+
+    Параметры:
+        file_path (str): Путь к EDF-файлу.
+        chunk_samples (int): Длина блока в отсчётах.
+        halo_samples (int): Запас с каждой стороны блока в отсчётах (в пределах записи).
+        channels (int): Количество первых каналов для чтения (None - все).
+
+    Возвращает:
+        generator: Кортежи (start, stop, first, data): границы блока [start, stop)
+            и сигналы data отрезка записи, начинающегося с отсчёта first.
+    """
+    with pyedflib.EdfReader(file_path) as f:
+        n_channels = f.signals_in_file if channels is None else min(channels, f.signals_in_file)
+        n_samples = int(f.getNSamples()[0])
+        for start in range(0, n_samples, chunk_samples):
+            stop = min(start + chunk_samples, n_samples)
+            first = max(start - halo_samples, 0)
+            last = min(stop + halo_samples, n_samples)
+            data = np.empty((n_channels, last - first))
+            for i in range(n_channels):
+                data[i] = f.readSignal(i, first, last - first)
+            yield start, stop, first, data
+
+
+class SWDProductsWriter:
+    """
+    Промежуточные данные SWD (см. swd_products), вычисляемые по блокам записи
+    и записываемые в файлы кэша детектора.
+
+    Параметры:
+        key (str): Ключ кэша.
+        n_channels (int): Количество каналов.
+        n_samples (int): Длина записи в отсчётах с частотой sfreq.
+        sfreq (float): Частота дискретизации записи.
+        ch_names (list): Имена каналов.
+        cache_dir (str): Директория кэша.
+        rate (float): Частота детекции; push получает сигналы и границы блоков с этой частотой.
+        channels (int): Количество первых каналов, по которым ищутся SWD.
+    """
+
+    def __init__(self, key, n_channels, n_samples, sfreq, ch_names, cache_dir,
+                 freq_low=SWD_PRODUCT_PARAMS['freq_low'], freq_high=SWD_PRODUCT_PARAMS['freq_high'],
+                 depth=SWD_PRODUCT_PARAMS['depth'], rate=SWD_PRODUCT_PARAMS['rate'],
+                 channels=SWD_PRODUCT_PARAMS['channels']):
+        self.key = key
+        self.cache_dir = cache_dir
+        self.sfreq = float(rate)
+        n_samples = resampled_length(n_samples, sfreq, rate)
+        self.n_channels = n_channels = min(channels, n_channels)
+        self.ch_names = list(ch_names)[:n_channels]
+        self.freq_low, self.freq_high = freq_low, freq_high
+        self.samples_per_second = int(rate)
+        self.n_seconds = n_samples // self.samples_per_second
+        self.depth = min(depth, self.samples_per_second)
+        # Огибающая и таблица пиков - float32, как их возвращает swd_products
+        self.envelope = create_product_array(key, 'envelope', (n_channels, n_samples), np.float32, cache_dir)
+        self.table = create_product_array(key, 'table', (n_channels, self.n_seconds, self.depth), np.float32, cache_dir)
+
+    def push(self, start, stop, first, volts):
+        """
+        Обрабатывает блок [start, stop) по сигналам в вольтах с частотой rate, начинающимся с отсчёта first.
+        """
+        self.envelope[:, start:stop] = swd_envelope(volts[:self.n_channels], self.sfreq, self.freq_low, self.freq_high)[:, start - first:stop - first]
+        self.fill_table(start // self.samples_per_second, stop // self.samples_per_second)
+
+    def fill_table(self, first_second, last_second):
+        """
+        Заполняет таблицу пиков секунд [first_second, last_second) по уже записанной огибающей.
+        """
+        last_second = min(last_second, self.n_seconds)
+        if last_second > first_second:
+            seconds = self.envelope[:, first_second * self.samples_per_second:last_second * self.samples_per_second]
+            self.table[:, first_second:last_second] = swd_peak_table(seconds, self.sfreq, self.depth)
+
+    def _close_arrays(self):
+        for array in (self.envelope, self.table):
+            if array is not None:
+                array.flush()
+        self.envelope = self.table = None
+
+    def commit(self):
+        """
+        Завершает запись; промежуточные данные доступны через load_products.
+        """
+        self._close_arrays()
+        return commit_products(self.key, ['envelope', 'table'],
+                               {'sfreq': self.sfreq, 'ch_names': self.ch_names}, self.cache_dir)
+
+    def discard(self):
+        """
+        Удаляет незавершённые файлы.
+        """
+        self._close_arrays()
+        _remove_tmp_files(self.key, ['envelope', 'table'], self.cache_dir)
+
+
+class DSProductsWriter:
+    """
+    Промежуточные данные DS (см. ds_products), вычисляемые по блокам записи.
+    Высоты пиков пишутся во временные файлы по каналам и в конце собираются
+    в порядке ds_products (канал за каналом).
+
+    Параметры:
+        key (str): Ключ кэша.
+        n_channels (int): Количество каналов записи.
+        n_samples (int): Длина записи в отсчётах.
+        sfreq (float): Частота дискретизации.
+        cache_dir (str): Директория кэша.
+    """
+
+    def __init__(self, key, n_channels, n_samples, sfreq, cache_dir, cutoff=DS_PRODUCT_PARAMS['cutoff'],
+                 order=DS_PRODUCT_PARAMS['order'], channels=DS_PRODUCT_PARAMS['channels'],
+                 rate=DS_PRODUCT_PARAMS['rate']):
+        self.key = key
+        self.cache_dir = cache_dir
+        self.sfreq = float(sfreq)
+        self.cutoff, self.order, self.rate = cutoff, order, rate
+        self.samples_per_second = int(sfreq)
+        self.n_channels = min(channels, n_channels)
+        self.n_seconds = int(n_samples / sfreq)
+        self.counts = np.zeros((self.n_channels, self.n_seconds), dtype=np.int64)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.parts = [open(self._part_path(ch), 'w+b') for ch in range(self.n_channels)]
+
+    def _part_path(self, ch):
+        return os.path.join(self.cache_dir, f"{self.key}_heights_{ch}.part")
+
+    def push(self, start, stop, first, volts):
+        """
+        Обрабатывает блок [start, stop) по сигналам в вольтах, начинающимся с отсчёта first.
+        """
+        first_second = start // self.samples_per_second
+        n_seconds = min(stop // self.samples_per_second, self.n_seconds) - first_second
+        self.append(first_second, ds_peak_heights(volts[:self.n_channels], self.sfreq, n_seconds, start - first,
+                                                  self.cutoff, self.order, self.rate))
+
+    def append(self, first_second, heights):
+        """
+        Добавляет высоты пиков секунд, следующих за уже добавленными.
+
+        Параметры:
+            first_second (int): Первая секунда.
+            heights (list): По каждому каналу - (высоты, количества по секундам), см. second_peak_heights.
+        """
+        for ch, (channel_heights, counts) in enumerate(heights):
+            self.counts[ch, first_second:first_second + len(counts)] = counts
+            self.parts[ch].write(np.asarray(channel_heights, dtype=np.float64).tobytes())
+
+    def commit(self):
+        """
+        Собирает высоты всех каналов в файлы кэша; промежуточные данные доступны через load_products.
+        """
+        offsets = np.zeros(self.counts.size + 1, dtype=np.int64)
+        np.cumsum(self.counts.ravel(), out=offsets[1:])
+        heights = create_product_array(self.key, 'heights', (int(offsets[-1]),), np.float64, self.cache_dir)
+        position = 0
+        for part in self.parts:
+            part.seek(0)
+            while True:
+                block = np.frombuffer(part.read(COPY_BLOCK * 8), dtype=np.float64)
+                if not len(block):
+                    break
+                heights[position:position + len(block)] = block
+                position += len(block)
+        heights.flush()
+        del heights
+        offsets_array = create_product_array(self.key, 'offsets', offsets.shape, np.int64, self.cache_dir)
+        offsets_array[:] = offsets
+        offsets_array.flush()
+        del offsets_array
+        self._remove_parts()
+        return commit_products(self.key, ['heights', 'offsets'],
+                               {'n_channels': self.n_channels, 'n_seconds': self.n_seconds, 'sfreq': self.sfreq},
+                               self.cache_dir)
+
+    def _remove_parts(self):
+        for ch, part in enumerate(self.parts):
+            part.close()
+            if os.path.exists(self._part_path(ch)):
+                os.remove(self._part_path(ch))
+        self.parts = []
+
+    def discard(self):
+        """
+        Удаляет незавершённые файлы.
+        """
+        self._remove_parts()
+        _remove_tmp_files(self.key, ['heights', 'offsets'], self.cache_dir)
+
+
+def _remove_tmp_files(key, names, cache_dir):
+    for name in names:
+        path = os.path.join(cache_dir, f"{key}_{name}.npy.tmp")
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def annotate_edf_chunked(unannotated_edf_path, model=None, chunk_seconds=CHUNK_SECONDS,
+                         feature_cache_dir=FEATURE_CACHE_DIR, detector_cache_dir=DETECTOR_CACHE_DIR,
+                         prediction_cache_dir=PREDICTION_CACHE_DIR, model_hash=None):
+    """
+    Аннотирует EDF-файл (IS, SWD, DS) блоками, не загружая запись в память целиком.
+    Аннотации совпадают с annotate_edf (SWD/DS - с точностью до краевых эффектов
+    на расстоянии CHUNK_HALO_SECONDS от границ блоков).
+
+    Параметры:
+        unannotated_edf_path (str): Путь к неаннотированному EDF-файлу.
+        model (Model): Уже загруженная модель; если None, модель загружается из файла.
+        chunk_seconds (int): Длительность блока, сек.
+        feature_cache_dir (str): Директория кэша признаков; None - не использовать кэш.
+        detector_cache_dir (str): Директория кэша промежуточных данных SWD/DS; None - промежуточные
+            данные пишутся во временную директорию и удаляются после детекции.
+        prediction_cache_dir (str): Директория кэша вероятностей классов; None - не сохранять вероятности.
+        model_hash (str): SHA-256 файла переданной модели; если модель загружается здесь, считается по MODEL_PATH.
+
+    Возвращает:
+        status (str): "success" в случае успешного выполнения, иначе сообщение об ошибке.
+        recording (dict): Заголовки и итоговые аннотации ('signals' - None) или None при ошибке.
+    """
+    fs = SAMPLING_RATE
+    temp_dir = None
+    writers = []
+    try:
+        if model is None:
+            model = load_model_keras(MODEL_PATH)
+            if model is None:
+                return "Ошибка: не удалось загрузить модель.", None
+            if prediction_cache_dir and feature_cache_dir:
+                model_hash = file_sha256(MODEL_PATH)
+
+        signal_labels, header, signal_headers, existing_annotations, n_samples = load_edf_info(unannotated_edf_path)
+        if signal_labels is None:
+            return "Ошибка: не удалось загрузить EDF-файл.", None
+        n_channels = len(signal_labels)
+        sfreq = signal_rate(signal_headers)
+
+        content_hash = file_sha256(unannotated_edf_path)
+
+        features = None
+        if feature_cache_dir:
+            cache_key, cache_params = feature_cache_key(content_hash, fs, LOWCUT, HIGHCUT)
+            features, positions = load_cached_features(cache_key, feature_cache_dir)
+
+        # Промежуточные данные детекторов из кэша; отсутствующие вычисляются по блокам
+        products_dir = detector_cache_dir or tempfile.mkdtemp(prefix="ecog_chunked_")
+        temp_dir = None if detector_cache_dir else products_dir
+        swd_key = detector_cache_key('swd', content_hash, SWD_PRODUCT_PARAMS)
+        ds_key = detector_cache_key('ds', content_hash, DS_PRODUCT_PARAMS)
+        swd_data = load_products(swd_key, products_dir) if detector_cache_dir else None
+        ds_data = load_products(ds_key, products_dir) if detector_cache_dir else None
+        swd_writer = SWDProductsWriter(swd_key, n_channels, n_samples, sfreq, signal_labels, products_dir,
+                                       **SWD_PRODUCT_PARAMS) if swd_data is None else None
+        ds_writer = DSProductsWriter(ds_key, n_channels, n_samples, sfreq, products_dir,
+                                     **DS_PRODUCT_PARAMS) if ds_data is None else None
+        writers = [writer for writer in (swd_writer, ds_writer) if writer is not None]
+
+        extractor = OnlineFeatureExtractor(min(IS_CHANNELS, n_channels), fs, LOWCUT, HIGHCUT) if features is None else None
+        # Окна, которые берёт extract_features: начало строго меньше n_samples - window_size
+        # (в отсчётах записи, передискретизированной к частоте модели)
+        last_position = resampled_length(n_samples, sfreq, fs) - int(WINDOW_SECONDS * fs)
+        feature_parts, position_parts, probability_parts = [], [], []
+
+        if extractor is not None or writers:
+            # Запас передискретизации отбрасывается resample_segment, запас фильтров остаётся
+            halo = (int(CHUNK_HALO_SECONDS * sfreq) if writers else 0) + resampling_margin(sfreq, fs)
+            # Каналы этапов, которые ещё нужно вычислить: с частотой модели (IS и SWD, SWD_RATE)
+            # и с частотой записи (DS); читается их объединение
+            model_stages = [channels for stage, channels in ((extractor, IS_CHANNELS),
+                                                             (swd_writer, SWD_PRODUCT_PARAMS['channels']))
+                            if stage is not None]
+            model_channels = channels_to_read(n_channels, *model_stages)
+            read_channels = channels_to_read(n_channels, *model_stages,
+                                             *([DS_PRODUCT_PARAMS['channels']] if ds_writer is not None else []))
+            for start, stop, first, data in iter_edf_chunks(unannotated_edf_path, int(chunk_seconds * sfreq), halo,
+                                                            read_channels):
+                # Блок и его сигналы с частотой модели
+                model_first, model_data = resample_segment(data[:model_channels], first, n_samples, sfreq, fs)
+                model_start, model_stop = resampled_length(start, sfreq, fs), resampled_length(stop, sfreq, fs)
+                if extractor is not None:
+                    chunk_features, chunk_positions = extractor.push(
+                        model_data[:IS_CHANNELS, model_start - model_first:model_stop - model_first])
+                    keep = chunk_positions < last_position
+                    chunk_features, chunk_positions = chunk_features[keep], chunk_positions[keep]
+                    if len(chunk_features):
+                        # Предсказание по блоку: признаки всей записи не нужны модели одновременно
+                        X = chunk_features.reshape((chunk_features.shape[0], chunk_features.shape[1], 1))
+                        probability_parts.append(model.predict(X, verbose=0))
+                        feature_parts.append(chunk_features)
+                        position_parts.append(chunk_positions)
+                if swd_writer is not None:
+                    swd_writer.push(model_start, model_stop, model_first, signals_to_volts(model_data, signal_headers))
+                del model_data
+                if ds_writer is not None:
+                    ds_writer.push(start, stop, first, signals_to_volts(data, signal_headers))
+                print(f"Обработано {stop / sfreq / 3600:.2f} из {n_samples / sfreq / 3600:.2f} ч. записи")
+
+        for writer in writers:
+            writer.commit()
+        writers = []
+        if swd_data is None:
+            swd_data = load_products(swd_key, products_dir)
+        if ds_data is None:
+            ds_data = load_products(ds_key, products_dir)
+
+        if extractor is not None:
+            if not feature_parts:
+                return "Ошибка: не удалось извлечь признаки из данных.", None
+            features = np.concatenate(feature_parts)
+            positions = np.concatenate(position_parts)
+            y_pred_probs = np.concatenate(probability_parts)
+            if feature_cache_dir:
+                save_cached_features(cache_key, cache_params, features, positions, feature_cache_dir)
+        else:
+            # Признаки из кэша (mmap) подаются модели частями длиной в блок
+            windows_per_chunk = max(1, int(chunk_seconds // STEP_SECONDS))
+            y_pred_probs = np.concatenate([
+                model.predict(np.asarray(features[i:i + windows_per_chunk])[..., np.newaxis], verbose=0)
+                for i in range(0, len(features), windows_per_chunk)
+            ])
+        y_pred_classes = np.argmax(y_pred_probs, axis=1)
+
+        prediction_key = None
+        if prediction_cache_dir and feature_cache_dir and model_hash:
+            prediction_key = prediction_cache_key(cache_key, model_hash)
+            save_probabilities(prediction_key, y_pred_probs, positions, prediction_cache_dir)
+
+        annotations_pred = postprocess_predictions(y_pred_classes, positions, fs)
+        annotations = combine_annotations(existing_annotations, annotations_pred, swd_data, ds_data)
+        del swd_data, ds_data
+
+        recording = {
+            'file_path': unannotated_edf_path,
+            'signals': None,
+            'n_samples': n_samples,
+            'signal_labels': signal_labels,
+            'header': header,
+            'signal_headers': signal_headers,
+            'sfreq': sfreq,
+            'annotations': annotations,
+            'content_hash': content_hash,
+            'prediction_key': prediction_key
+        }
+        return "success", recording
+
+    except Exception as e:
+        return f"Ошибка: {str(e)}", None
+    finally:
+        for writer in writers:
+            writer.discard()
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,78 @@
+# detector_runner.py
+#
+# Детекторы SWD и DS по одной записи в памяти. Детекторы независимы друг от друга и почти
+# всё время проводят в коде NumPy/SciPy, отпускающем GIL, поэтому выполняются одновременно
+# в пуле потоков: время детекции - время самого долгого детектора, а не сумма.
+# Сигналы не копируются: все детекторы только читают один и тот же массив.
+
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from .swd_detection import SWD_PRODUCT_PARAMS, detect_swd_from_products, swd_products
+from .ds_detection import DS_PRODUCT_PARAMS, detect_ds_from_products, ds_products
+from .detector_cache import cached_products
+
+# Зарегистрированные детекторы: промежуточные данные по сигналам в памяти
+# (data в вольтах, sfreq, ch_names, **params), их параметры (ключ кэша) и детекция по ним
+DETECTORS = {
+    'swd': {'products': swd_products, 'params': SWD_PRODUCT_PARAMS, 'detect': detect_swd_from_products},
+    'ds': {'products': lambda data, sfreq, ch_names, **params: ds_products(data, sfreq, **params),
+           'params': DS_PRODUCT_PARAMS, 'detect': detect_ds_from_products},
+}
+
+# Потоков для детекторов (по умолчанию - по одному на детектор; 1 - по очереди)
+DETECTOR_THREADS = int(os.environ.get("ECOG_DETECTOR_THREADS", 0)) or len(DETECTORS)
+
+
+def detector_channels(n_signals, kinds=None):
+    """
+    Сколько первых каналов записи нужно детекторам (объединение их каналов).
+    """
+    return min(n_signals, max(DETECTORS[kind]['params']['channels'] for kind in (kinds or DETECTORS)))
+
+
+def run_detectors(data, sfreq, ch_names, content_hash=None, cache_dir=None, kinds=None, detect=True,
+                  threads=DETECTOR_THREADS, timer=None):
+    """
+    Вычисляет промежуточные данные (или берёт их из кэша) и интервалы детекторов одновременно в пуле потоков.
+
+    Параметры:
+        data (ndarray): Сигналы формы (n_channels, n_samples) в вольтах; достаточно первых
+            detector_channels каналов.
+        sfreq (float): Частота дискретизации.
+        ch_names (list): Имена каналов.
+        content_hash (str): SHA-256 записи для кэша промежуточных данных; None - без кэша.
+        cache_dir (str): Директория кэша промежуточных данных; None - без кэша.
+        kinds (list): Детекторы (по умолчанию - все из DETECTORS).
+        detect (bool): Искать интервалы с параметрами по умолчанию; False - только промежуточные данные.
+        threads (int): Количество потоков.
+        timer (callable): Замер детектора по его виду (контекстный менеджер, например stage_timer);
+            выполняется в потоке детектора с контекстом вызывающего.
+
+    Возвращает:
+        dict: По виду детектора - {'products': промежуточные данные или None,
+            'intervals': обнаруженные интервалы, 'seconds': время детектора, сек.}.
+    """
+    kinds = list(kinds or DETECTORS)
+
+    def run(kind):
+        detector = DETECTORS[kind]
+        started = time.perf_counter()
+        with timer(kind) if timer else nullcontext():
+            def compute():
+                return detector['products'](data, sfreq, ch_names, **detector['params'])
+            if content_hash and cache_dir:
+                products = cached_products(kind, content_hash, detector['params'], compute, cache_dir)
+            else:
+                products = compute()
+            intervals = detector['detect'](products, verbose=True) if detect and products else []
+        return {'products': products, 'intervals': intervals, 'seconds': time.perf_counter() - started}
+
+    if threads > 1 and len(kinds) > 1:
+        with ThreadPoolExecutor(max_workers=min(threads, len(kinds))) as pool:
+            # Контекст вызывающего (замеры этапов запроса) переносится в потоки
+            futures = {kind: pool.submit(contextvars.copy_context().run, run, kind) for kind in kinds}
+            return {kind: future.result() for kind, future in futures.items()}
+    return {kind: run(kind) for kind in kinds}
@@ -0,0 +1,240 @@
+# edf_stream.py
+
+import os
+import tempfile
+
+ANNOTATION_LABEL = 'EDF Annotations'
+
+# Ширина полей заголовка сигнала EDF в порядке их следования
+SIGNAL_FIELDS = [
+    ('label', 16),
+    ('transducer', 80),
+    ('dimension', 8),
+    ('physical_min', 8),
+    ('physical_max', 8),
+    ('digital_min', 8),
+    ('digital_max', 8),
+    ('prefilter', 80),
+    ('samples_per_record', 8),
+    ('reserved', 32),
+]
+
+# Сколько записей данных читается с диска за один раз
+RECORDS_PER_READ = 64
+
+
+def read_edf_header(f):
+    """
+    Читает заголовок EDF/EDF+ из открытого бинарного файла.
+
+    Параметры:
+        f (file): Файл, открытый в режиме 'rb'.
+
+    Возвращает:
+        header (dict): Поля основного заголовка (байтовые строки) и разобранные
+            значения 'n_records', 'record_duration', 'n_signals'.
+        signals (list): Список словарей с полями заголовков сигналов (байтовые строки)
+            и разобранным 'spr' (отсчётов на запись).
+    """
+    f.seek(0)
+    main = f.read(256)
+    header = {
+        'version': main[0:8],
+        'patient': main[8:88],
+        'recording': main[88:168],
+        'startdate': main[168:176],
+        'starttime': main[176:184],
+        'header_bytes': main[184:192],
+        'reserved': main[192:236],
+        'n_records': int(main[236:244].strip()),
+        'record_duration_field': main[244:252],
+        'record_duration': float(main[244:252].strip()),
+        'n_signals': int(main[252:256].strip()),
+    }
+    ns = header['n_signals']
+    raw_fields = f.read(256 * ns)
+    signals = [{} for _ in range(ns)]
+    offset = 0
+    for name, width in SIGNAL_FIELDS:
+        for i in range(ns):
+            signals[i][name] = raw_fields[offset:offset + width]
+            offset += width
+    for signal in signals:
+        signal['spr'] = int(signal['samples_per_record'].strip())
+    return header, signals
+
+
+def _field(value, width):
+    """
+    Форматирует значение поля заголовка EDF: ASCII, выравнивание влево, пробелы.
+    """
+    if isinstance(value, bytes):
+        value = value.decode('ascii', errors='replace')
+    value = str(value)[:width]
+    return value.ljust(width).encode('ascii', errors='replace')
+
+
+def _format_seconds(value):
+    """
+    Число секунд для TAL: со знаком, без экспоненты и лишних нулей.
+    """
+    text = f"{value:+.7f}".rstrip('0').rstrip('.')
+    return text
+
+
+def _timekeeping_onset(tal_bytes):
+    """
+    Извлекает время начала записи данных из первого TAL аннотационного сигнала.
+    """
+    end = tal_bytes.find(b'\x14')
+    if end <= 0:
+        return None
+    try:
+        return float(tal_bytes[:end].split(b'\x15')[0])
+    except ValueError:
+        return None
+
+
+def _annotation_tal(onset, duration, description):
+    """
+    Кодирует одну аннотацию в TAL (Time-stamped Annotation List) EDF+.
+    """
+    tal = _format_seconds(onset).encode('ascii')
+    if duration and duration > 0:
+        tal += b'\x15' + _format_seconds(duration).lstrip('+').encode('ascii')
+    tal += b'\x14' + str(description).encode('utf-8') + b'\x14\x00'
+    return tal
+
+
+def save_annotations_streaming(original_file_path, output_file_path, annotations, progress_callback=None, atomic=True):
+    """
+    Сохраняет аннотации в EDF+, не декодируя сигналы.
+
+    Записи данных исходного файла копируются побайтно, заново формируется
+    только аннотационный канал 'EDF Annotations'. Память не зависит от длины записи.
+
+    Параметры:
+        original_file_path (str): Путь к исходному EDF/EDF+ файлу.
+        output_file_path (str): Путь для сохранения (может совпадать с исходным).
+        annotations (list): Список аннотаций в формате (onset, duration, description).
+        progress_callback (callable): Вызывается как progress_callback(done, total) по ходу записи.
+        atomic (bool): Писать во временный файл рядом с целевым и переименовывать в конце.
+
+    Возвращает:
+        bool: True при успешной записи, False иначе.
+    """
+    tmp_path = None
+    try:
+        with open(original_file_path, 'rb') as src:
+            header, signals = read_edf_header(src)
+            n_records = header['n_records']
+            duration = header['record_duration']
+
+            # Байтовые смещения сигналов внутри записи данных
+            offsets = []
+            position = 0
+            for signal in signals:
+                offsets.append((position, position + 2 * signal['spr']))
+                position += 2 * signal['spr']
+            record_size = position
+
+            annotation_idx = [i for i, s in enumerate(signals) if s['label'].strip() == ANNOTATION_LABEL.encode()]
+            data_idx = [i for i in range(len(signals)) if i not in annotation_idx]
+            is_edf_plus = header['reserved'].startswith(b'EDF+')
+
+            # Упаковка аннотаций по записям данных; первая TAL каждой записи - отметка времени
+            tals = [_annotation_tal(*annotation) for annotation in sorted(annotations, key=lambda x: x[0])]
+            timekeeping_len = len(_annotation_tal(n_records * duration, 0, '')) + 1
+            max_tal = max([len(t) for t in tals], default=0)
+            total = sum(len(t) for t in tals)
+            capacity = timekeeping_len + max_tal + -(-total // max(n_records, 1))
+            capacity = max(capacity + capacity % 2, 120)
+
+            per_record = [[] for _ in range(n_records)]
+            record, used = 0, 0
+            for tal in tals:
+                if used + len(tal) > capacity - timekeeping_len:
+                    record, used = record + 1, 0
+                per_record[min(record, n_records - 1)].append(tal)
+                used += len(tal)
+
+            # Новый заголовок: сигналы данных без изменений + один аннотационный канал
+            new_signals = [signals[i] for i in data_idx]
+            new_signals.append({
+                'label': ANNOTATION_LABEL, 'transducer': '', 'dimension': '',
+                'physical_min': '-1', 'physical_max': '1',
+                'digital_min': '-32768', 'digital_max': '32767',
+                'prefilter': '', 'samples_per_record': str(capacity // 2), 'reserved': '',
+            })
+            patient, recording_field = header['patient'], header['recording']
+            reserved = header['reserved'] if is_edf_plus else b'EDF+C'
+            if not is_edf_plus:
+                # Поля EDF+ имеют фиксированную структуру подполей
+                patient = f"X X X {patient.decode('ascii', errors='replace').strip().replace(' ', '_') or 'X'}"
+                recording_field = f"Startdate X X X {recording_field.decode('ascii', errors='replace').strip().replace(' ', '_') or 'X'}"
+
+            ns = len(new_signals)
+            out_header = b''.join([
+                _field(header['version'], 8),
+                _field(patient, 80),
+                _field(recording_field, 80),
+                _field(header['startdate'], 8),
+                _field(header['starttime'], 8),
+                _field(256 * (ns + 1), 8),
+                _field(reserved, 44),
+                _field(n_records, 8),
+                _field(header['record_duration_field'], 8),
+                _field(ns, 4),
+            ])
+            for name, width in SIGNAL_FIELDS:
+                out_header += b''.join(_field(signal[name], width) for signal in new_signals)
+
+            out_dir = os.path.dirname(os.path.abspath(output_file_path))
+            if atomic:
+                fd, tmp_path = tempfile.mkstemp(suffix='.edf.tmp', dir=out_dir)
+                dst = os.fdopen(fd, 'wb')
+            else:
+                dst = open(output_file_path, 'wb')
+
+            with dst:
+                dst.write(out_header)
+                src.seek(256 * (len(signals) + 1))
+                done = 0
+                while done < n_records:
+                    count = min(RECORDS_PER_READ, n_records - done)
+                    chunk = src.read(record_size * count)
+                    if len(chunk) < record_size * count:
+                        raise IOError("Файл короче, чем указано в заголовке")
+                    out = bytearray()
+                    for r in range(count):
+                        rec = chunk[r * record_size:(r + 1) * record_size]
+                        for i in data_idx:
+                            out += rec[offsets[i][0]:offsets[i][1]]
+
+                        # Отметка времени записи: из исходного файла (EDF+D) или по длительности записи
+                        onset = None
+                        if annotation_idx:
+                            first = annotation_idx[0]
+                            onset = _timekeeping_onset(rec[offsets[first][0]:offsets[first][1]])
+                        if onset is None:
+                            onset = (done + r) * duration
+                        tal = _format_seconds(onset).encode('ascii') + b'\x14\x14\x00'
+                        tal += b''.join(per_record[done + r])
+                        out += tal.ljust(capacity, b'\x00')
+                    dst.write(out)
+                    done += count
+                    if progress_callback is not None:
+                        progress_callback(done, n_records)
+
+        if atomic:
+            os.replace(tmp_path, output_file_path)
+            tmp_path = None
+        print(f"Аннотации сохранены потоковой записью: {output_file_path}")
+        return True
+    except Exception as e:
+        print(f"Ошибка при потоковом сохранении аннотаций в {output_file_path}: {e}")
+        return False
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
@@ -3,15 +3,20 @@
 import numpy as np
 import pyedflib
 
-def load_edf_with_annotations(file_path):
+# Множители перевода физических единиц EDF в вольты (как в mne.io.read_raw_edf)
+UNIT_SCALES = {'V': 1.0, 'mV': 1e-3, 'uV': 1e-6, 'µV': 1e-6, 'nV': 1e-9}
+
+def load_edf_with_annotations(file_path, channels=None):
     """
     Загружает EDF-файл вместе с существующими аннотациями.
 
     Параметры:
         file_path (str): Путь к EDF-файлу.
+        channels (tuple): Каналы этапов обработки (см. channels_to_read): декодируются только
+            первые каналы, нужные этапам; None - все каналы.
 
     Возвращает:
-        signals (ndarray): Массив сигналов.
+        signals (ndarray): Массив сигналов (первые channels_to_read(...) каналов).
         signal_labels (list): Список меток каналов.
         header (dict): Заголовок EDF-файла.
         signal_headers (list): Список заголовков сигналов.
@@ -20,6 +25,8 @@ def load_edf_with_annotations(file_path):
     try:
         with pyedflib.EdfReader(file_path) as f:
             n = f.signals_in_file
+            if channels is not None:
+                n = channels_to_read(n, *channels)
             signal_labels = f.getSignalLabels()
             signals = np.zeros((n, f.getNSamples()[0]))
             for i in range(n):
@@ -37,6 +44,50 @@ def load_edf_with_annotations(file_path):
         print(f"Ошибка при загрузке файла {file_path}: {e}")
         return None, None, None, None, None
 
+def channels_to_read(n_signals, *stage_channels):
+    """
+    Сколько первых каналов записи нужно прочитать для этапов обработки.
+    Каждый этап объявляет количество первых каналов, которые он использует
+    (IS_CHANNELS, SWD_CHANNELS, DS_CHANNELS; None - все каналы), читается их объединение.
+
+    Параметры:
+        n_signals (int): Количество каналов в записи.
+        *stage_channels: Каналы каждого выполняемого этапа.
+
+    Возвращает:
+        int: Количество первых каналов для чтения (0 - этапов нет).
+    """
+    if not stage_channels:
+        return 0
+    return min(n_signals, max(n_signals if channels is None else channels for channels in stage_channels))
+
+def load_edf_info(file_path):
+    """
+    Читает заголовки и аннотации EDF-файла без сигналов (для обработки записи блоками).
+
+    Параметры:
+        file_path (str): Путь к EDF-файлу.
+
+    Возвращает:
+        signal_labels (list): Список меток каналов.
+        header (dict): Заголовок EDF-файла.
+        signal_headers (list): Список заголовков сигналов.
+        existing_annotations (list): Список существующих аннотаций.
+        n_samples (int): Количество отсчётов в каждом канале.
+    """
+    try:
+        with pyedflib.EdfReader(file_path) as f:
+            signal_labels = f.getSignalLabels()
+            header = f.getHeader()
+            signal_headers = f.getSignalHeaders()
+            n_samples = int(f.getNSamples()[0])
+            annotations = f.readAnnotations()
+            existing_annotations = list(zip(annotations[0], annotations[1], annotations[2]))
+        return signal_labels, header, signal_headers, existing_annotations, n_samples
+    except Exception as e:
+        print(f"Ошибка при чтении заголовка файла {file_path}: {e}")
+        return None, None, None, None, None
+
 def save_annotated_edf(original_file_path, annotated_file_path, new_annotations, header, signal_headers, signals, existing_annotations):
     """
     Сохраняет EDF-файл с объединёнными аннотациями.
@@ -49,6 +100,9 @@ def save_annotated_edf(original_file_path, annotated_file_path, new_annotations,
         signal_headers (list): Список заголовков сигналов.
         signals (ndarray): Массив сигналов.
         existing_annotations (list): Список существующих аннотаций.
+
+    Возвращает:
+        bool: True при успешной записи, False иначе.
     """
     try:
         # Объединяем существующие и новые аннотации
@@ -67,5 +121,22 @@ def save_annotated_edf(original_file_path, annotated_file_path, new_annotations,
                 writer.writeAnnotation(onset, duration, description)
 
         print(f"Аннотированный EDF-файл сохранён: {annotated_file_path}")
+        return True
     except Exception as e:
         print(f"Ошибка при сохранении аннотированного EDF-файла: {e}")
+        return False
+
+def signals_to_volts(signals, signal_headers):
+    """
+    Переводит сигналы из физических единиц EDF в вольты.
+    Детекторы SWD и DS рассчитаны на данные в вольтах (как их отдаёт mne).
+
+    Параметры:
+        signals (ndarray): Массив сигналов в единицах из заголовков (первые len(signals) каналов записи).
+        signal_headers (list): Список заголовков сигналов.
+
+    Возвращает:
+        ndarray: Сигналы в вольтах.
+    """
+    scales = np.array([UNIT_SCALES.get(h.get('dimension', '').strip(), 1.0) for h in signal_headers[:len(signals)]])
+    return signals * scales[:, np.newaxis]
@@ -3,11 +3,24 @@
 import os
 import numpy as np
 from .model_utils import load_model_keras
-from .data_processing import load_edf, bandpass_filter, extract_features
-from .edf_utils import save_annotated_edf, load_edf_with_annotations
+from .data_processing import IS_CHANNELS, load_edf, bandpass_filter, extract_features
+from .edf_utils import load_edf_with_annotations, signals_to_volts
+from .resampling import MODEL_RATE, resample, signal_rate
+from .feature_cache import FEATURE_CACHE_DIR, feature_cache_key, file_sha256, load_cached_features, save_cached_features
 from .annotation_utils import load_json_annotations, create_edf_annotations, seconds_to_hms
-from .swd_detection import detect_swd
-from .ds_detection import detect_ds
+from .swd_detection import SWD_PRODUCT_PARAMS, detect_swd_from_products
+from .ds_detection import DS_PRODUCT_PARAMS, detect_ds_from_products
+from .detector_cache import DETECTOR_CACHE_DIR
+from .detector_runner import detector_channels, run_detectors
+from .prediction_cache import PREDICTION_CACHE_DIR, prediction_cache_key, save_probabilities
+
+# Путь к модели относительно рабочей директории приложения
+MODEL_PATH = r"model\cnn_classifier.h5"
+
+# Частота дискретизации и полоса фильтра, с которыми обучена модель
+SAMPLING_RATE = MODEL_RATE
+LOWCUT = 0.5
+HIGHCUT = 100
 
 def postprocess_predictions(predictions, positions, fs):
     """
@@ -123,48 +136,115 @@ def merge_overlapping_annotations(annotations, annotation_type):
 
     return merged_annotations
 
-def annotate_edf(unannotated_edf_path):
+def combine_annotations(existing_annotations, annotations_pred, swd_data, ds_data):
+    """
+    Итоговые аннотации записи: IS по предсказаниям модели, SWD и DS по промежуточным
+    данным детекторов; перекрывающиеся интервалы каждого типа объединяются.
+
+    Параметры:
+        existing_annotations (list): Аннотации, уже имеющиеся в файле.
+        annotations_pred (list): Аннотации is1/is2 по предсказаниям (см. postprocess_predictions).
+        swd_data (dict): Промежуточные данные детектора SWD или None.
+        ds_data (dict): Промежуточные данные детектора DS или None.
+
+    Возвращает:
+        list: Аннотации (onset, duration, description), отсортированные по времени.
+    """
+    # Объединение аннотаций IS
+    all_is_annotations = existing_annotations + annotations_pred if existing_annotations else annotations_pred
+
+    swd_annotations = detect_swd_from_products(swd_data, verbose=True) if swd_data else []
+    swd_annotation_tuples = convert_swd_annotations_to_tuples(swd_annotations)
+
+    ds_annotations = detect_ds_from_products(ds_data, verbose=True) if ds_data else []
+    ds_annotation_tuples = convert_ds_annotations_to_tuples(ds_annotations)
+
+    # Объединение всех аннотаций
+    final_annotations = all_is_annotations + swd_annotation_tuples + ds_annotation_tuples
+
+    # Объединение перекрывающихся аннотаций по типам
+    merged_is_annotations = merge_overlapping_annotations(final_annotations, 'is')
+    merged_swd_annotations = merge_overlapping_annotations(final_annotations, 'swd')
+    merged_ds_annotations = merge_overlapping_annotations(final_annotations, 'ds')
+
+    # Собираем все объединённые аннотации вместе с исходными аннотациями файла
+    final_merged_annotations = merged_is_annotations + merged_swd_annotations + merged_ds_annotations
+    if existing_annotations:
+        final_merged_annotations = list(existing_annotations) + final_merged_annotations
+
+    # Сортировка всех аннотаций по времени начала
+    final_merged_annotations.sort(key=lambda x: x[0])
+    return final_merged_annotations
+
+def annotate_edf(unannotated_edf_path, model=None, feature_cache_dir=FEATURE_CACHE_DIR,
+                 detector_cache_dir=DETECTOR_CACHE_DIR, prediction_cache_dir=PREDICTION_CACHE_DIR,
+                 model_hash=None):
     """
     Аннотирует EDF-файл, используя модель и выполняя детекцию IS, SWD и DS.
+    Результат возвращается в памяти, на диск ничего не записывается:
+    сохранение выполняется только явно (см. save_annotated_edf).
 
     Параметры:
         unannotated_edf_path (str): Путь к неаннотированному EDF-файлу.
+        model (Model): Уже загруженная модель; если None, модель загружается из файла.
+        feature_cache_dir (str): Директория кэша признаков; None - не использовать кэш.
+        detector_cache_dir (str): Директория кэша промежуточных данных SWD/DS; None - не использовать кэш.
+        prediction_cache_dir (str): Директория кэша вероятностей классов; None - не сохранять вероятности.
+            Вероятности сохраняются только вместе с кэшем признаков (ключ строится по его ключу).
+        model_hash (str): SHA-256 файла переданной модели; если модель загружается здесь, считается по MODEL_PATH.
 
     Возвращает:
-        str: "success" в случае успешного выполнения, иначе сообщение об ошибке.
+        status (str): "success" в случае успешного выполнения, иначе сообщение об ошибке.
+        recording (dict): Сигналы, заголовки и итоговые аннотации или None при ошибке.
     """
     try:
-        fs = 400  # Частота дискретизации
-        lowcut = 0.5
-        highcut = 100
-
-        # Пути к файлам
-        model_path = r"model\cnn_classifier.h5"
-        annotated_is_edf_path = r"annotated_is_file.edf"
-        file_name, file_extension = os.path.splitext(unannotated_edf_path)
-        final_annotated_edf_path = f"{file_name}_annotated{file_extension}"
-
-        # Загрузка модели
-        model = load_model_keras(model_path)
-        if model is None:
-            return "Ошибка: не удалось загрузить модель."
+        fs = SAMPLING_RATE  # Частота дискретизации модели
+        lowcut = LOWCUT
+        highcut = HIGHCUT
 
-        # Загрузка EDF-файла с существующими аннотациями
-        signals, signal_labels, header, signal_headers, existing_annotations = load_edf_with_annotations(unannotated_edf_path)
+        # Загрузка модели, если она не передана (пакетная обработка загружает её один раз)
+        if model is None:
+            model = load_model_keras(MODEL_PATH)
+            if model is None:
+                return "Ошибка: не удалось загрузить модель.", None
+            if prediction_cache_dir and feature_cache_dir:
+                model_hash = file_sha256(MODEL_PATH)
+
+        # Загрузка EDF-файла с существующими аннотациями; декодируются только каналы IS и детекторов,
+        # остальные каналы просмотрщик читает из файла по мере отрисовки (см. recording_to_raw в app.py)
+        signals, signal_labels, header, signal_headers, existing_annotations = load_edf_with_annotations(
+            unannotated_edf_path, channels=(IS_CHANNELS, SWD_PRODUCT_PARAMS['channels'], DS_PRODUCT_PARAMS['channels']))
         if signals is None:
-            return "Ошибка: не удалось загрузить EDF-файл."
-
-        # Применение фильтра к каждому каналу
-        filtered_signals = []
-        for i in range(signals.shape[0]):
-            filtered_signal = bandpass_filter(signals[i], lowcut, highcut, fs)
-            filtered_signals.append(filtered_signal)
-        filtered_signals = np.array(filtered_signals)
-
-        # Извлечение признаков
-        features, positions = extract_features(filtered_signals, fs)
-        if features.size == 0:
-            return "Ошибка: не удалось извлечь признаки из данных."
+            return "Ошибка: не удалось загрузить EDF-файл.", None
+        sfreq = signal_rate(signal_headers)  # Частота дискретизации записи
+
+        content_hash = file_sha256(unannotated_edf_path) if (feature_cache_dir or detector_cache_dir) else None
+
+        # Признаки той же записи с теми же параметрами берутся из кэша без фильтрации
+        features = None
+        if feature_cache_dir:
+            cache_key, cache_params = feature_cache_key(content_hash, fs, lowcut, highcut)
+            features, positions = load_cached_features(cache_key, feature_cache_dir)
+
+        if features is None:
+            # Передискретизация каналов IS к частоте модели (при совпадении частот - без копирования)
+            model_signals, _ = resample(signals[:IS_CHANNELS], sfreq, fs)
+
+            # Применение фильтра к каждому каналу
+            filtered_signals = []
+            for i in range(model_signals.shape[0]):
+                filtered_signal = bandpass_filter(model_signals[i], lowcut, highcut, fs)
+                filtered_signals.append(filtered_signal)
+            filtered_signals = np.array(filtered_signals)
+            del model_signals
+
+            # Извлечение признаков
+            features, positions = extract_features(filtered_signals, fs)
+            del filtered_signals
+            if features.size == 0:
+                return "Ошибка: не удалось извлечь признаки из данных.", None
+            if feature_cache_dir:
+                save_cached_features(cache_key, cache_params, features, positions, feature_cache_dir)
 
         # Подготовка данных для модели
         X = features.reshape((features.shape[0], features.shape[1], 1))
@@ -173,56 +253,39 @@ def annotate_edf(unannotated_edf_path):
         y_pred_probs = model.predict(X)
         y_pred_classes = np.argmax(y_pred_probs, axis=1)
 
+        # Вероятности сохраняются для повторной разметки IS с другими порогами без модели
+        prediction_key = None
+        if prediction_cache_dir and feature_cache_dir and model_hash:
+            prediction_key = prediction_cache_key(cache_key, model_hash)
+            save_probabilities(prediction_key, y_pred_probs, positions, prediction_cache_dir)
+
         # Постобработка предсказаний
         annotations_pred = postprocess_predictions(y_pred_classes, positions, fs)
 
-        # Объединение аннотаций IS
-        all_is_annotations = existing_annotations + annotations_pred if existing_annotations else annotations_pred
-
-        # Сохранение временного EDF-файла с IS аннотациями
-        save_annotated_edf(
-            unannotated_edf_path,
-            annotated_is_edf_path,
-            annotations_pred,
-            header,
-            signal_headers,
-            signals,
-            existing_annotations if existing_annotations else []
-        )
-
-        # Обнаружение SWD и DS
-        swd_annotations = detect_swd(annotated_is_edf_path)
-        swd_annotation_tuples = convert_swd_annotations_to_tuples(swd_annotations)
-
-        ds_annotations = detect_ds(annotated_is_edf_path)
-        ds_annotation_tuples = convert_ds_annotations_to_tuples(ds_annotations)
-
-        # Объединение всех аннотаций
-        final_annotations = all_is_annotations + swd_annotation_tuples + ds_annotation_tuples
-
-        # Объединение перекрывающихся аннотаций по типам
-        merged_is_annotations = merge_overlapping_annotations(final_annotations, 'is')
-        merged_swd_annotations = merge_overlapping_annotations(final_annotations, 'swd')
-        merged_ds_annotations = merge_overlapping_annotations(final_annotations, 'ds')
-
-        # Собираем все объединённые аннотации
-        final_merged_annotations = merged_is_annotations + merged_swd_annotations + merged_ds_annotations
-
-        # Сортировка всех аннотаций по времени начала
-        final_merged_annotations.sort(key=lambda x: x[0])
-
-        # Сохранение окончательного EDF-файла с IS, SWD и DS аннотациями
-        save_annotated_edf(
-            unannotated_edf_path,
-            final_annotated_edf_path,
-            final_merged_annotations,
-            header,
-            signal_headers,
-            signals,
-            existing_annotations if existing_annotations else []
-        )
-
-        return "success"
+        # Обнаружение SWD и DS прямо по сигналам в памяти (в вольтах, как их читает mne),
+        # детекторы выполняются одновременно по одному массиву (см. run_detectors).
+        # Детекторы получают сигналы с частотой записи и сами приводят их к своей частоте;
+        # в вольты переводятся только каналы детекторов.
+        # Промежуточные данные детекторов кэшируются для повторной детекции с другими параметрами
+        data = signals_to_volts(signals[:detector_channels(len(signals))], signal_headers)
+        detections = run_detectors(data, sfreq, signal_labels, content_hash, detector_cache_dir, detect=False)
+        del data
+        print("Время детекторов: " + ", ".join(f"{kind} {result['seconds']:.2f} с" for kind, result in detections.items()))
+        swd_data, ds_data = detections['swd']['products'], detections['ds']['products']
+
+        recording = {
+            'file_path': unannotated_edf_path,
+            'signals': signals,
+            'n_samples': signals.shape[1],
+            'signal_labels': signal_labels,
+            'header': header,
+            'signal_headers': signal_headers,
+            'sfreq': sfreq,
+            'annotations': combine_annotations(existing_annotations, annotations_pred, swd_data, ds_data),
+            'content_hash': content_hash,
+            'prediction_key': prediction_key
+        }
+        return "success", recording
 
     except Exception as e:
-        return f"Ошибка: {str(e)}"
+        return f"Ошибка: {str(e)}", None
@@ -1,5 +1,6 @@
 # model_utils.py
 
+import os
 import joblib
 import tensorflow as tf
 from tensorflow.keras.models import load_model
@@ -82,6 +83,20 @@ def load_model_pickle(model_path):
         print(f"Ошибка при загрузке модели из {model_path}: {e}")
         return None
 
+def load_model_file(model_path):
+    """
+    Загружает модель по расширению файла: Keras (.h5, .keras) или сохранённую joblib (остальные).
+
+    Параметры:
+        model_path (str): Путь к файлу модели.
+
+    Возвращает:
+        model: Загруженная модель или None при ошибке.
+    """
+    if os.path.splitext(model_path)[1].lower() in ('.h5', '.keras'):
+        return load_model_keras(model_path)
+    return load_model_pickle(model_path)
+
 def predict(model, X):
     """
     Делает предсказание на основе входных данных X.
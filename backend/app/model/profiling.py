@@ -0,0 +1,164 @@
+# profiling.py
+#
+# Профилирование одного прогона обработки по требованию:
+# cProfile (файл .pstats) или выборочный профилировщик стеков (файл .collapsed
+# для flamegraph.pl / speedscope) и топ выделений памяти tracemalloc (.txt).
+# Когда профилирование не запрошено, profile_run не вызывается и накладных расходов нет.
+
+import cProfile
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_MODES = ("cprofile", "sampling")
+DEFAULT_PROFILE_DIR = os.environ.get("ECOG_PROFILE_DIR", "data/profiles")
+
+# Интервал выборки стеков, сек.
+SAMPLE_INTERVAL = 0.005
+# Глубина стеков tracemalloc и размер топа выделений
+TRACEMALLOC_FRAMES = 25
+TRACEMALLOC_TOP = 50
+
+# Номер прогона в процессе: имена файлов не совпадают при нескольких прогонах в секунду
+_run_counter = itertools.count(1)
+
+
+def profile_mode_from_env():
+    """
+    Режим профилирования из переменной окружения ECOG_PROFILE.
+
+    Возвращает:
+        str: 'cprofile', 'sampling' или None, если профилирование выключено.
+    """
+    return normalize_profile_mode(os.environ.get("ECOG_PROFILE"))
+
+
+def normalize_profile_mode(value):
+    """
+    Приводит значение флага/заголовка к режиму профилирования.
+    '1', 'true', 'on' означают cProfile; пустое значение, '0', 'off' - выключено.
+    """
+    if not value:
+        return None
+    value = value.strip().lower()
+    if value in ("0", "false", "off", "no"):
+        return None
+    if value in ("1", "true", "on", "yes"):
+        return "cprofile"
+    if value in PROFILE_MODES:
+        return value
+    return None
+
+
+class SamplingProfiler:
+    """
+    Выборочный профилировщик: фоновый поток периодически снимает стек
+    профилируемого потока через sys._current_frames() и считает одинаковые стеки.
+    """
+
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def write_collapsed(self, path):
+        """
+        Записывает стеки в формате collapsed: 'кадр;кадр;кадр количество'.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _safe_name(name):
+    return re.sub(r"[^0-9A-Za-z._-]+", "_", name).strip("_")[:100] or "run"
+
+
+@contextmanager
+def profile_run(name, mode="cprofile", output_dir=None, trace_memory=True):
+    """
+    Профилирует блок кода и сохраняет результаты в output_dir.
+
+    Параметры:
+        name (str): Имя прогона (используется в именах файлов).
+        mode (str): 'cprofile' или 'sampling'.
+        output_dir (str): Директория для результатов (по умолчанию ECOG_PROFILE_DIR или data/profiles).
+        trace_memory (bool): Снимать топ выделений памяти tracemalloc.
+
+    Возвращает:
+        list: Пути к созданным файлам (заполняется после выхода из блока).
+    """
+    output_dir = output_dir or DEFAULT_PROFILE_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    run_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{next(_run_counter)}"
+    prefix = os.path.join(output_dir, f"{run_id}_{_safe_name(name)}")
+    paths = []
+
+    # tracemalloc уже может быть запущен снаружи (например, бенчмарком) - тогда не трогаем его
+    start_tracemalloc = trace_memory and not tracemalloc.is_tracing()
+    if start_tracemalloc:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    if mode == "sampling":
+        profiler = SamplingProfiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    started = time.perf_counter()
+    try:
+        yield paths
+    finally:
+        elapsed = time.perf_counter() - started
+        if mode == "sampling":
+            profiler.stop()
+            path = f"{prefix}.collapsed"
+            profiler.write_collapsed(path)
+        else:
+            profiler.disable()
+            path = f"{prefix}.pstats"
+            profiler.dump_stats(path)
+        paths.append(path)
+
+        if start_tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            path = f"{prefix}_tracemalloc.txt"
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"# {name}: {elapsed:.3f} с, пик {peak / 2 ** 20:.1f} МБ, в конце {current / 2 ** 20:.1f} МБ\n")
+                for stat in snapshot.statistics("traceback")[:TRACEMALLOC_TOP]:
+                    f.write(f"\n{stat.size / 2 ** 20:.2f} МБ в {stat.count} блоках\n")
+                    for line in stat.traceback.format(limit=TRACEMALLOC_FRAMES):
+                        f.write(f"{line}\n")
+            paths.append(path)
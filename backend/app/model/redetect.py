@@ -0,0 +1,151 @@
+# redetect.py
+#
+# Повторная детекция SWD/DS с новыми параметрами (или по сетке параметров)
+# по промежуточным данным детекторов, сохранённым при аннотации,
+# и повторная разметка IS по сохранённым вероятностям классов модели.
+#
+# Запуск из директории backend/app:
+#     python -m model.redetect D:/recordings/rat1.edf --swd amplitude_threshold=0.0004,0.0005 min_spikes_per_second=5,7
+#     python -m model.redetect D:/recordings --ds min_duration=5,7,9 --json sweep.json
+#     python -m model.redetect D:/recordings --is 1=0.6 2=0.5 --smoothing 3
+
+import argparse
+import json
+import os
+from .batch import collect_files
+from .detector_cache import DETECTOR_CACHE_DIR, detector_cache_key, load_products
+from .ds_detection import DS_PRODUCT_PARAMS, sweep_ds
+from .feature_cache import feature_cache_key, file_sha256
+from .prediction_cache import PREDICTION_CACHE_DIR, load_probabilities, prediction_cache_key, reannotate_is
+from .swd_detection import SWD_PRODUCT_PARAMS, sweep_swd
+
+DETECTORS = {
+    'swd': (SWD_PRODUCT_PARAMS, sweep_swd),
+    'ds': (DS_PRODUCT_PARAMS, sweep_ds),
+}
+
+
+def parse_grid(items):
+    """
+    Разбирает параметры вида 'имя=значение1,значение2' в сетку.
+
+    Возвращает:
+        dict: Имя параметра -> список значений (float).
+    """
+    grid = {}
+    for item in items or []:
+        name, _, values = item.partition('=')
+        grid[name.strip()] = [float(value) for value in values.split(',') if value.strip()]
+    return grid
+
+
+def sweep_file(file_path, grids, cache_dir=DETECTOR_CACHE_DIR):
+    """
+    Перебирает сетки параметров по кэшированным промежуточным данным одной записи.
+
+    Параметры:
+        file_path (str): Путь к EDF-файлу, аннотированному ранее с кэшем детекторов.
+        grids (dict): 'swd'/'ds' -> сетка параметров (см. sweep_swd, sweep_ds).
+        cache_dir (str): Директория кэша промежуточных данных.
+
+    Возвращает:
+        dict: 'swd'/'ds' -> список {'params', 'intervals'} или None, если данных нет в кэше.
+    """
+    content_hash = file_sha256(file_path)
+    result = {}
+    for kind, grid in grids.items():
+        product_params, sweep = DETECTORS[kind]
+        products = load_products(detector_cache_key(kind, content_hash, product_params), cache_dir)
+        result[kind] = sweep(products, grid) if products is not None else None
+    return result
+
+
+def parse_thresholds(items):
+    """
+    Разбирает пороги вида 'класс=вероятность'.
+
+    Возвращает:
+        dict: Класс (int) -> порог (float).
+    """
+    thresholds = {}
+    for item in items or []:
+        cls, _, value = item.partition('=')
+        thresholds[int(cls)] = float(value)
+    return thresholds
+
+
+def rethreshold_file(file_path, thresholds, smoothing=1, model_path=None, cache_dir=PREDICTION_CACHE_DIR):
+    """
+    Разметка IS одной записи по сохранённым вероятностям с новыми порогами, без запуска модели.
+
+    Параметры:
+        file_path (str): Путь к EDF-файлу, аннотированному ранее с кэшем признаков и вероятностей.
+        thresholds (dict): Класс (1, 2) -> минимальная вероятность.
+        smoothing (int): Ширина сглаживания вероятностей, окон.
+        model_path (str): Файл модели, которой получены вероятности (по умолчанию MODEL_PATH).
+        cache_dir (str): Директория кэша вероятностей.
+
+    Возвращает:
+        list: Объединённые аннотации IS или None, если вероятностей нет в кэше.
+    """
+    # main загружает TensorFlow, для перебора SWD/DS он не нужен
+    from .main import HIGHCUT, LOWCUT, MODEL_PATH, SAMPLING_RATE, merge_overlapping_annotations
+    feature_key, _ = feature_cache_key(file_sha256(file_path), SAMPLING_RATE, LOWCUT, HIGHCUT)
+    key = prediction_cache_key(feature_key, file_sha256(model_path or MODEL_PATH))
+    probabilities, positions = load_probabilities(key, cache_dir)
+    if probabilities is None:
+        return None
+    annotations = reannotate_is(probabilities, positions, SAMPLING_RATE, thresholds, smoothing)
+    return merge_overlapping_annotations(annotations, 'is')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Повторная детекция SWD/DS по кэшированным огибающим и таблицам пиков")
+    parser.add_argument("input", help="EDF-файл, директория или glob-шаблон")
+    parser.add_argument("--swd", nargs="*", default=None, help="Сетка параметров SWD: имя=значение1,значение2 ...")
+    parser.add_argument("--ds", nargs="*", default=None, help="Сетка параметров DS: имя=значение1,значение2 ...")
+    parser.add_argument("--is", dest="is_thresholds", nargs="*", default=None,
+                        help="Пороги вероятности IS: класс=порог (1 - начало, 2 - конец)")
+    parser.add_argument("--smoothing", type=int, default=1, help="Ширина сглаживания вероятностей IS, окон")
+    parser.add_argument("--model", default=None, help="Файл модели, которой получены вероятности IS")
+    parser.add_argument("--cache-dir", default=DETECTOR_CACHE_DIR, help="Директория кэша промежуточных данных")
+    parser.add_argument("--prediction-cache-dir", default=PREDICTION_CACHE_DIR, help="Директория кэша вероятностей классов")
+    parser.add_argument("--json", default=None, help="Сохранить все найденные интервалы в JSON-файл")
+    args = parser.parse_args(argv)
+
+    grids = {}
+    if args.swd is not None:
+        grids['swd'] = parse_grid(args.swd)
+    if args.ds is not None:
+        grids['ds'] = parse_grid(args.ds)
+    if not grids and args.is_thresholds is None:
+        grids = {'swd': {}, 'ds': {}}
+
+    files = [os.path.abspath(args.input)] if os.path.isfile(args.input) else collect_files(args.input)
+    report = {}
+    for file_path in files:
+        report[file_path] = sweep_file(file_path, grids, args.cache_dir)
+        for kind, runs in report[file_path].items():
+            if runs is None:
+                print(f"{os.path.basename(file_path)}: нет данных {kind.upper()} в кэше, файл нужно аннотировать заново")
+                continue
+            for run in runs:
+                params = ", ".join(f"{name}={value:g}" for name, value in run['params'].items())
+                print(f"{os.path.basename(file_path)} {kind.upper()} [{params}]: {len(run['intervals'])} интервалов")
+
+        if args.is_thresholds is not None:
+            thresholds = parse_thresholds(args.is_thresholds)
+            annotations = rethreshold_file(file_path, thresholds, args.smoothing, args.model, args.prediction_cache_dir)
+            report[file_path]['is'] = annotations
+            if annotations is None:
+                print(f"{os.path.basename(file_path)}: нет вероятностей IS в кэше, файл нужно аннотировать заново")
+            else:
+                print(f"{os.path.basename(file_path)} IS: {len(annotations) // 2} интервалов")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=float)
+
+
+if __name__ == "__main__":
+    main()
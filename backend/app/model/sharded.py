@@ -0,0 +1,346 @@
+# sharded.py
+#
+# Параллельная аннотация одной длинной записи: запись делится на отрезки по времени,
+# каждый отрезок обрабатывается в отдельном процессе (фильтрация, признаки, модель, SWD, DS).
+# Процессы читают EDF сами - общие страницы файла в кэше ОС; огибающая SWD пишется
+# процессами прямо в общий файл промежуточных данных (mmap).
+#
+# Границы отрезков задаются в отсчётах записи, передискретизированной к частоте модели (IS, SWD);
+# отрезок читается с частотой записи и передискретизируется с запасом resampling_margin,
+# DS получает сигналы с частотой записи.
+# Читаются только каналы, нужные этапам (IS_CHANNELS, SWD_CHANNELS, DS_CHANNELS).
+# Отрезки читаются с запасом:
+#   IS  - окно признаков после конца (окна, начинающиеся в отрезке); полосовой фильтр продолжается
+#         с состояния, которое основной процесс получает одним последовательным проходом фильтра
+#         по каналам IS (is_filter_states) - как при фильтрации всей записи сразу;
+#   SWD - перекрытие блоков огибающей (ENVELOPE_OVERLAP) и SHARD_HALO_SECONDS для FIR-фильтра;
+#         границы отрезков совпадают с границами блоков hilbert_envelope всей записи;
+#   DS  - SHARD_HALO_SECONDS для filtfilt.
+# Результаты отрезков собираются в промежуточные данные всей записи, поэтому серии секунд,
+# разрезанные границей отрезков, объединяются детекторами так же, как при обработке целиком:
+# признаки IS, огибающая и таблица пиков SWD совпадают с annotate_edf, высоты пиков DS - с точностью
+# до погрешности округления filtfilt.
+#
+# Запуск из директории backend/app:
+#     python -m model.sharded D:/recordings/rat1_72h.edf --output D:/annotated --workers 8
+
+import argparse
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import mne
+import numpy as np
+import pyedflib
+from scipy.signal import butter
+from . import batch
+from .batch import _init_worker, output_path_for
+from .chunked import DSProductsWriter, SWDProductsWriter
+from .data_processing import IS_CHANNELS, WINDOW_SECONDS, STEP_SECONDS, OnlineFilter, extract_features
+from .detector_cache import DETECTOR_CACHE_DIR, detector_cache_key, load_products
+from .ds_detection import DS_PRODUCT_PARAMS, ds_peak_heights
+from .edf_stream import save_annotations_streaming
+from .edf_utils import channels_to_read, load_edf_info, signals_to_volts
+from .feature_cache import FEATURE_CACHE_DIR, feature_cache_key, file_sha256, save_cached_features
+from .main import SAMPLING_RATE, LOWCUT, HIGHCUT, combine_annotations, postprocess_predictions
+from .prediction_cache import PREDICTION_CACHE_DIR, prediction_cache_key, save_probabilities
+from .resampling import resample_segment, resampled_length, resampling_factors, resampling_margin, signal_rate
+from .swd_detection import ENVELOPE_BLOCK_SIZE, ENVELOPE_OVERLAP, SWD_PRODUCT_PARAMS, hilbert_envelope
+
+# Длительность отрезка, сек. (округляется вверх до целого числа блоков огибающей)
+SHARD_SECONDS = 3600
+# Запас сверх перекрытия огибающей для FIR-фильтра SWD и filtfilt DS, сек.
+SHARD_HALO_SECONDS = 10
+
+
+def shard_bounds(n_samples, fs, shard_seconds=SHARD_SECONDS, up=1):
+    """
+    Границы отрезков записи, кратные длине блока огибающей и множителю передискретизации up
+    (начало отрезка приходится на отсчёт записи, кратный down).
+
+    Возвращает:
+        list: Пары (start, stop) в отсчётах.
+    """
+    block = math.lcm(ENVELOPE_BLOCK_SIZE, up)
+    shard_samples = max(1, math.ceil(shard_seconds * fs / block)) * block
+    return [(start, min(start + shard_samples, n_samples)) for start in range(0, n_samples, shard_samples)]
+
+
+def _read_range(file_path, first, last, channels):
+    with pyedflib.EdfReader(file_path) as f:
+        data = np.empty((channels, last - first))
+        for i in range(channels):
+            data[i] = f.readSignal(i, first, last - first)
+    return data
+
+
+def _source_range(first, last, n_samples, sfreq):
+    # Отрезок записи, после передискретизации покрывающий [first, last) в отсчётах с частотой модели
+    up, down = resampling_factors(sfreq, SAMPLING_RATE)
+    margin = resampling_margin(sfreq, SAMPLING_RATE)
+    return max(first // up * down - margin, 0), min(-(-last // up) * down + margin, n_samples)
+
+
+def _is_filter():
+    # Полосовой фильтр признаков IS (как в bandpass_filter)
+    nyq = 0.5 * SAMPLING_RATE
+    return butter(5, [LOWCUT / nyq, HIGHCUT / nyq], btype='band')
+
+
+def _is_first(start):
+    # Первое окно признаков отрезка - на сетке окон всей записи
+    step_size = int(STEP_SECONDS * SAMPLING_RATE)
+    return start // step_size * step_size
+
+
+def is_filter_states(file_path, bounds, n_samples, sfreq, n_channels):
+    """
+    Состояния полосового фильтра IS в начале каждого отрезка: фильтр проходит каналы IS
+    записи последовательно, отрезок за отрезком, поэтому продолжение фильтрации с этого
+    состояния в обработчике даёт те же отсчёты, что фильтрация всей записи сразу.
+
+    Параметры:
+        file_path (str): Путь к EDF-файлу.
+        bounds (list): Границы отрезков (см. shard_bounds).
+        n_samples (int): Длина записи в отсчётах.
+        sfreq (float): Частота дискретизации записи.
+        n_channels (int): Количество каналов записи.
+
+    Возвращает:
+        generator: Для каждого отрезка - состояние фильтра формы (IS-каналы, порядок фильтра);
+            следующее вычисляется, когда предыдущее уже передано обработчику.
+    """
+    channels = min(IS_CHANNELS, n_channels)
+    b, a = _is_filter()
+    is_filter = OnlineFilter(channels, b, a)
+    position = 0
+    for start, _ in bounds:
+        first = _is_first(start)
+        if first > position:
+            source_first, source_last = _source_range(position, first, n_samples, sfreq)
+            model_first, model_data = resample_segment(_read_range(file_path, source_first, source_last, channels),
+                                                       source_first, n_samples, sfreq, SAMPLING_RATE)
+            is_filter(model_data[:, position - model_first:first - model_first])
+            position = first
+        yield is_filter.zi.copy()
+
+
+def _process_shard(file_path, start, stop, n_samples, sfreq, signal_headers, envelope_path, is_state):
+    """
+    Обрабатывает отрезок [start, stop) (в отсчётах с частотой модели) в процессе-обработчике.
+    n_samples и sfreq - длина и частота дискретизации записи, is_state - состояние полосового
+    фильтра IS в начале первого окна отрезка (см. is_filter_states).
+
+    Возвращает:
+        dict: Признаки, позиции и вероятности окон, начинающихся в отрезке;
+            секунды SWD целиком внутри отрезка (для таблицы пиков); высоты пиков DS
+            для секунд, начинающихся в отрезке.
+    """
+    fs = SAMPLING_RATE
+    n_model = resampled_length(n_samples, sfreq, fs)
+    window_size = int(WINDOW_SECONDS * fs)
+    halo = ENVELOPE_OVERLAP + int(SHARD_HALO_SECONDS * fs)
+    is_first = _is_first(start)
+    is_last = min(stop + window_size, n_model)
+    first = min(is_first, max(start - halo, 0))
+    last = max(is_last, min(stop + halo, n_model))
+    source_first, source_last = _source_range(first, last, n_samples, sfreq)
+    n_channels = len(signal_headers)
+    model_channels = channels_to_read(n_channels, IS_CHANNELS, SWD_PRODUCT_PARAMS['channels'])
+    data = _read_range(file_path, source_first, source_last,
+                       channels_to_read(n_channels, IS_CHANNELS, SWD_PRODUCT_PARAMS['channels'],
+                                        DS_PRODUCT_PARAMS['channels']))
+    model_first, model_data = resample_segment(data[:model_channels], source_first, n_samples, sfreq, fs)
+    result = {'start': start}
+
+    # IS: фильтр продолжается с состояния всей записи, признаки - те же extract_features;
+    # окна, начинающиеся в отрезке (как в extract_features - не позже n_samples - window_size)
+    is_filter = OnlineFilter(len(is_state), *_is_filter())
+    is_filter.zi = is_state
+    filtered = is_filter(model_data[:IS_CHANNELS, is_first - model_first:is_last - model_first])
+    features, positions = extract_features(filtered, fs)
+    del filtered
+    features = features.reshape(len(positions), 6 * len(is_state))
+    positions = positions + is_first
+    keep = (positions >= start) & (positions < stop) & (positions < n_model - window_size)
+    features, positions = features[keep], positions[keep]
+    result['features'] = features
+    result['positions'] = positions
+    result['probabilities'] = batch._worker_model.predict(features[..., np.newaxis], verbose=0) if len(features) \
+        else np.zeros((0, 3))
+
+    volts = signals_to_volts(model_data[:SWD_PRODUCT_PARAMS['channels']], signal_headers)
+    del model_data
+
+    # SWD: огибающая отрезка пишется в общий файл, таблица пиков строится по ней в основном процессе
+    filtered = mne.filter.filter_data(volts, fs, SWD_PRODUCT_PARAMS['freq_low'], SWD_PRODUCT_PARAMS['freq_high'],
+                                      verbose=False)
+    del volts
+    envelope = hilbert_envelope(filtered, threads=1, start=start - model_first, stop=stop - model_first)
+    del filtered
+    shared_envelope = np.load(envelope_path, mmap_mode='r+')
+    shared_envelope[:, start:stop] = envelope
+    shared_envelope.flush()
+    del shared_envelope
+    result['swd_first_second'] = math.ceil(start / fs)
+    result['swd_last_second'] = stop // fs
+
+    # DS: секунды, начинающиеся в отрезке, по сигналам с частотой записи
+    volts = signals_to_volts(data[:DS_PRODUCT_PARAMS['channels']], signal_headers)
+    del data
+    ds_first_second = math.ceil(start / fs)
+    ds_last_second = min(math.ceil(stop / fs), int(n_samples / sfreq))
+    result['ds_first_second'] = ds_first_second
+    result['ds_heights'] = ds_peak_heights(
+        volts, sfreq, ds_last_second - ds_first_second, int(ds_first_second * sfreq) - source_first,
+        DS_PRODUCT_PARAMS['cutoff'], DS_PRODUCT_PARAMS['order'], DS_PRODUCT_PARAMS['rate'])
+    return result
+
+
+def annotate_edf_sharded(unannotated_edf_path, model_path, workers=None, shard_seconds=SHARD_SECONDS, threads=1,
+                         feature_cache_dir=FEATURE_CACHE_DIR, detector_cache_dir=DETECTOR_CACHE_DIR,
+                         prediction_cache_dir=PREDICTION_CACHE_DIR):
+    """
+    Аннотирует одну запись (IS, SWD, DS), обрабатывая её отрезки параллельно в процессах.
+
+    Параметры:
+        unannotated_edf_path (str): Путь к неаннотированному EDF-файлу.
+        model_path (str): Путь к файлу модели (загружается в каждом процессе).
+        workers (int): Количество процессов (по умолчанию - число ядер).
+        shard_seconds (float): Длительность отрезка, сек.
+        threads (int): Потоков TensorFlow на процесс.
+        feature_cache_dir (str): Директория кэша признаков; None - не сохранять признаки.
+        detector_cache_dir (str): Директория кэша промежуточных данных SWD/DS; None - временная директория.
+        prediction_cache_dir (str): Директория кэша вероятностей классов; None - не сохранять вероятности.
+
+    Возвращает:
+        status (str): "success" в случае успешного выполнения, иначе сообщение об ошибке.
+        recording (dict): Заголовки и итоговые аннотации ('signals' - None) или None при ошибке.
+    """
+    fs = SAMPLING_RATE
+    temp_dir = None
+    writers = []
+    try:
+        signal_labels, header, signal_headers, existing_annotations, n_samples = load_edf_info(unannotated_edf_path)
+        if signal_labels is None:
+            return "Ошибка: не удалось загрузить EDF-файл.", None
+        sfreq = signal_rate(signal_headers)
+        content_hash = file_sha256(unannotated_edf_path)
+
+        products_dir = detector_cache_dir or tempfile.mkdtemp(prefix="ecog_sharded_")
+        temp_dir = None if detector_cache_dir else products_dir
+        swd_key = detector_cache_key('swd', content_hash, SWD_PRODUCT_PARAMS)
+        ds_key = detector_cache_key('ds', content_hash, DS_PRODUCT_PARAMS)
+        swd_writer = SWDProductsWriter(swd_key, len(signal_labels), n_samples, sfreq, signal_labels, products_dir,
+                                       **SWD_PRODUCT_PARAMS)
+        ds_writer = DSProductsWriter(ds_key, len(signal_labels), n_samples, sfreq, products_dir, **DS_PRODUCT_PARAMS)
+        writers = [swd_writer, ds_writer]
+
+        bounds = shard_bounds(resampled_length(n_samples, sfreq, fs), fs, shard_seconds,
+                              resampling_factors(sfreq, fs)[0])
+        workers = min(workers or os.cpu_count() or 1, len(bounds))
+        print(f"Отрезков: {len(bounds)}, процессов: {workers}")
+        features, positions, probabilities = [], [], []
+        # spawn: TensorFlow не переносит fork после инициализации
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(model_path, threads)) as pool:
+            # Отрезок отправляется обработчику, как только известно состояние фильтра IS в его начале
+            states = is_filter_states(unannotated_edf_path, bounds, n_samples, sfreq, len(signal_labels))
+            futures = [pool.submit(_process_shard, unannotated_edf_path, start, stop, n_samples, sfreq, signal_headers,
+                                   swd_writer.envelope.filename, state)
+                       for (start, stop), state in zip(bounds, states)]
+            # Результаты собираются по порядку отрезков: высоты DS дописываются последовательно
+            for done, future in enumerate(futures, start=1):
+                result = future.result()
+                features.append(result['features'])
+                positions.append(result['positions'])
+                probabilities.append(result['probabilities'])
+                swd_writer.fill_table(result['swd_first_second'], result['swd_last_second'])
+                ds_writer.append(result['ds_first_second'], result['ds_heights'])
+                print(f"Отрезок {done}/{len(bounds)} обработан")
+
+        # Секунды SWD на границах отрезков - по огибающей, записанной соседними процессами
+        for start, _ in bounds[1:]:
+            swd_writer.fill_table(start // fs, math.ceil(start / fs))
+        for writer in writers:
+            writer.commit()
+        writers = []
+        swd_data = load_products(swd_key, products_dir)
+        ds_data = load_products(ds_key, products_dir)
+
+        features = np.concatenate(features)
+        positions = np.concatenate(positions)
+        y_pred_probs = np.concatenate(probabilities)
+        if not len(features):
+            return "Ошибка: не удалось извлечь признаки из данных.", None
+        prediction_key = None
+        if feature_cache_dir:
+            cache_key, cache_params = feature_cache_key(content_hash, fs, LOWCUT, HIGHCUT)
+            save_cached_features(cache_key, cache_params, features, positions, feature_cache_dir)
+            if prediction_cache_dir:
+                prediction_key = prediction_cache_key(cache_key, file_sha256(model_path))
+                save_probabilities(prediction_key, y_pred_probs, positions, prediction_cache_dir)
+
+        annotations_pred = postprocess_predictions(np.argmax(y_pred_probs, axis=1), positions, fs)
+        annotations = combine_annotations(existing_annotations, annotations_pred, swd_data, ds_data)
+        del swd_data, ds_data
+
+        recording = {
+            'file_path': unannotated_edf_path,
+            'signals': None,
+            'n_samples': n_samples,
+            'signal_labels': signal_labels,
+            'header': header,
+            'signal_headers': signal_headers,
+            'sfreq': sfreq,
+            'annotations': annotations,
+            'content_hash': content_hash,
+            'prediction_key': prediction_key
+        }
+        return "success", recording
+
+    except Exception as e:
+        return f"Ошибка: {str(e)}", None
+    finally:
+        for writer in writers:
+            writer.discard()
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Параллельная аннотация одной длинной записи по отрезкам времени")
+    parser.add_argument("input", help="EDF-файл")
+    parser.add_argument("--output", "-o", required=True, help="Директория для аннотированного файла")
+    parser.add_argument("--workers", "-j", type=int, default=None, help="Количество процессов (по умолчанию - число ядер)")
+    parser.add_argument("--shard-seconds", type=float, default=SHARD_SECONDS, help="Длительность отрезка, сек.")
+    parser.add_argument("--model", default=None, help="Путь к cnn_classifier.h5 (или модели, сохранённой joblib)")
+    parser.add_argument("--threads-per-worker", type=int, default=1, help="Потоков TensorFlow на процесс")
+    parser.add_argument("--feature-cache-dir", default=FEATURE_CACHE_DIR, help="Кэш признаков")
+    parser.add_argument("--detector-cache-dir", default=DETECTOR_CACHE_DIR,
+                        help="Кэш огибающих и таблиц пиков SWD/DS для повторной детекции (model.redetect)")
+    parser.add_argument("--no-detector-cache", action="store_true", help="Не сохранять промежуточные данные детекторов")
+    args = parser.parse_args(argv)
+
+    model_path = args.model or os.path.join(os.path.dirname(os.path.abspath(__file__)), "cnn_classifier.h5")
+    os.makedirs(args.output, exist_ok=True)
+    started = time.perf_counter()
+    status, recording = annotate_edf_sharded(
+        os.path.abspath(args.input), model_path, workers=args.workers, shard_seconds=args.shard_seconds,
+        threads=args.threads_per_worker, feature_cache_dir=args.feature_cache_dir,
+        detector_cache_dir=None if args.no_detector_cache else args.detector_cache_dir)
+    if status != "success":
+        raise SystemExit(status)
+    output_path = output_path_for(args.input, args.output)
+    if not save_annotations_streaming(args.input, output_path, recording["annotations"]):
+        raise SystemExit("Не удалось сохранить файл")
+    hours = recording["n_samples"] / recording["sfreq"] / 3600
+    print(f"{hours:.2f} ч. записи за {time.perf_counter() - started:.1f} с: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
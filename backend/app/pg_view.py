@@ -0,0 +1,255 @@
+# pg_view.py
+
+import numpy as np
+import pyqtgraph as pg
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QScrollBar, QVBoxLayout, QWidget
+from app import MainWindow
+from model.annotation_utils import seconds_to_hms
+
+# Разрешение полосы прокрутки: делений на секунду записи
+SCROLL_RESOLUTION = 100
+
+
+class TimeAxisItem(pg.AxisItem):
+    """
+    Ось времени с подписями в формате 'чч:мм:сс'.
+    """
+
+    def tickStrings(self, values, scale, spacing):
+        return [seconds_to_hms(value) for value in values]
+
+
+class ScrollSlider:
+    """
+    Полоса прокрутки Qt с интерфейсом matplotlib Slider
+    (val, valmin, valmax, set_val, on_changed), но с шагом
+    1 / SCROLL_RESOLUTION сек. вместо целых секунд.
+    """
+
+    def __init__(self):
+        self.widget = QScrollBar(Qt.Horizontal)
+        self.widget.setRange(0, 0)
+        self.widget.valueChanged.connect(self._on_value_changed)
+        self.valmin = 0
+        self.valmax = 0
+        self.val = 0
+        self._callbacks = []
+
+    def on_changed(self, callback):
+        self._callbacks.append(callback)
+
+    def set_range(self, valmin, valmax, page):
+        self.valmin = valmin
+        self.valmax = valmax
+        self.widget.setRange(int(valmin * SCROLL_RESOLUTION), int(valmax * SCROLL_RESOLUTION))
+        self.widget.setPageStep(max(int(page * SCROLL_RESOLUTION), 1))
+        self.widget.setSingleStep(max(int(page * SCROLL_RESOLUTION / 100), 1))
+
+    def set_val(self, val):
+        val = min(max(val, self.valmin), self.valmax)
+        self.val = val
+        self.widget.blockSignals(True)
+        self.widget.setValue(int(round(val * SCROLL_RESOLUTION)))
+        self.widget.blockSignals(False)
+        for callback in self._callbacks:
+            callback(val)
+
+    def _on_value_changed(self, value):
+        self.set_val(value / SCROLL_RESOLUTION)
+
+
+class PgMainWindow(MainWindow):
+    """
+    Главное окно с отрисовкой через pyqtgraph (QGraphicsView, при наличии - OpenGL).
+
+    Поддерживает те же возможности, что и matplotlib-версия: три канала,
+    линии и подписи аннотаций, масштабирование, слайдер и обзорную полосу.
+    Прокрутка непрерывная: перетаскивание графика мышью и полоса прокрутки
+    с шагом 1 / SCROLL_RESOLUTION сек.
+    """
+
+    def init_canvas(self):
+        """
+        Создание области графиков pyqtgraph. Возвращает виджет для разделителя.
+        """
+        pg.setConfigOptions(useOpenGL=True, antialias=False, background='w', foreground='k')
+        self.graphics = pg.GraphicsLayoutWidget()
+        self.plots = []
+        self.curves = []
+        self._updating_range = False
+
+        for i in range(3):
+            plot = self.graphics.addPlot(row=i, col=0, axisItems={'bottom': TimeAxisItem(orientation='bottom')})
+            plot.setMouseEnabled(x=True, y=False)
+            plot.showGrid(x=True, y=True, alpha=0.3)
+            plot.hideButtons()
+            curve = plot.plot(pen=pg.mkPen(self.channel_colors[i], width=1))
+            if self.plots:
+                plot.setXLink(self.plots[0])
+            self.plots.append(plot)
+            self.curves.append(curve)
+
+        # Перетаскивание или колесо мыши по каналам прокручивает запись непрерывно
+        self.plots[0].sigXRangeChanged.connect(self.on_x_range_changed)
+
+        # Обзорная полоса всей записи
+        self.overview_plot = self.graphics.addPlot(row=3, col=0, axisItems={'bottom': TimeAxisItem(orientation='bottom')})
+        self.overview_plot.setMouseEnabled(x=False, y=False)
+        self.overview_plot.hideAxis('left')
+        self.overview_plot.hideButtons()
+        self.overview_plot.setMaximumHeight(90)
+        self.overview_plot.scene().sigMouseClicked.connect(self.on_overview_click)
+        self.overview_span = pg.LinearRegionItem(movable=False, brush=pg.mkBrush(255, 215, 0, 100))
+        self.overview_markers = []
+
+        self.annotation_lines = []
+
+        # Полоса прокрутки вместо matplotlib Slider
+        self.slider = ScrollSlider()
+        self.slider.on_changed(self.update_plot)
+
+        widget = QWidget()
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.graphics)
+        layout.addWidget(self.slider.widget)
+        widget.setLayout(layout)
+        return widget
+
+    def set_slider_range(self, max_time):
+        self.slider.set_range(0, max_time, self.window_width)
+
+    def get_view_width_px(self):
+        return self.plots[0].vb.width()
+
+    def init_plot(self):
+        """
+        Инициализация графиков и отрисовка первого окна.
+        """
+        for i, plot in enumerate(self.plots):
+            if i < len(self.raw.ch_names):
+                plot.setTitle(f"Канал {self.raw.ch_names[i]}")
+        self.update_plot(0)
+
+    def update_plot(self, val):
+        """
+        Обновляет данные кривых для текущего положения полосы прокрутки.
+        """
+        start_time = self.slider.val
+        end_time = start_time + self.window_width
+        times, channels = self.get_view_data(start_time, end_time)
+        if len(times) == 0:
+            return
+
+        for i, curve in enumerate(self.curves):
+            if i < len(channels):
+                norm_channel = (channels[i] - np.mean(channels[i])) / np.max(np.abs(channels[i]))
+                curve.setData(times, norm_channel)
+            else:
+                curve.clear()
+
+        # Смена диапазона программно не должна вызывать повторную прокрутку
+        self._updating_range = True
+        for plot in self.plots:
+            plot.setXRange(start_time, end_time, padding=0)
+            plot.setYRange(-self.y_limit, self.y_limit, padding=0)
+        self._updating_range = False
+
+        self.plot_annotations()
+
+    def on_x_range_changed(self, view_box, x_range):
+        """
+        Перетаскивание или масштабирование графика мышью.
+        """
+        if self._updating_range or self.raw is None:
+            return
+        start_time, end_time = x_range
+        width = end_time - start_time
+        if abs(width - self.window_width) > 1e-6:
+            self.window_width = max(width, 1e-3)
+            self.set_slider_range(max(0, self.raw.times[-1] - self.window_width))
+        self.slider.set_val(max(0, start_time))
+
+    def plot_annotations(self):
+        """
+        Отрисовка линий и подписей аннотаций в видимой области.
+        """
+        for plot, line in self.annotation_lines:
+            plot.removeItem(line)
+        self.annotation_lines = []
+
+        start_time = self.slider.val
+        end_time = start_time + self.window_width
+
+        if self.pyramid is not None:
+            self.overview_span.setRegion((start_time, end_time))
+
+        for onset, description in zip(self.raw.annotations.onset, self.raw.annotations.description):
+            if start_time <= onset <= end_time:
+                for i, plot in enumerate(self.plots):
+                    # Подпись выводится только на верхнем канале
+                    label = f"{description}\n{seconds_to_hms(onset)}" if i == 0 else None
+                    line = pg.InfiniteLine(
+                        pos=onset, angle=90, movable=False,
+                        pen=pg.mkPen('purple', style=Qt.DashLine),
+                        label=label, labelOpts={'position': 0.9, 'color': 'purple'}
+                    )
+                    plot.addItem(line)
+                    self.annotation_lines.append((plot, line))
+
+    def plot_overview(self):
+        """
+        Огибающая всей записи на обзорной полосе из кэшированной пирамиды.
+        """
+        self.overview_plot.clear()
+        self.overview_markers = []
+        if self.pyramid is None:
+            return
+
+        times, mins, maxs = self.pyramid.overview()
+        lower = pg.PlotCurveItem(times, mins[0], pen=pg.mkPen(self.channel_colors[0]))
+        upper = pg.PlotCurveItem(times, maxs[0], pen=pg.mkPen(self.channel_colors[0]))
+        self.overview_plot.addItem(lower)
+        self.overview_plot.addItem(upper)
+        self.overview_plot.addItem(pg.FillBetweenItem(lower, upper, brush=pg.mkBrush(self.channel_colors[0])))
+        self.overview_plot.addItem(self.overview_span)
+        self.overview_plot.setXRange(0, self.pyramid.n_times / self.pyramid.sfreq, padding=0)
+        self.overview_envelope_range = (float(np.min(mins[0])), float(np.max(maxs[0])))
+
+    def plot_overview_markers(self):
+        """
+        Плотность маркеров IS/SWD/DS поверх огибающей на обзорной полосе.
+        """
+        for item in self.overview_markers:
+            self.overview_plot.removeItem(item)
+        self.overview_markers = []
+        if self.raw is None or self.pyramid is None:
+            return
+
+        duration = self.pyramid.n_times / self.pyramid.sfreq
+        bins = np.linspace(0, duration, 201)
+        onsets = np.asarray(self.raw.annotations.onset)
+        descriptions = np.asarray(self.raw.annotations.description).astype(str)
+        low, high = self.overview_envelope_range
+        for marker_type, color in self.marker_colors.items():
+            mask = np.char.startswith(descriptions, marker_type) if len(descriptions) else []
+            if not np.any(mask):
+                continue
+            counts, _ = np.histogram(onsets[mask], bins=bins)
+            # Гистограмма масштабируется в диапазон огибающей
+            scaled = low + (high - low) * counts / max(counts.max(), 1)
+            item = pg.PlotCurveItem(bins, scaled, stepMode='center', pen=pg.mkPen(color, width=2))
+            self.overview_plot.addItem(item)
+            self.overview_markers.append(item)
+
+    def on_overview_click(self, event):
+        """
+        Переход к месту записи по клику на обзорной полосе.
+        """
+        if self.raw is None or self.pyramid is None:
+            return
+        if not self.overview_plot.sceneBoundingRect().contains(event.scenePos()):
+            return
+        x = self.overview_plot.vb.mapSceneToView(event.scenePos()).x()
+        self.slider.set_val(min(max(0, x - self.window_width / 2), self.slider.valmax))
@@ -0,0 +1,200 @@
+# view_utils.py
+
+import os
+import numpy as np
+
+# Размер корзины нижнего уровня пирамиды (в отсчётах)
+BASE_BUCKET = 16
+# Во сколько раз укрупняется корзина на каждом следующем уровне
+LEVEL_FACTOR = 4
+# Порог "отсчётов на пиксель", выше которого рисуется огибающая
+LOD_THRESHOLD = 2.0
+# Размер блока чтения при построении пирамиды (в отсчётах)
+READ_CHUNK = BASE_BUCKET * 65536
+
+# Пирамида текущего файла: (ключ, пирамида), ключ - (путь, время изменения).
+# Хранится одна запись: при открытии другого файла прежняя пирамида освобождается
+_pyramid_cache = {}
+
+
+class MinMaxPyramid:
+    """
+    Многоуровневая min/max-огибающая сигнала для отрисовки
+    с уровнем детализации (LOD).
+
+    Уровень 0 хранит минимум и максимум по корзинам из BASE_BUCKET
+    отсчётов, каждый следующий уровень укрупняет корзину в LEVEL_FACTOR раз.
+    """
+
+    def __init__(self, levels, sfreq, n_times):
+        """
+        Параметры:
+            levels (list): Список пар (bucket, mins, maxs), mins/maxs формы (n_channels, n_buckets).
+            sfreq (float): Частота дискретизации.
+            n_times (int): Количество отсчётов в записи.
+        """
+        self.levels = levels
+        self.sfreq = sfreq
+        self.n_times = n_times
+
+    @classmethod
+    def from_raw(cls, raw, n_channels=3):
+        """
+        Строит пирамиду по mne.io.Raw, читая данные блоками.
+
+        Параметры:
+            raw (mne.io.Raw): Запись (может быть без preload).
+            n_channels (int): Количество отображаемых каналов.
+
+        Возвращает:
+            MinMaxPyramid: Построенная пирамида.
+        """
+        n_channels = min(n_channels, len(raw.ch_names))
+        n_times = raw.n_times
+        n_buckets = int(np.ceil(n_times / BASE_BUCKET))
+        mins = np.empty((n_channels, n_buckets), dtype=np.float32)
+        maxs = np.empty((n_channels, n_buckets), dtype=np.float32)
+
+        # Нижний уровень считается за один проход по файлу
+        for start in range(0, n_times, READ_CHUNK):
+            stop = min(start + READ_CHUNK, n_times)
+            block = raw.get_data(picks=list(range(n_channels)), start=start, stop=stop)
+            b_start = start // BASE_BUCKET
+            block_min, block_max = _reduce_min_max(block, block, BASE_BUCKET)
+            mins[:, b_start:b_start + block_min.shape[1]] = block_min
+            maxs[:, b_start:b_start + block_max.shape[1]] = block_max
+
+        return cls(_build_levels(mins, maxs), raw.info['sfreq'], n_times)
+
+    @classmethod
+    def cached(cls, file_path, raw, n_channels=3):
+        """
+        Возвращает пирамиду для файла из кэша или строит её.
+        Кэш хранит пирамиду только последнего открытого файла.
+
+        Параметры:
+            file_path (str): Путь к EDF-файлу (ключ кэша).
+            raw (mne.io.Raw): Запись.
+            n_channels (int): Количество отображаемых каналов.
+
+        Возвращает:
+            MinMaxPyramid: Пирамида для файла.
+        """
+        try:
+            key = (os.path.abspath(file_path), os.path.getmtime(file_path))
+        except OSError:
+            key = (file_path, None)
+        pyramid = _pyramid_cache.get(key)
+        if pyramid is None:
+            _pyramid_cache.clear()
+            pyramid = cls.from_raw(raw, n_channels)
+            _pyramid_cache[key] = pyramid
+        return pyramid
+
+    def samples_per_pixel(self, start_time, end_time, width_px):
+        """
+        Количество отсчётов, приходящихся на один пиксель по оси X.
+        """
+        return (end_time - start_time) * self.sfreq / max(int(width_px), 1)
+
+    def envelope(self, start_time, end_time, width_px):
+        """
+        Возвращает min/max-огибающую видимого интервала, сведённую
+        к ширине экрана в пикселях.
+
+        Параметры:
+            start_time (float): Начало интервала (сек.).
+            end_time (float): Конец интервала (сек.).
+            width_px (int): Ширина области отрисовки в пикселях.
+
+        Возвращает:
+            times (ndarray): Время центра каждого столбца.
+            mins (ndarray): Минимумы формы (n_channels, n_columns).
+            maxs (ndarray): Максимумы формы (n_channels, n_columns).
+        """
+        width_px = max(int(width_px), 1)
+        spp = self.samples_per_pixel(start_time, end_time, width_px)
+
+        # Самый крупный уровень, корзина которого не превышает пиксель
+        bucket, level_mins, level_maxs = self.levels[0]
+        for level in self.levels:
+            if level[0] <= spp:
+                bucket, level_mins, level_maxs = level
+            else:
+                break
+
+        first = max(int(start_time * self.sfreq) // bucket, 0)
+        last = min(int(np.ceil(end_time * self.sfreq / bucket)), level_mins.shape[1])
+        if first >= last:
+            empty = np.empty((level_mins.shape[0], 0), dtype=np.float32)
+            return np.empty(0), empty, empty
+
+        mins = level_mins[:, first:last]
+        maxs = level_maxs[:, first:last]
+
+        # Доведение числа корзин до числа столбцов экрана
+        per_column = max(int(np.ceil(mins.shape[1] / width_px)), 1)
+        mins, maxs = _reduce_min_max(mins, maxs, per_column)
+
+        column = bucket * per_column
+        times = (first * bucket + column * (np.arange(mins.shape[1]) + 0.5)) / self.sfreq
+        return times, mins, maxs
+
+    def overview(self, max_columns=2000):
+        """
+        Огибающая всей записи на самом подходящем уровне пирамиды.
+
+        Параметры:
+            max_columns (int): Максимальное число столбцов.
+
+        Возвращает:
+            times, mins, maxs: См. envelope().
+        """
+        duration = self.n_times / self.sfreq
+        return self.envelope(0, duration, max_columns)
+
+
+def _reduce_min_max(mins, maxs, factor):
+    """
+    Сворачивает массивы min/max по последней оси группами по factor элементов.
+    """
+    n = mins.shape[1]
+    n_full = n // factor
+    parts_min = []
+    parts_max = []
+    if n_full:
+        parts_min.append(mins[:, :n_full * factor].reshape(mins.shape[0], n_full, factor).min(axis=2))
+        parts_max.append(maxs[:, :n_full * factor].reshape(maxs.shape[0], n_full, factor).max(axis=2))
+    if n_full * factor < n:
+        parts_min.append(mins[:, n_full * factor:].min(axis=1, keepdims=True))
+        parts_max.append(maxs[:, n_full * factor:].max(axis=1, keepdims=True))
+    return np.hstack(parts_min), np.hstack(parts_max)
+
+
+def _build_levels(mins, maxs):
+    """
+    Строит уровни пирамиды, начиная с нижнего.
+    """
+    levels = [(BASE_BUCKET, mins, maxs)]
+    bucket = BASE_BUCKET
+    while mins.shape[1] > 1:
+        mins, maxs = _reduce_min_max(mins, maxs, LEVEL_FACTOR)
+        bucket *= LEVEL_FACTOR
+        levels.append((bucket, mins, maxs))
+    return levels
+
+
+def interleave_envelope(times, mins, maxs):
+    """
+    Преобразует огибающую в ломаную для ax.plot: каждая колонка
+    даёт вертикальный отрезок от минимума до максимума.
+
+    Возвращает:
+        x (ndarray): Координаты X длиной 2 * n_columns.
+        y (ndarray): Значения формы (n_channels, 2 * n_columns).
+    """
+    x = np.repeat(times, 2)
+    y = np.empty((mins.shape[0], mins.shape[1] * 2), dtype=mins.dtype)
+    y[:, 0::2] = mins
+    y[:, 1::2] = maxs
+    return x, y
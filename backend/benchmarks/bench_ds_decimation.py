@@ -0,0 +1,130 @@
+# bench_ds_decimation.py
+#
+# Детектор DS с прореживанием перед поиском пиков (ds_products с rate) против поиска пиков
+# на исходной частоте (rate=None, совпадает с исходным detect_ds - см. backend/tests/test_ds_detection.py):
+# время и совпадение промежуточных данных и результата детекции.
+# Код возврата 1, если коэффициент Жаккара секунд интервалов DS ниже --min-jaccard.
+#
+#     python bench_ds_decimation.py --hours 4 --rates 40 50 100
+#     python bench_ds_decimation.py D:/recordings/rat1.edf D:/recordings/rat2.edf
+
+import argparse
+import json
+import os
+import sys
+import time
+import mne
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "server"))
+
+from ds_detection import DS_PARAMS, detect_ds_from_products, ds_products
+from synthetic_edf import generate_edf
+
+
+def _timed(function, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _max_heights(products):
+    offsets = products['offsets']
+    counts = np.diff(offsets)
+    highest = np.full(len(counts), np.nan)
+    highest[counts > 0] = products['heights'][offsets[:-1][counts > 0]]
+    return highest
+
+
+def _counts_above(products, threshold):
+    above = np.zeros(len(products['heights']) + 1, dtype=np.int64)
+    np.cumsum(products['heights'] >= threshold, out=above[1:])
+    return above[products['offsets'][1:]] - above[products['offsets'][:-1]]
+
+
+def _seconds(intervals):
+    return {second for interval in intervals
+            for second in range(interval['start_second'], interval['end_second'] + 1)}
+
+
+def compare_products(reference, decimated):
+    """
+    Совпадение промежуточных данных и детекции DS с параметрами по умолчанию.
+    """
+    threshold = DS_PARAMS['lower_amplitude_threshold']
+    ref_max, dec_max = _max_heights(reference), _max_heights(decimated)
+    valid = ~np.isnan(ref_max) & ~np.isnan(dec_max) & (ref_max >= threshold)
+    errors = np.abs(dec_max[valid] - ref_max[valid]) / ref_max[valid]
+    # Подходящие секунды - серии длительностью от 1 с
+    ref_seconds = _seconds(detect_ds_from_products(reference, **dict(DS_PARAMS, min_duration=1)))
+    dec_seconds = _seconds(detect_ds_from_products(decimated, **dict(DS_PARAMS, min_duration=1)))
+    ref_intervals = detect_ds_from_products(reference)
+    dec_intervals = detect_ds_from_products(decimated)
+    ref_ds, dec_ds = _seconds(ref_intervals), _seconds(dec_intervals)
+    return {
+        "max_height_error_p50": float(np.percentile(errors, 50)) if len(errors) else 0.0,
+        "max_height_error_p99": float(np.percentile(errors, 99)) if len(errors) else 0.0,
+        "count_agreement": float(np.mean(_counts_above(reference, threshold) == _counts_above(decimated, threshold))),
+        "second_agreement": 1.0 - len(ref_seconds ^ dec_seconds) / reference['n_seconds'],
+        "intervals": [len(ref_intervals), len(dec_intervals)],
+        "interval_seconds_jaccard": len(ref_ds & dec_ds) / len(ref_ds | dec_ds) if ref_ds | dec_ds else 1.0,
+    }
+
+
+def bench_file(edf_path, rates, repeat):
+    raw = mne.io.read_raw_edf(edf_path, preload=True, verbose=False)
+    data, sfreq = raw.get_data(), raw.info['sfreq']
+    reference_seconds, reference = _timed(lambda: ds_products(data, sfreq, rate=None), repeat)
+    result = {"sfreq": sfreq, "full_rate_seconds": reference_seconds, "rates": {}}
+    for rate in rates:
+        seconds, decimated = _timed(lambda: ds_products(data, sfreq, rate=rate), repeat)
+        result["rates"][f"{rate:g}"] = dict(seconds=seconds, speedup=reference_seconds / seconds,
+                                             **compare_products(reference, decimated))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Прореживание перед поиском пиков DS: время и совпадение с исходной частотой")
+    parser.add_argument("files", nargs="*", help="EDF-файлы (по умолчанию - синтетическая запись)")
+    parser.add_argument("--hours", type=float, default=1.0, help="Длительность синтетической записи, ч.")
+    parser.add_argument("--data-dir", default=os.path.join(BENCH_DIR, "data"), help="Куда складывать синтетические EDF")
+    parser.add_argument("--rates", type=float, nargs="+", default=[50, 100], help="Частоты прореживания, Гц")
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов для замера времени")
+    parser.add_argument("--min-jaccard", type=float, default=1.0,
+                        help="Минимальный коэффициент Жаккара секунд интервалов DS (1 - интервалы совпадают)")
+    parser.add_argument("--output", "-o", default=None, help="JSON-отчёт")
+    args = parser.parse_args(argv)
+
+    files = args.files
+    if not files:
+        edf_path = os.path.join(args.data_dir, f"synthetic_{args.hours:g}h.edf")
+        if not os.path.exists(edf_path):
+            generate_edf(edf_path, hours=args.hours)
+        files = [edf_path]
+
+    report = {}
+    failed = False
+    for edf_path in files:
+        result = report[edf_path] = bench_file(edf_path, args.rates, args.repeat)
+        print(f"{os.path.basename(edf_path)}: исходная частота {result['full_rate_seconds']:.3f} с")
+        for rate, item in result["rates"].items():
+            print(f"  {rate} Гц: {item['seconds']:.3f} с (x{item['speedup']:.1f}), "
+                  f"секунд совпало {item['second_agreement']:.4f}, пиков выше порога {item['count_agreement']:.4f}, "
+                  f"ошибка высоты p99 {item['max_height_error_p99']:.1e}, "
+                  f"интервалов {item['intervals'][0]} -> {item['intervals'][1]}, "
+                  f"Жаккар секунд DS {item['interval_seconds_jaccard']:.4f}")
+            failed |= item['interval_seconds_jaccard'] < args.min_jaccard
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# bench_envelope.py
+#
+# Огибающая SWD на "неудобных" длинах записи: scipy.signal.hilbert по всей длине
+# против блочного hilbert_envelope (блоки next_fast_len, float32, потоки).
+# Длина записи с большими простыми множителями замедляет БПФ по всей длине,
+# блочный расчёт от длины не зависит.
+#
+#     python bench_envelope.py --hours 1 --output envelope_report.json
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from scipy.signal import butter, hilbert, sosfiltfilt
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "server"))
+
+from swd_detection import ENVELOPE_THREADS, SWD_FREQ_HIGH, SWD_FREQ_LOW, hilbert_envelope
+
+FS = 400
+N_CHANNELS = 3
+
+
+def is_prime(n):
+    if n < 2:
+        return False
+    for divisor in range(2, int(n ** 0.5) + 1):
+        if n % divisor == 0:
+            return False
+    return True
+
+
+def next_prime(n):
+    while not is_prime(n):
+        n += 1
+    return n
+
+
+def awkward_lengths(n_samples):
+    """
+    Длины записи около n_samples: гладкая (степени 2, 3, 5), простая
+    и удвоенное простое (БПФ по всей длине - алгоритм Блюстейна).
+    """
+    prime = next_prime(n_samples)
+    half_prime = next_prime(n_samples // 2)
+    return {
+        "smooth": n_samples - n_samples % 2000,
+        "prime": prime,
+        "2 * prime": 2 * half_prime,
+    }
+
+
+def _timed(function, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_length(n_samples, repeat, threads, rng):
+    """
+    Замер одного размера: время, объём результата и расхождение блочной огибающей
+    с огибающей по всей длине вдали от краёв записи.
+    """
+    # Шум в полосе SWD - как сигнал после фильтра swd_envelope
+    sos = butter(4, [SWD_FREQ_LOW, SWD_FREQ_HIGH], btype='band', fs=FS, output='sos')
+    data = sosfiltfilt(sos, rng.standard_normal((N_CHANNELS, n_samples)))
+    full_seconds, full = _timed(lambda: np.abs(hilbert(data)), repeat)
+    block_seconds, blocks = _timed(lambda: hilbert_envelope(data, threads=threads), repeat)
+    # Начало и конец записи у БПФ по всей длине искажены циклическим переносом
+    interior = slice(60 * FS, n_samples - 60 * FS)
+    error = float(np.max(np.abs(full[:, interior] - blocks[:, interior])) / np.max(np.abs(full[:, interior])))
+    return {
+        "n_samples": n_samples,
+        "full_seconds": full_seconds,
+        "blockwise_seconds": block_seconds,
+        "speedup": full_seconds / block_seconds if block_seconds > 0 else None,
+        # Аналитический сигнал по всей длине - complex128
+        "full_analytic_mb": full.size * 16 / 2 ** 20,
+        "blockwise_output_mb": blocks.nbytes / 2 ** 20,
+        "max_relative_error": error,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк огибающей SWD на простых и составных длинах записи")
+    parser.add_argument("--hours", type=float, default=1.0, help="Примерная длительность записи, ч.")
+    parser.add_argument("--repeat", type=int, default=1, help="Повторов для замера времени")
+    parser.add_argument("--threads", type=int, default=ENVELOPE_THREADS, help="Потоков для блоков огибающей")
+    parser.add_argument("--output", "-o", default=None, help="JSON-отчёт")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    report = {"hours": args.hours, "threads": args.threads, "channels": N_CHANNELS, "lengths": {}}
+    for name, n_samples in awkward_lengths(int(args.hours * 3600 * FS)).items():
+        result = bench_length(n_samples, args.repeat, args.threads, rng)
+        report["lengths"][name] = result
+        print(f"{name:>10} ({n_samples} отсч.): hilbert {result['full_seconds']:.2f} с, "
+              f"блоками {result['blockwise_seconds']:.2f} с (x{result['speedup']:.1f}), "
+              f"результат {result['full_analytic_mb']:.0f} -> {result['blockwise_output_mb']:.0f} МБ, "
+              f"расхождение {result['max_relative_error']:.1e}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
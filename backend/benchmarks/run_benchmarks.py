@@ -0,0 +1,286 @@
+# run_benchmarks.py
+#
+# Поэтапный бенчмарк конвейеров upload_edf (HTTP сервер) и annotate_edf (Windows клиент)
+# на синтетических EDF+ файлах.
+#
+#     python run_benchmarks.py --hours 1 24 --output report.json
+#     python run_benchmarks.py --hours 1 --output report.json --baseline baseline.json
+#     python run_benchmarks.py --hours 1 --output baseline.json   # сохранить новый baseline
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+
+from synthetic_edf import generate_edf
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(BENCH_DIR, "..", "server")
+APP_DIR = os.path.join(BENCH_DIR, "..", "app")
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, APP_DIR)
+
+# Модули сервера (плоские) и клиента (пакет model) импортируются бок о бок
+import annotation_utils as server_annotations
+import data_processing as server_processing
+import detector_runner as server_detectors
+import edf_stream as server_stream
+import edf_utils as server_edf
+import resampling as server_resampling
+from feature_cache import file_sha256
+from model_utils import load_model_keras
+from swd_detection import SWD_PRODUCT_PARAMS
+from ds_detection import DS_PRODUCT_PARAMS
+from model import main as app_main
+from model import detector_runner as app_detectors
+from model import edf_utils as app_edf
+from model import edf_stream as app_stream
+from model import resampling as app_resampling
+
+FS = 400
+LOWCUT = 0.5
+HIGHCUT = 100
+# Каналы, которые декодируют оба конвейера: IS, SWD и DS
+STAGE_CHANNELS = (server_processing.IS_CHANNELS, SWD_PRODUCT_PARAMS['channels'], DS_PRODUCT_PARAMS['channels'])
+
+
+class StageRecorder:
+    """
+    Замер времени и пикового прироста памяти (tracemalloc) для каждого этапа.
+    """
+
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - started
+        result = {"seconds": elapsed}
+        if self.trace_memory:
+            result["peak_mb"] = (tracemalloc.get_traced_memory()[1] - baseline) / 2 ** 20
+        self.stages[name] = result
+
+
+def _filter_all(signals):
+    filtered = []
+    for i in range(signals.shape[0]):
+        filtered.append(server_processing.bandpass_filter(signals[i], LOWCUT, HIGHCUT, FS))
+    return np.array(filtered)
+
+
+def _merge(annotations):
+    merged = []
+    for annotation_type in ("is", "swd", "ds"):
+        merged += server_annotations.merge_overlapping_annotations(annotations, annotation_type)
+    merged.sort(key=lambda x: x[0])
+    return merged
+
+
+def bench_upload_edf(edf_path, model, recorder, work_dir):
+    """
+    Этапы process_uploaded_edf из backend/server/main.py (без кэша признаков; кэш детекторов
+    каждый прогон пустой - как при первой загрузке файла).
+    """
+    stage = recorder.stage
+    content_hash = file_sha256(edf_path)  # На сервере считается при приёме файла
+    detector_cache_dir = tempfile.mkdtemp(dir=work_dir)
+    with stage("read_edf"):
+        signals, labels, header, signal_headers, existing = server_edf.read_edf_with_annotations(
+            edf_path, channels=STAGE_CHANNELS)
+    sfreq = server_resampling.signal_rate(signal_headers)
+    with stage("resample"):
+        model_signals, _ = server_resampling.resample(signals[:server_processing.IS_CHANNELS], sfreq, FS)
+    with stage("bandpass_filter"):
+        filtered = _filter_all(model_signals)
+    del model_signals
+    with stage("extract_features"):
+        features, positions = server_processing.extract_features(filtered, FS)
+    del filtered
+    with stage("predict"):
+        y_pred = np.argmax(model.predict(features.reshape((features.shape[0], features.shape[1], 1)), verbose=0), axis=1)
+    with stage("postprocess"):
+        is_annotations = list(existing) + server_annotations.postprocess_predictions(y_pred, positions, FS)
+    with stage("detect"):
+        data = server_edf.signals_to_volts(signals[:server_detectors.detector_channels(len(signals))], signal_headers)
+        detections = server_detectors.run_detectors(data, sfreq, labels, content_hash, detector_cache_dir)
+        del data
+    swd = server_annotations.convert_swd_annotations_to_tuples(detections['swd']['intervals'])
+    ds = server_annotations.convert_ds_annotations_to_tuples(detections['ds']['intervals'])
+    with stage("merge_annotations"):
+        final = _merge(is_annotations + swd + ds)
+    with stage("write_final_edf"):
+        server_stream.save_annotations_streaming(edf_path, os.path.join(work_dir, "final_upload.edf"), final)
+
+
+def bench_annotate_edf(edf_path, model, recorder, work_dir):
+    """
+    Этапы annotate_edf из backend/app/model/main.py (без кэшей) и сохранения из клиента.
+    """
+    stage = recorder.stage
+    with stage("read_edf"):
+        signals, labels, header, signal_headers, existing = app_edf.load_edf_with_annotations(
+            edf_path, channels=STAGE_CHANNELS)
+    sfreq = app_resampling.signal_rate(signal_headers)
+    with stage("resample"):
+        model_signals, _ = app_resampling.resample(signals[:server_processing.IS_CHANNELS], sfreq, FS)
+    with stage("bandpass_filter"):
+        filtered = _filter_all(model_signals)
+    del model_signals
+    with stage("extract_features"):
+        features, positions = server_processing.extract_features(filtered, FS)
+    del filtered
+    with stage("predict"):
+        y_pred = np.argmax(model.predict(features.reshape((features.shape[0], features.shape[1], 1)), verbose=0), axis=1)
+    with stage("postprocess"):
+        annotations_pred = app_main.postprocess_predictions(y_pred, positions, FS)
+    with stage("detect"):
+        data = app_edf.signals_to_volts(signals[:app_detectors.detector_channels(len(signals))], signal_headers)
+        detections = app_detectors.run_detectors(data, sfreq, labels, detect=False)
+        del data
+    with stage("merge_annotations"):
+        final = app_main.combine_annotations(list(existing), annotations_pred,
+                                             detections['swd']['products'], detections['ds']['products'])
+    with stage("save_streaming"):
+        app_stream.save_annotations_streaming(edf_path, os.path.join(work_dir, "annotated.edf"), final)
+
+
+PIPELINES = {
+    "upload_edf": bench_upload_edf,
+    "annotate_edf": bench_annotate_edf,
+}
+
+
+def run_pipeline(pipeline, edf_path, model, repeat, trace_memory):
+    """
+    Прогоняет конвейер: repeat раз для времени (берётся минимум) и один раз под tracemalloc для памяти.
+
+    Возвращает:
+        dict: {этап: {'seconds', 'peak_mb'}}.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for _ in range(repeat):
+            recorder = StageRecorder(trace_memory=False)
+            PIPELINES[pipeline](edf_path, model, recorder, work_dir)
+            for name, value in recorder.stages.items():
+                best = results.setdefault(name, {"seconds": value["seconds"]})
+                best["seconds"] = min(best["seconds"], value["seconds"])
+
+        if trace_memory:
+            tracemalloc.start()
+            try:
+                recorder = StageRecorder(trace_memory=True)
+                PIPELINES[pipeline](edf_path, model, recorder, work_dir)
+            finally:
+                tracemalloc.stop()
+            for name, value in recorder.stages.items():
+                results.setdefault(name, {})["peak_mb"] = value["peak_mb"]
+
+    results["total"] = {"seconds": sum(v["seconds"] for v in results.values())}
+    return results
+
+
+def compare_reports(current, baseline, tolerance):
+    """
+    Сравнивает отчёт с baseline.
+
+    Параметры:
+        current (dict): Текущий отчёт.
+        baseline (dict): Сохранённый отчёт.
+        tolerance (float): Допустимое относительное ухудшение (0.2 = +20%).
+
+    Возвращает:
+        list: Строки с найденными регрессиями.
+    """
+    regressions = []
+    for size, pipelines in current["results"].items():
+        for pipeline, stages in pipelines.items():
+            base_stages = baseline.get("results", {}).get(size, {}).get(pipeline, {})
+            for name, value in stages.items():
+                base = base_stages.get(name)
+                if not base:
+                    continue
+                for metric in ("seconds", "peak_mb"):
+                    if metric not in value or metric not in base or base[metric] <= 0:
+                        continue
+                    ratio = value[metric] / base[metric]
+                    marker = ""
+                    if ratio > 1 + tolerance:
+                        marker = "  <-- регрессия"
+                        regressions.append(f"{size} {pipeline}.{name} {metric}: x{ratio:.2f}")
+                    print(f"{size:>6} {pipeline:>13}.{name:<18} {metric:<8} "
+                          f"{base[metric]:10.3f} -> {value[metric]:10.3f} (x{ratio:.2f}){marker}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Поэтапный бенчмарк конвейеров разметки ЭКоГ")
+    parser.add_argument("--hours", type=float, nargs="+", default=[1.0], help="Длительности синтетических записей, ч. (1-72)")
+    parser.add_argument("--pipelines", nargs="+", default=list(PIPELINES), choices=list(PIPELINES))
+    parser.add_argument("--data-dir", default=os.path.join(BENCH_DIR, "data"), help="Куда складывать синтетические EDF")
+    parser.add_argument("--model", default=os.path.join(SERVER_DIR, "cnn_classifier.h5"))
+    parser.add_argument("--repeat", type=int, default=1, help="Повторов для замера времени")
+    parser.add_argument("--no-memory", action="store_true", help="Не замерять память (tracemalloc)")
+    parser.add_argument("--output", "-o", default="benchmark_report.json", help="JSON-отчёт")
+    parser.add_argument("--baseline", default=None, help="JSON-отчёт для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Допустимое ухудшение относительно baseline")
+    args = parser.parse_args(argv)
+
+    model = load_model_keras(args.model)
+    if model is None:
+        print("Не удалось загрузить модель")
+        return 2
+
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+
+    for hours in args.hours:
+        size = f"{hours:g}h"
+        edf_path = os.path.join(args.data_dir, f"synthetic_{size}.edf")
+        if not os.path.exists(edf_path):
+            generate_edf(edf_path, hours=hours)
+        report["results"][size] = {}
+        for pipeline in args.pipelines:
+            print(f"Бенчмарк {pipeline} на {size}...")
+            report["results"][size][pipeline] = run_pipeline(pipeline, edf_path, model, args.repeat, not args.no_memory)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Отчёт сохранён: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.tolerance)
+        if regressions:
+            print("Найдены регрессии:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
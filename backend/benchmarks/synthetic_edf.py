@@ -0,0 +1,139 @@
+# synthetic_edf.py
+#
+# Генератор синтетических EDF+ файлов ЭКоГ для бенчмарков:
+# 3 канала, 400 Гц, фоновый шум с наложенными SWD- и DS-подобными вставками.
+#
+#     python synthetic_edf.py --hours 24 --output data/synthetic_24h.edf
+
+import argparse
+import json
+import os
+import numpy as np
+import pyedflib
+from scipy.signal import lfilter
+
+FS = 400
+N_CHANNELS = 3
+# Длина блока генерации, сек. (файл пишется блоками, память не растёт с длиной записи)
+BLOCK_SECONDS = 600
+
+# Амплитуды в мкВ: SWD выше порога огибающей детектора (500 мкВ),
+# DS в коридоре порогов пиков (80-300 мкВ)
+BACKGROUND_UV = 40.0
+SWD_UV = 900.0
+DS_UV = 180.0
+
+
+def plan_events(duration_seconds, swd_per_hour, ds_per_hour, rng):
+    """
+    Случайно размещает непересекающиеся вставки SWD и DS.
+
+    Возвращает:
+        list: Список словарей {'type', 'start', 'end'} в секундах.
+    """
+    events = []
+    hours = duration_seconds / 3600
+    occupied = []
+    for event_type, per_hour, (min_len, max_len) in (('swd', swd_per_hour, (3, 12)), ('ds', ds_per_hour, (9, 25))):
+        for _ in range(int(round(per_hour * hours))):
+            for _attempt in range(20):
+                length = rng.uniform(min_len, max_len)
+                start = rng.uniform(5, max(duration_seconds - length - 5, 6))
+                end = start + length
+                if all(end + 5 < s or start - 5 > e for s, e in occupied):
+                    occupied.append((start, end))
+                    events.append({'type': event_type, 'start': round(start, 3), 'end': round(end, 3)})
+                    break
+    events.sort(key=lambda x: x['start'])
+    return events
+
+
+def _background(n_samples, rng, state):
+    """
+    Фон: белый шум через однополюсный НЧ-фильтр (близко к 1/f спектру ЭКоГ).
+    """
+    noise = rng.standard_normal((N_CHANNELS, n_samples))
+    out, state = lfilter([1.0], [1.0, -0.95], noise, axis=1, zi=state)
+    return out * BACKGROUND_UV * 0.3, state
+
+
+def _burst(event_type, t):
+    """
+    Форма вставки во времени t (сек. от начала вставки).
+    """
+    if event_type == 'swd':
+        # Пик-волна ~8 Гц: узкий спайк + медленная волна
+        phase = (t * 8.0) % 1.0
+        spike = np.exp(-((phase - 0.1) / 0.03) ** 2)
+        wave = -0.5 * np.sin(2 * np.pi * phase)
+        return SWD_UV * (spike + wave)
+    # DS: медленные волны 2-3 Гц
+    return DS_UV * np.sin(2 * np.pi * 2.5 * t) * (0.8 + 0.2 * np.sin(2 * np.pi * 0.3 * t))
+
+
+def generate_edf(output_path, hours=1.0, swd_per_hour=30, ds_per_hour=20, seed=0):
+    """
+    Создаёт синтетический EDF+ файл и JSON-файл с заложенными событиями рядом с ним.
+
+    Параметры:
+        output_path (str): Путь к создаваемому EDF-файлу.
+        hours (float): Длительность записи в часах.
+        swd_per_hour (float): Количество SWD-вставок в час.
+        ds_per_hour (float): Количество DS-вставок в час.
+        seed (int): Зерно генератора случайных чисел.
+
+    Возвращает:
+        list: Заложенные события.
+    """
+    rng = np.random.default_rng(seed)
+    duration_seconds = int(hours * 3600)
+    events = plan_events(duration_seconds, swd_per_hour, ds_per_hour, rng)
+
+    signal_headers = [{
+        'label': f'ECoG{i + 1}', 'dimension': 'uV', 'sample_frequency': FS,
+        'physical_max': 5000.0, 'physical_min': -5000.0,
+        'digital_max': 32767, 'digital_min': -32768,
+        'prefilter': '', 'transducer': ''
+    } for i in range(N_CHANNELS)]
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    writer = pyedflib.EdfWriter(output_path, N_CHANNELS, file_type=pyedflib.FILETYPE_EDFPLUS)
+    try:
+        writer.setSignalHeaders(signal_headers)
+        state = np.zeros((N_CHANNELS, 1))
+        for block_start in range(0, duration_seconds, BLOCK_SECONDS):
+            block_seconds = min(BLOCK_SECONDS, duration_seconds - block_start)
+            n = block_seconds * FS
+            block, state = _background(n, rng, state)
+            t_block = block_start + np.arange(n) / FS
+            for event in events:
+                if event['end'] <= block_start or event['start'] >= block_start + block_seconds:
+                    continue
+                mask = (t_block >= event['start']) & (t_block < event['end'])
+                burst = _burst(event['type'], t_block[mask] - event['start'])
+                # Небольшие различия амплитуды между каналами
+                for ch in range(N_CHANNELS):
+                    block[ch, mask] += burst * (1.0 - 0.1 * ch)
+            writer.writeSamples(np.ascontiguousarray(np.clip(block, -4999, 4999)))
+    finally:
+        writer.close()
+
+    with open(f"{os.path.splitext(output_path)[0]}.events.json", 'w', encoding='utf-8') as f:
+        json.dump({'hours': hours, 'fs': FS, 'seed': seed, 'events': events}, f, indent=2)
+    print(f"Синтетический EDF создан: {output_path} ({hours} ч., событий: {len(events)})")
+    return events
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генерация синтетического EDF+ файла ЭКоГ")
+    parser.add_argument("--hours", type=float, default=1.0, help="Длительность записи, ч.")
+    parser.add_argument("--output", "-o", required=True, help="Путь к EDF-файлу")
+    parser.add_argument("--swd-per-hour", type=float, default=30)
+    parser.add_argument("--ds-per-hour", type=float, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    generate_edf(args.output, args.hours, args.swd_per_hour, args.ds_per_hour, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,17 @@
 # data_processing.py
 
+from collections import deque
+from math import gcd
 import numpy as np
 import pyedflib
 from scipy.signal import butter, lfilter, welch
 
+# Окна признаков: длина и шаг, сек.
+WINDOW_SECONDS = 4
+STEP_SECONDS = 2
+# Каналов (первых в записи), по которым считаются признаки IS: модель обучена на 6 * IS_CHANNELS признаках
+IS_CHANNELS = 3
+
 def load_edf(file_path):
     """
     Загружает сигналы из EDF-файла.
@@ -57,45 +65,184 @@ def bandpass_filter(data, lowcut, highcut, fs, order=5):
         print(f"Ошибка при фильтрации данных: {e}")
         return data
 
-def extract_features(signals, fs):
+def relative_band_powers(window, fs):
+    """
+    Относительные мощности дельта- (0.5-4 Гц) и тета-диапазонов (4-8 Гц) по каждому каналу окна.
+
+    Параметры:
+        window (ndarray): Отфильтрованные сигналы окна формы (n_channels, window_size).
+        fs (float): Частота дискретизации.
+
+    Возвращает:
+        ndarray: Вектор длины 2 * n_channels (сначала дельта, затем тета).
+    """
+    freqs, psd = welch(window, fs=fs, nperseg=window.shape[1])
+    delta_power = np.sum(psd[:, (freqs >= 0.5) & (freqs <= 4)], axis=1)
+    theta_power = np.sum(psd[:, (freqs >= 4) & (freqs <= 8)], axis=1)
+    total_power = np.sum(psd, axis=1)
+    # Избежание деления на ноль
+    total_power[total_power == 0] = 1
+    return np.hstack([delta_power / total_power, theta_power / total_power])
+
+def window_features(window, fs):
+    """
+    Вектор признаков одного окна: среднее, СКО, максимум, минимум
+    и относительные мощности дельта- и тета-диапазонов по каждому каналу.
+
+    Параметры:
+        window (ndarray): Отфильтрованные сигналы окна формы (n_channels, window_size).
+        fs (float): Частота дискретизации.
+
+    Возвращает:
+        ndarray: Вектор признаков длины 6 * n_channels.
+    """
+    # Временные признаки
+    mean = np.mean(window, axis=1)
+    std = np.std(window, axis=1)
+    max_val = np.max(window, axis=1)
+    min_val = np.min(window, axis=1)
+    # Частотные признаки
+    return np.hstack([mean, std, max_val, min_val, relative_band_powers(window, fs)])
+
+def count_windows(n_samples, fs):
+    """
+    Количество окон признаков, которые extract_features выделяет в записи длины n_samples.
+    """
+    return len(range(0, n_samples - int(WINDOW_SECONDS * fs), int(STEP_SECONDS * fs)))
+
+def extract_features(signals, fs, out=None):
     """
     Извлекает признаки из сигналов.
 
     Параметры:
         signals (ndarray): Массив сигналов.
         fs (float): Частота дискретизации.
+        out (ndarray): Массив для признаков формы (count_windows(...), 6 * n_channels), заполняемый
+            на месте (например, в общей памяти); None - новый массив.
 
     Возвращает:
         features (ndarray): Массив признаков.
         positions (ndarray): Массив позиций окон.
     """
     try:
-        window_size = int(4 * fs)  # окна по 4 секунды
-        step_size = int(2 * fs)    # шаг в 2 секунды
+        window_size = int(WINDOW_SECONDS * fs)  # окна по 4 секунды
+        step_size = int(STEP_SECONDS * fs)      # шаг в 2 секунды
         features = []
         positions = []
         for start in range(0, signals.shape[1] - window_size, step_size):
             window = signals[:, start:start + window_size]
-            # Временные признаки
-            mean = np.mean(window, axis=1)
-            std = np.std(window, axis=1)
-            max_val = np.max(window, axis=1)
-            min_val = np.min(window, axis=1)
-            # Частотные признаки
-            freqs, psd = welch(window, fs=fs, nperseg=window_size)
-            delta_power = np.sum(psd[:, (freqs >= 0.5) & (freqs <= 4)], axis=1)
-            theta_power = np.sum(psd[:, (freqs >= 4) & (freqs <= 8)], axis=1)
-            total_power = np.sum(psd, axis=1)
-            # Избежание деления на ноль
-            total_power[total_power == 0] = 1
-            delta_rel_power = delta_power / total_power
-            theta_rel_power = theta_power / total_power
-            feature_vector = np.hstack([mean, std, max_val, min_val, delta_rel_power, theta_rel_power])
-            features.append(feature_vector)
+            if out is None:
+                features.append(window_features(window, fs))
+            else:
+                out[len(positions)] = window_features(window, fs)
             positions.append(start)
-        features = np.array(features)
+        features = np.array(features) if out is None else out
         positions = np.array(positions)
         return features, positions
     except Exception as e:
         print(f"Ошибка при извлечении признаков: {e}")
         return np.array([]), np.array([])
+
+class OnlineFilter:
+    """
+    Фильтр, обрабатывающий сигнал блоками с сохранением состояния между ними:
+    результат по блокам совпадает с lfilter по всему сигналу сразу (с нулевым начальным состоянием).
+
+    Параметры:
+        n_channels (int): Количество каналов.
+        b, a (ndarray): Коэффициенты фильтра.
+    """
+
+    def __init__(self, n_channels, b, a):
+        self.b, self.a = b, a
+        self.zi = np.zeros((n_channels, max(len(a), len(b)) - 1))
+
+    def __call__(self, block):
+        filtered, self.zi = lfilter(self.b, self.a, block, axis=1, zi=self.zi)
+        return filtered
+
+class OnlineFeatureExtractor:
+    """
+    Потоковый аналог bandpass_filter + extract_features: сигнал поступает блоками
+    произвольной длины, признаки окна выдаются, как только окно заполнено.
+
+    Окно делится на части длиной НОД(окна, шага) (при окне 4 с и шаге 2 с - половины окна).
+    Среднее, СКО, максимум и минимум части считаются один раз и объединяются для всех
+    окон, в которые она входит; хранятся только части текущего окна, поэтому память
+    не зависит от длины записи.
+    В отличие от extract_features, выдаётся и окно, заканчивающееся ровно на последнем отсчёте.
+
+    Параметры:
+        n_channels (int): Количество каналов.
+        fs (float): Частота дискретизации.
+        lowcut (float): Нижняя граница полосового фильтра.
+        highcut (float): Верхняя граница полосового фильтра.
+        order (int): Порядок фильтра.
+    """
+
+    def __init__(self, n_channels, fs, lowcut, highcut, order=5):
+        self.fs = fs
+        self.n_channels = n_channels
+        nyq = 0.5 * fs
+        b, a = butter(order, [lowcut / nyq, highcut / nyq], btype='band')
+        self.filter = OnlineFilter(n_channels, b, a)
+        self.window_size = int(WINDOW_SECONDS * fs)
+        self.step_size = int(STEP_SECONDS * fs)
+        self.part_size = gcd(self.window_size, self.step_size)
+        self.parts_per_window = self.window_size // self.part_size
+        self.parts_per_step = self.step_size // self.part_size
+        # Части текущего окна: (отфильтрованный сигнал, среднее, сумма квадратов отклонений, максимум, минимум)
+        self.parts = deque(maxlen=self.parts_per_window)
+        self.pending = np.zeros((n_channels, 0))
+        self.n_parts = 0  # Частей обработано с начала записи
+
+    def _part_stats(self, part):
+        # Копия: часть не должна удерживать в памяти весь поступивший блок
+        part = part.copy()
+        mean = np.mean(part, axis=1)
+        m2 = np.sum((part - mean[:, np.newaxis]) ** 2, axis=1)
+        return part, mean, m2, np.max(part, axis=1), np.min(part, axis=1)
+
+    def _window_features(self):
+        # Объединение средних и дисперсий частей (формула Чана) - без повторного прохода по окну
+        _, mean, m2, max_val, min_val = self.parts[0]
+        count = self.part_size
+        for _, part_mean, part_m2, part_max, part_min in list(self.parts)[1:]:
+            delta = part_mean - mean
+            total = count + self.part_size
+            mean = mean + delta * self.part_size / total
+            m2 = m2 + part_m2 + delta ** 2 * count * self.part_size / total
+            max_val = np.maximum(max_val, part_max)
+            min_val = np.minimum(min_val, part_min)
+            count = total
+        std = np.sqrt(m2 / count)
+        # Частотные признаки - по всему окну
+        window = np.concatenate([part[0] for part in self.parts], axis=1)
+        return np.hstack([mean, std, max_val, min_val, relative_band_powers(window, self.fs)])
+
+    def push(self, block):
+        """
+        Фильтрует очередной блок и извлекает признаки заполненных окон.
+
+        Параметры:
+            block (ndarray): Сигналы формы (n_channels, n_samples).
+
+        Возвращает:
+            features (ndarray): Признаки заполненных окон формы (n_windows, 6 * n_channels).
+            positions (ndarray): Позиции начала окон в отсчётах от начала записи.
+        """
+        features = []
+        positions = []
+        self.pending = np.concatenate([self.pending, self.filter(np.asarray(block, dtype=np.float64))], axis=1)
+        offset = 0
+        while self.pending.shape[1] - offset >= self.part_size:
+            self.parts.append(self._part_stats(self.pending[:, offset:offset + self.part_size]))
+            offset += self.part_size
+            self.n_parts += 1
+            first_part = self.n_parts - self.parts_per_window
+            if first_part >= 0 and first_part % self.parts_per_step == 0:
+                features.append(self._window_features())
+                positions.append(first_part * self.part_size)
+        self.pending = self.pending[:, offset:].copy()
+        features = np.array(features).reshape(len(features), 6 * self.n_channels)
+        return features, np.array(positions, dtype=int)
@@ -0,0 +1,177 @@
+# detector_cache.py
+#
+# Кэш промежуточных данных детекторов SWD/DS на диске (огибающая, таблицы пиков).
+# Повторная детекция с другими параметрами читает их через mmap, минуя
+# чтение EDF, фильтрацию и преобразование Гильберта.
+
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+from feature_cache import evict_cache, touch_cache_entry
+
+logger = logging.getLogger(__name__)
+
+DETECTOR_CACHE_DIR = os.environ.get("ECOG_DETECTOR_CACHE_DIR", "data/detectors")
+# Предельный объём кэша детекторов, ГБ (0 - без ограничения); час записи занимает около 19 МБ
+DETECTOR_CACHE_MAX_BYTES = int(float(os.environ.get("ECOG_DETECTOR_CACHE_MAX_GB", 20)) * 1024 ** 3)
+
+# Увеличивается при изменении swd_products/ds_products, меняющем результат
+DETECTOR_VERSION = 2
+
+# Огибающая нужна только для подсчёта total_spikes, на диске хватает float32
+FLOAT32_KEYS = ("envelope",)
+
+
+def detector_cache_key(kind, content_hash, params):
+    """
+    Ключ кэша: вид детектора, хэш содержимого записи и параметры промежуточных данных.
+
+    Параметры:
+        kind (str): 'swd' или 'ds'.
+        content_hash (str): SHA-256 содержимого EDF-файла.
+        params (dict): Параметры, влияющие на промежуточные данные (полоса, порядок фильтра).
+
+    Возвращает:
+        str: Ключ (префикс имён файлов в кэше).
+    """
+    description = {"kind": kind, "content_hash": content_hash, "version": DETECTOR_VERSION, **params}
+    digest = hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()[:40]
+    return f"{kind}_{digest}"
+
+
+def _write_meta(base, meta):
+    with open(f"{base}.json.tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(f"{base}.json.tmp", f"{base}.json")
+
+
+def save_products(key, products, cache_dir=None):
+    """
+    Сохраняет промежуточные данные: массивы - в .npy, остальное - в .json.
+    JSON пишется последним и служит признаком полной записи.
+
+    Возвращает:
+        bool: True при успешной записи, False иначе.
+    """
+    cache_dir = cache_dir or DETECTOR_CACHE_DIR
+    base = os.path.join(cache_dir, key)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        meta = {"arrays": []}
+        for name, value in products.items():
+            if isinstance(value, np.ndarray):
+                if name in FLOAT32_KEYS:
+                    value = value.astype(np.float32, copy=False)
+                tmp_path = f"{base}_{name}.npy.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, np.ascontiguousarray(value))
+                os.replace(tmp_path, f"{base}_{name}.npy")
+                meta["arrays"].append(name)
+            else:
+                meta[name] = value
+        _write_meta(base, meta)
+        logger.info(f"Промежуточные данные детектора сохранены: {base}")
+        evict_cache(cache_dir, DETECTOR_CACHE_MAX_BYTES, keep=key)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении промежуточных данных детектора {base}: {e}")
+        return False
+
+
+def create_product_array(key, name, shape, dtype, cache_dir=None):
+    """
+    Создаёт массив промежуточных данных в файле (.npy, mmap) для заполнения по частям,
+    когда запись не помещается в память. Окончательное имя файл получает в commit_products.
+
+    Параметры:
+        key (str): Ключ кэша.
+        name (str): Имя массива ('envelope', 'table', ...).
+        shape (tuple): Форма массива.
+        dtype: Тип элементов.
+        cache_dir (str): Директория кэша.
+
+    Возвращает:
+        memmap: Массив, открытый на запись.
+    """
+    cache_dir = cache_dir or DETECTOR_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}_{name}.npy.tmp")
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+
+def commit_products(key, names, meta, cache_dir=None):
+    """
+    Завершает запись промежуточных данных, созданных create_product_array:
+    файлы массивов переименовываются, метаданные пишутся в .json последними.
+    Массивы к этому моменту должны быть закрыты (flush и удаление ссылок).
+
+    Параметры:
+        key (str): Ключ кэша.
+        names (list): Имена массивов.
+        meta (dict): Остальные поля промежуточных данных.
+        cache_dir (str): Директория кэша.
+
+    Возвращает:
+        bool: True при успешной записи, False иначе.
+    """
+    base = os.path.join(cache_dir or DETECTOR_CACHE_DIR, key)
+    try:
+        for name in names:
+            os.replace(f"{base}_{name}.npy.tmp", f"{base}_{name}.npy")
+        _write_meta(base, dict(meta, arrays=list(names)))
+        logger.info(f"Промежуточные данные детектора сохранены: {base}")
+        evict_cache(cache_dir or DETECTOR_CACHE_DIR, DETECTOR_CACHE_MAX_BYTES, keep=key)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении промежуточных данных детектора {base}: {e}")
+        return False
+
+
+def load_products(key, cache_dir=None):
+    """
+    Загружает промежуточные данные детектора; массивы отображаются в память (mmap).
+
+    Возвращает:
+        dict: Промежуточные данные или None, если их нет в кэше.
+    """
+    base = os.path.join(cache_dir or DETECTOR_CACHE_DIR, key)
+    if not os.path.exists(f"{base}.json"):
+        return None
+    try:
+        with open(f"{base}.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        products = {name: value for name, value in meta.items() if name != "arrays"}
+        for name in meta["arrays"]:
+            products[name] = np.load(f"{base}_{name}.npy", mmap_mode="r")
+        touch_cache_entry(f"{base}.json")
+        return products
+    except Exception as e:
+        logger.error(f"Ошибка при чтении промежуточных данных детектора {base}: {e}")
+        return None
+
+
+def cached_products(kind, content_hash, params, compute, cache_dir=None):
+    """
+    Промежуточные данные детектора из кэша или вычисленные и сохранённые в кэш.
+
+    Параметры:
+        kind (str): 'swd' или 'ds'.
+        content_hash (str): SHA-256 содержимого EDF-файла.
+        params (dict): Параметры промежуточных данных (входят в ключ).
+        compute (callable): Вычисляет промежуточные данные при промахе кэша.
+        cache_dir (str): Директория кэша.
+
+    Возвращает:
+        dict: Промежуточные данные или None, если вычислить их не удалось.
+    """
+    key = detector_cache_key(kind, content_hash, params)
+    products = load_products(key, cache_dir)
+    if products is not None:
+        logger.info(f"Промежуточные данные детектора {kind} взяты из кэша: {key}")
+        return products
+    products = compute()
+    if products is not None:
+        save_products(key, products, cache_dir)
+    return products
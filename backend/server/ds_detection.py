@@ -1,113 +1,349 @@
 # ds_detection.py
 
+import itertools
+from fractions import Fraction
+from functools import lru_cache
 import mne
 import numpy as np
-from scipy.signal import butter, filtfilt, find_peaks
+from scipy.signal import butter, filtfilt, find_peaks, firwin, kaiserord, resample_poly
 from annotation_utils import seconds_to_hms
 
-def detect_ds(file_path):
+# Фильтр низких частот перед поиском пиков
+DS_CUTOFF = 8.0  # Порог частоты для низкочастотного фильтра
+DS_ORDER = 3
+# Выбор каналов (первые 3 или другие при необходимости)
+DS_CHANNELS = 3
+# Частота, до которой прореживается сигнал перед сглаживанием и поиском пиков, Гц; None - без прореживания.
+# Прореживание приближённое: фильтр Баттерворта на другой частоте и пики по меньшему числу отсчётов
+# сдвигают высоты около порогов, и интервалы DS расходятся с поиском на исходной частоте.
+# Прореживание уже сглаженного сигнала тоже не сохраняет результат: пик на склоне (между
+# соседними отсчётами прореженной сетки) теряется, а точная проверка кандидатов на исходной
+# частоте не быстрее find_peaks по всему сигналу. Поэтому по умолчанию пики ищутся на исходной
+# частоте (совпадает с исходным detect_ds)
+DS_RATE = None
+# Подавление наложения спектров при прореживании, дБ
+DS_DECIMATION_ATTENUATION = 60
+
+# Параметры, от которых зависят промежуточные данные (ключ кэша)
+DS_PRODUCT_PARAMS = {'cutoff': DS_CUTOFF, 'order': DS_ORDER, 'channels': DS_CHANNELS, 'rate': DS_RATE}
+
+# Параметры поиска по умолчанию
+DS_PARAMS = {
+    'min_peaks_per_sec': 1,  # Минимальное количество пиков
+    'max_peaks_per_sec': 8,  # Максимальное количество пиков
+    'lower_amplitude_threshold': 0.00008,  # Нижний порог амплитуды
+    'upper_amplitude_threshold': 0.00030,  # Верхний порог амплитуды
+    'min_duration': 7,  # Минимальная длительность интервала в секундах
+}
+
+
+def detect_ds(file_path, **params):
     """
     Обнаруживает интервалы DS в EDF-файле.
 
     Параметры:
         file_path (str): Путь к EDF-файлу.
+        **params: Параметры поиска (см. DS_PARAMS).
 
     Возвращает:
         matching_seconds (list): Список обнаруженных DS интервалов.
     """
-    # Параметры поиска
-    cutoff = 8.0  # Порог частоты для низкочастотного фильтра
-    order = 3
-    min_peaks_per_sec = 1  # Минимальное количество пиков
-    max_peaks_per_sec = 8  # Максимальное количество пиков
-    lower_amplitude_threshold = 0.00008  # Нижний порог амплитуды
-    upper_amplitude_threshold = 0.00030  # Верхний порог амплитуды
-    min_duration = 7  # Минимальная длительность интервала в секундах
+    products = ds_products_from_file(file_path)
+    if products is None:
+        return []
+    try:
+        return detect_ds_from_products(products, verbose=True, **params)
+    except Exception as e:
+        print(f"Ошибка при обнаружении DS интервалов: {e}")
+        return []
+
+def detect_ds_in_data(data, sfreq, **params):
+    """
+    Обнаруживает интервалы DS в сигналах, уже загруженных в память.
+
+    Параметры:
+        data (ndarray): Сигналы формы (n_channels, n_samples) в вольтах.
+        sfreq (float): Частота дискретизации.
+        **params: Параметры поиска (см. DS_PARAMS).
+
+    Возвращает:
+        matching_seconds (list): Список обнаруженных DS интервалов.
+    """
+    products = ds_products(data, sfreq)
+    if products is None:
+        return []
+    try:
+        return detect_ds_from_products(products, verbose=True, **params)
+    except Exception as e:
+        print(f"Ошибка при обнаружении DS интервалов: {e}")
+        return []
+
+def ds_products_from_file(file_path):
+    """
+    Читает EDF-файл и вычисляет промежуточные данные детектора DS (см. ds_products).
+    """
+    try:
+        # Читаются только каналы детектора (без preload сигналы декодируются при get_data)
+        raw = mne.io.read_raw_edf(file_path, preload=False, verbose=False)
+        data = raw.get_data(picks=raw.ch_names[:DS_CHANNELS])
+    except Exception as e:
+        print(f"Ошибка при обнаружении DS интервалов: {e}")
+        return None
+    return ds_products(data, raw.info['sfreq'])
+
+def decimation_factors(sfreq, rate=DS_RATE):
+    """
+    Множители прореживания sfreq -> rate: rate = sfreq * up / down.
+
+    Возвращает:
+        tuple: (up, down); (1, 1) - без прореживания (rate не задан или не ниже sfreq).
+    """
+    if not rate or rate >= sfreq:
+        return 1, 1
+    ratio = Fraction(rate).limit_denominator(1000) / Fraction(sfreq).limit_denominator(1000)
+    return ratio.numerator, ratio.denominator
+
+@lru_cache(maxsize=None)
+def _decimation_filter(sfreq, up, down, passband):
+    # Полоса пропускания до passband, подавление с частоты, которая накладывается на passband
+    rate = sfreq * up / down
+    stopband = rate - passband
+    if stopband <= passband:
+        raise ValueError(f"Частота прореживания {rate} Гц слишком низкая для полосы {passband} Гц")
+    numtaps, beta = kaiserord(DS_DECIMATION_ATTENUATION, (stopband - passband) / (0.5 * sfreq * up))
+    return firwin(numtaps | 1, 0.5 * (passband + stopband), window=('kaiser', beta), fs=sfreq * up)
+
+def ds_decimate(data, sfreq, rate=DS_RATE, cutoff=DS_CUTOFF):
+    """
+    Прореживает сигналы до частоты rate полифазным КИХ-фильтром (resample_poly),
+    сохраняя полосу до 1.25 * cutoff.
+
+    Отсчёт k результата соответствует отсчёту k * down / up исходных сигналов
+    (см. decimation_factors).
+
+    Параметры:
+        data (ndarray): Сигналы формы (n_channels, n_samples).
+        sfreq (float): Частота дискретизации.
+        rate (float): Частота после прореживания, Гц (не ниже 2.5 * cutoff).
+        cutoff (float): Частота среза последующего фильтра низких частот, Гц.
+
+    Возвращает:
+        tuple: (прореженные сигналы, их частота дискретизации).
+    """
+    up, down = decimation_factors(sfreq, rate)
+    if up == down:
+        return data, sfreq
+    # resample_poly масштабирует коэффициенты фильтра на месте - передаётся копия
+    window = _decimation_filter(float(sfreq), up, down, 1.25 * cutoff).copy()
+    return resample_poly(data, up, down, axis=-1, window=window), sfreq * up / down
+
+def ds_smooth(data, sfreq, cutoff=DS_CUTOFF, order=DS_ORDER):
+    """
+    Сглаживает сигналы фильтром низких частот без фазового сдвига (filtfilt).
+
+    Параметры:
+        data (ndarray): Сигналы формы (n_channels, n_samples).
+        sfreq (float): Частота дискретизации.
+        cutoff (float): Частота среза, Гц.
+        order (int): Порядок фильтра.
+
+    Возвращает:
+        ndarray: Сглаженные сигналы.
+    """
+    nyquist = 0.5 * sfreq
+    b, a = butter(order, cutoff / nyquist, btype='low')
+    # Все каналы одним вызовом: тот же результат, что filtfilt по каждому каналу, без копии при сборке массива
+    return filtfilt(b, a, data, axis=-1)
+
+def second_peak_heights(channel_data, sfreq, n_seconds, source_sfreq=None, start=0):
+    """
+    Высоты всех локальных максимумов каждой секунды канала, по убыванию внутри секунды.
+
+    Как при поиске пиков отдельно в каждой секунде, пики на первом и последнем отсчёте
+    секунды (исходной частоты) не учитываются. Для прореженного сигнала высота пика
+    уточняется по параболе через три соседних отсчёта, секунда определяется по положению
+    вершины параболы.
+
+    Параметры:
+        channel_data (ndarray): Сглаженный сигнал канала.
+        sfreq (float): Частота дискретизации channel_data.
+        n_seconds (int): Количество секунд.
+        source_sfreq (float): Частота исходного сигнала, если channel_data прорежен.
+        start (int): Отсчёт channel_data на границе первой секунды.
+
+    Возвращает:
+        tuple: (heights, counts) - высоты пиков секунд подряд и их количество в каждой секунде.
+    """
+    source_sfreq = source_sfreq or sfreq
+    channel_data = channel_data[:start + int(np.ceil(n_seconds * sfreq)) + 2]
+    # Все пики; порог по высоте применяется при детекции
+    peaks, _ = find_peaks(channel_data)
+    heights = channel_data[peaks]
+    positions = peaks - start
+    if source_sfreq != sfreq:
+        before, after = channel_data[peaks - 1], channel_data[peaks + 1]
+        curvature = before - 2 * heights + after
+        shift = np.zeros(len(peaks))
+        np.divide(0.5 * (before - after), curvature, out=shift, where=curvature < 0)
+        heights = heights - 0.25 * (before - after) * shift
+        positions = np.round((positions + shift) * (source_sfreq / sfreq)).astype(np.int64)
+
+    bounds = (np.arange(n_seconds + 1) * source_sfreq).astype(np.int64)
+    seconds = np.searchsorted(bounds, positions, side='right') - 1
+    inside = (seconds >= 0) & (seconds < n_seconds)
+    seconds, positions, heights = seconds[inside], positions[inside], heights[inside]
+    keep = (positions != bounds[seconds]) & (positions != bounds[seconds + 1] - 1)
+    seconds, heights = seconds[keep], heights[keep]
+
+    order = np.lexsort((-heights, seconds))
+    return heights[order], np.bincount(seconds, minlength=n_seconds)
+
+def ds_peak_heights(data, sfreq, n_seconds, start=0, cutoff=DS_CUTOFF, order=DS_ORDER, rate=DS_RATE):
+    """
+    Прореживает (ds_decimate) и сглаживает сигналы, находит высоты пиков секунд (second_peak_heights).
+
+    Параметры:
+        data (ndarray): Сигналы формы (n_channels, n_samples) в вольтах.
+        sfreq (float): Частота дискретизации.
+        n_seconds (int): Количество секунд.
+        start (int): Отсчёт data, с которого начинается первая секунда (граница секунды записи);
+            отсчёты до него и после последней секунды служат запасом для фильтров.
+        cutoff (float): Частота среза фильтра низких частот, Гц.
+        order (int): Порядок фильтра.
+        rate (float): Частота прореживания, Гц.
 
+    Возвращает:
+        list: По каждому каналу - (heights, counts), см. second_peak_heights.
+    """
+    up, down = decimation_factors(sfreq, rate)
+    # Прореживание по той же сетке отсчётов, что у всей записи: down делит число отсчётов в секунде
+    phase = start % down
+    decimated, decimated_sfreq = ds_decimate(data[:, phase:], sfreq, rate, cutoff)
+    smoothed = ds_smooth(decimated, decimated_sfreq, cutoff, order)
+    offset = (start - phase) * up // down
+    # Отсчёт перед первой секундой нужен для пика на её границе (вершина параболы может быть внутри секунды)
+    margin = min(offset, 1)
+    return [second_peak_heights(channel_data[offset - margin:], decimated_sfreq, n_seconds, sfreq, margin)
+            for channel_data in smoothed]
+
+def ds_products(data, sfreq, cutoff=DS_CUTOFF, order=DS_ORDER, rate=DS_RATE, channels=DS_CHANNELS):
+    """
+    Вычисляет промежуточные данные детектора DS, не зависящие от параметров поиска:
+    высоты всех локальных максимумов сглаженного сигнала по каждому каналу и каждой секунде.
+
+    Высоты хранятся одним массивом: для секунды sec канала ch это
+    heights[offsets[i]:offsets[i + 1]], i = ch * n_seconds + sec, по убыванию.
+
+    Параметры:
+        data (ndarray): Сигналы формы (n_channels, n_samples) в вольтах.
+        sfreq (float): Частота дискретизации.
+        cutoff (float): Частота среза фильтра низких частот, Гц.
+        order (int): Порядок фильтра.
+        rate (float): Частота прореживания перед сглаживанием, Гц (None - без прореживания).
+        channels (int): Количество первых каналов, по которым ищутся DS.
+
+    Возвращает:
+        dict: 'heights', 'offsets', 'n_channels', 'n_seconds', 'sfreq' или None при ошибке.
+    """
     try:
-        # Загрузка EDF-файла
-        raw = mne.io.read_raw_edf(file_path, preload=True, verbose=False)
-        # Выбор каналов (первые 3 или другие при необходимости)
-        selected_channels = raw.ch_names[:3]  # Или укажите конкретные имена каналов
-        raw.pick_channels(selected_channels)
-        data = raw.get_data()
-        sfreq = raw.info['sfreq']
-
-        # Функция для сглаживания через фильтр низких частот
-        def lowpass_filter(data, cutoff=8.0, fs=sfreq, order=3):
-            nyquist = 0.5 * fs
-            normal_cutoff = cutoff / nyquist
-            b, a = butter(order, normal_cutoff, btype='low')
-            y = filtfilt(b, a, data)
-            return y
-
-        # Применяем фильтр к каждому каналу
-        smoothed_data = np.array([lowpass_filter(channel) for channel in data])
-
-        matching_seconds = []
-        current_interval = None  # Текущий интервал для всех каналов
-
-        # Проходим по каждой секунде
-        total_seconds = int(smoothed_data.shape[1] / sfreq)
-        for sec in range(total_seconds):
-            # Флаг, показывающий, удовлетворяет ли секунда условиям на всех каналах
-            all_channels_match = True
-
-            # Проверяем каждый канал в текущую секунду
-            for channel_data in smoothed_data:
-                # Выделяем данные для текущей секунды
-                start_idx = int(sec * sfreq)
-                end_idx = int((sec + 1) * sfreq)
-                segment = channel_data[start_idx:end_idx]
-
-                # Ищем все пики (всплески) выше минимального порога
-                peaks, properties = find_peaks(segment, height=lower_amplitude_threshold)
-
-                # Проверяем, что количество пиков в пределах от min_peaks_per_sec до max_peaks_per_sec
-                if len(peaks) < min_peaks_per_sec or len(peaks) > max_peaks_per_sec:
-                    all_channels_match = False
-                    break
-
-                # Проверяем, что хотя бы один пик не превышает верхний порог
-                peak_heights = properties['peak_heights']
-                if np.any(peak_heights > upper_amplitude_threshold):
-                    all_channels_match = False
-                    break
-
-            # Если секунда удовлетворяет условиям на всех каналах
-            if all_channels_match:
-                if current_interval is None:
-                    # Начинаем новый интервал
-                    current_interval = {'start_second': sec, 'end_second': sec}
-                else:
-                    # Продолжаем текущий интервал
-                    current_interval['end_second'] = sec
-            else:
-                # Завершаем текущий интервал и сохраняем, если длительность >= min_duration
-                if current_interval is not None:
-                    if (current_interval['end_second'] - current_interval['start_second'] + 1) >= min_duration:
-                        matching_seconds.append({
-                            'start_second': current_interval['start_second'],
-                            'start_time': seconds_to_hms(current_interval['start_second']),
-                            'end_second': current_interval['end_second'],
-                            'end_time': seconds_to_hms(current_interval['end_second']),
-                            'duration_seconds': current_interval['end_second'] - current_interval['start_second'] + 1
-                        })
-                    current_interval = None
-
-        # Добавляем последний интервал, если он остался незавершённым и длится >= min_duration
-        if current_interval is not None and (current_interval['end_second'] - current_interval['start_second'] + 1) >= min_duration:
+        data = data[:channels]
+
+        # Прореживание, сглаживание через фильтр низких частот и поиск пиков
+        total_seconds = int(data.shape[1] / sfreq)
+        channel_heights = ds_peak_heights(data, sfreq, total_seconds, cutoff=cutoff, order=order, rate=rate)
+        counts = np.concatenate([channel_counts for _, channel_counts in channel_heights])
+
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return {
+            'heights': np.concatenate([heights for heights, _ in channel_heights]),
+            'offsets': offsets,
+            'n_channels': len(channel_heights),
+            'n_seconds': total_seconds,
+            'sfreq': float(sfreq),
+        }
+    except Exception as e:
+        print(f"Ошибка при обнаружении DS интервалов: {e}")
+        return None
+
+def detect_ds_from_products(products, min_peaks_per_sec=DS_PARAMS['min_peaks_per_sec'],
+                            max_peaks_per_sec=DS_PARAMS['max_peaks_per_sec'],
+                            lower_amplitude_threshold=DS_PARAMS['lower_amplitude_threshold'],
+                            upper_amplitude_threshold=DS_PARAMS['upper_amplitude_threshold'],
+                            min_duration=DS_PARAMS['min_duration'], verbose=False):
+    """
+    Обнаруживает интервалы DS по промежуточным данным (см. ds_products) с заданными параметрами.
+
+    Секунда подходит, если на всех каналах число пиков не ниже lower_amplitude_threshold
+    лежит в пределах [min_peaks_per_sec, max_peaks_per_sec] и ни один из них не выше
+    upper_amplitude_threshold.
+
+    Параметры:
+        products (dict): Результат ds_products или загруженный из кэша.
+        min_peaks_per_sec (int): Минимальное количество пиков в секунду.
+        max_peaks_per_sec (int): Максимальное количество пиков в секунду.
+        lower_amplitude_threshold (float): Нижний порог амплитуды пика, В.
+        upper_amplitude_threshold (float): Верхний порог амплитуды пика, В.
+        min_duration (float): Минимальная длительность интервала в секундах.
+        verbose (bool): Печатать количество найденных интервалов.
+
+    Возвращает:
+        matching_seconds (list): Список обнаруженных DS интервалов.
+    """
+    heights = products['heights']
+    offsets = products['offsets']
+    n_channels = products['n_channels']
+    n_seconds = products['n_seconds']
+
+    # Количество пиков не ниже порога в каждой секунде каждого канала
+    above = np.zeros(len(heights) + 1, dtype=np.int64)
+    np.cumsum(heights >= lower_amplitude_threshold, out=above[1:])
+    counts = above[offsets[1:]] - above[offsets[:-1]]
+
+    # Высоты секунды отсортированы по убыванию: первая - максимальная
+    highest = np.full(len(counts), -np.inf)
+    non_empty = counts > 0
+    highest[non_empty] = heights[offsets[:-1][non_empty]]
+
+    matches = (counts >= min_peaks_per_sec) & (counts <= max_peaks_per_sec) & ~(highest > upper_amplitude_threshold)
+    # Секунда удовлетворяет условиям на всех каналах
+    all_channels_match = matches.reshape(n_channels, n_seconds).all(axis=0)
+
+    # Границы непрерывных серий подходящих секунд
+    edges = np.diff(np.concatenate([[0], all_channels_match.astype(np.int8), [0]]))
+    starts = np.nonzero(edges == 1)[0]
+    ends = np.nonzero(edges == -1)[0] - 1
+
+    matching_seconds = []
+    for start_second, end_second in zip(starts, ends):
+        start_second, end_second = int(start_second), int(end_second)
+        if (end_second - start_second + 1) >= min_duration:
             matching_seconds.append({
-                'start_second': current_interval['start_second'],
-                'start_time': seconds_to_hms(current_interval['start_second']),
-                'end_second': current_interval['end_second'],
-                'end_time': seconds_to_hms(current_interval['end_second']),
-                'duration_seconds': current_interval['end_second'] - current_interval['start_second'] + 1
+                'start_second': start_second,
+                'start_time': seconds_to_hms(start_second),
+                'end_second': end_second,
+                'end_time': seconds_to_hms(end_second),
+                'duration_seconds': end_second - start_second + 1
             })
 
+    if verbose:
         print(f"Найдено {len(matching_seconds)} DS интервалов.")
-        return matching_seconds
+    return matching_seconds
 
-    except Exception as e:
-        print(f"Ошибка при обнаружении DS интервалов: {e}")
-        return []
+def sweep_ds(products, grid):
+    """
+    Перебор сетки параметров DS по одним и тем же промежуточным данным.
+
+    Параметры:
+        products (dict): Результат ds_products или загруженный из кэша.
+        grid (dict): Имя параметра -> список значений; отсутствующие берутся из DS_PARAMS.
+
+    Возвращает:
+        list: Словари {'params': {...}, 'intervals': [...]} для каждой комбинации.
+    """
+    names = list(grid)
+    results = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = dict(DS_PARAMS, **dict(zip(names, values)))
+        results.append({'params': params, 'intervals': detect_ds_from_products(products, **params)})
+    return results
@@ -1,44 +1,26 @@
 # edf_utils.py
 
 import os
-import shutil
 import logging
-from fastapi import UploadFile
 import pyedflib
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
-def save_uploaded_file(file: UploadFile, upload_dir: str):
-    """
-    Сохраняет загруженный файл в указанную директорию.
-
-    Параметры:
-        file (UploadFile): Загруженный файл.
-        upload_dir (str): Путь к директории для сохранения файла.
+# Множители перевода физических единиц EDF в вольты (как в mne.io.read_raw_edf)
+UNIT_SCALES = {'V': 1.0, 'mV': 1e-3, 'uV': 1e-6, 'µV': 1e-6, 'nV': 1e-9}
 
-    Возвращает:
-        str: Путь к сохранённому файлу или None в случае ошибки.
-    """
-    try:
-        file_location = os.path.join(upload_dir, file.filename)
-        with open(file_location, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        logger.info(f"Файл сохранён в: {file_location}")
-        return file_location
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении файла {file.filename}: {e}")
-        return None
-
-def read_edf_with_annotations(file_path):
+def read_edf_with_annotations(file_path, channels=None):
     """
     Читает EDF-файл и извлекает сигналы и аннотации.
 
     Параметры:
         file_path (str): Путь к EDF-файлу.
+        channels (tuple): Каналы этапов обработки (см. channels_to_read): декодируются только
+            первые каналы, нужные этапам; None - все каналы.
 
     Возвращает:
-        signals (ndarray): Массив сигналов.
+        signals (ndarray): Массив сигналов (первые channels_to_read(...) каналов).
         signal_labels (list): Метки сигналов.
         header (dict): Заголовок EDF-файла.
         signal_headers (list): Заголовки сигналов.
@@ -47,6 +29,8 @@ def read_edf_with_annotations(file_path):
     try:
         f = pyedflib.EdfReader(file_path)
         num_signals = f.signals_in_file
+        if channels is not None:
+            num_signals = channels_to_read(num_signals, *channels)
         signal_labels = f.getSignalLabels()
         signals = np.zeros((num_signals, f.getNSamples()[0]))
         for i in range(num_signals):
@@ -64,40 +48,57 @@ def read_edf_with_annotations(file_path):
         logger.error(f"Ошибка при загрузке EDF-файла {file_path}: {e}")
         return None, None, None, None, None
 
-def write_edf_with_annotations(original_file_path, annotations, output_file_path, header, signal_headers, signals):
+def channels_to_read(n_signals, *stage_channels):
     """
-    Записывает EDF-файл с добавленными аннотациями.
+    Сколько первых каналов записи нужно прочитать для этапов обработки.
+    Каждый этап объявляет количество первых каналов, которые он использует
+    (IS_CHANNELS, SWD_CHANNELS, DS_CHANNELS; None - все каналы), читается их объединение.
 
     Параметры:
-        original_file_path (str): Путь к оригинальному EDF-файлу.
-        annotations (list): Список аннотаций в формате (onset, duration, description).
-        output_file_path (str): Путь для сохранения нового EDF-файла.
-        header (dict): Заголовок оригинального EDF-файла.
-        signal_headers (list): Заголовки сигналов.
-        signals (ndarray): Массив сигналов.
+        n_signals (int): Количество каналов в записи.
+        *stage_channels: Каналы каждого выполняемого этапа.
 
     Возвращает:
-        bool: True при успешной записи, False иначе.
+        int: Количество первых каналов для чтения (0 - этапов нет).
     """
-    try:
-        num_channels = len(signals)
-        logger.debug(f"Инициализация EdfWriter для файла {output_file_path} с {num_channels} каналами.")
-        with pyedflib.EdfWriter(output_file_path, n_channels=num_channels, file_type=pyedflib.FILETYPE_EDFPLUS) as writer:
-            logger.debug("Установка заголовка EDF.")
-            writer.setHeader(header)
-            for i in range(num_channels):
-                logger.debug(f"Установка заголовка сигнала для канала {i}.")
-                writer.setSignalHeader(i, signal_headers[i])
-            logger.debug("Запись сигналов.")
-            writer.writeSamples(signals)
+    if not stage_channels:
+        return 0
+    return min(n_signals, max(n_signals if channels is None else channels for channels in stage_channels))
+
+def read_edf_window(file_path, start, n_samples):
+    """
+    Читает отрезок всех каналов EDF-файла, не декодируя остальную запись.
 
-            logger.debug("Добавление аннотаций.")
-            for onset, duration, description in annotations:
-                logger.debug(f"Добавление аннотации: onset={onset}, duration={duration}, description={description}")
-                writer.writeAnnotation(onset, duration, description)
+    Параметры:
+        file_path (str): Путь к EDF-файлу.
+        start (int): Первый отсчёт отрезка.
+        n_samples (int): Длина отрезка в отсчётах (обрезается по концу записи).
 
-        logger.info(f"EDF-файл с аннотациями успешно сохранён: {output_file_path}")
-        return True
+    Возвращает:
+        ndarray: Сигналы отрезка формы (n_channels, n_samples) или None при ошибке.
+    """
+    try:
+        with pyedflib.EdfReader(file_path) as f:
+            n_samples = max(0, min(n_samples, int(f.getNSamples()[0]) - start))
+            signals = np.zeros((f.signals_in_file, n_samples))
+            for i in range(f.signals_in_file):
+                signals[i, :] = f.readSignal(i, start, n_samples)
+        return signals
     except Exception as e:
-        logger.error(f"Ошибка при записи EDF-файла {output_file_path}: {e}")
-        return False
+        logger.error(f"Ошибка при чтении отрезка EDF-файла {file_path}: {e}")
+        return None
+
+def signals_to_volts(signals, signal_headers):
+    """
+    Переводит сигналы из физических единиц EDF в вольты.
+    Детекторы SWD и DS рассчитаны на данные в вольтах (как их отдаёт mne).
+
+    Параметры:
+        signals (ndarray): Массив сигналов в единицах из заголовков (первые len(signals) каналов записи).
+        signal_headers (list): Список заголовков сигналов.
+
+    Возвращает:
+        ndarray: Сигналы в вольтах.
+    """
+    scales = np.array([UNIT_SCALES.get(h.get('dimension', '').strip(), 1.0) for h in signal_headers[:len(signals)]])
+    return signals * scales[:, np.newaxis]
@@ -0,0 +1,198 @@
+# feature_cache.py
+#
+# Кэш признаков на диске: матрицы (features, positions) сохраняются в .npy
+# и при повторной обработке той же записи с теми же параметрами фильтра и окон
+# читаются через mmap, минуя фильтрацию и extract_features.
+
+import hashlib
+import json
+import logging
+import os
+import re
+import numpy as np
+from data_processing import IS_CHANNELS, WINDOW_SECONDS, STEP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+FEATURE_CACHE_DIR = os.environ.get("ECOG_FEATURE_CACHE_DIR", "data/features")
+# Предельный объём кэша признаков, ГБ (0 - без ограничения); час записи занимает около 0.3 МБ
+FEATURE_CACHE_MAX_BYTES = int(float(os.environ.get("ECOG_FEATURE_CACHE_MAX_GB", 5)) * 1024 ** 3)
+
+# Увеличивается при любом изменении bandpass_filter/extract_features, меняющем результат
+FEATURE_VERSION = 2
+
+HASH_CHUNK = 4 * 1024 * 1024
+
+# Имя файла кэша начинается с ключа записи: 40 hex-символов, у детекторов - с префиксом вида ('swd_', 'ds_')
+CACHE_ENTRY_PATTERN = re.compile(r"^((?:[a-z]+_)?[0-9a-f]{40})[_.]")
+
+
+def file_sha256(file_path):
+    """
+    SHA-256 содержимого файла, читается блоками.
+
+    Параметры:
+        file_path (str): Путь к файлу.
+
+    Возвращает:
+        str: Шестнадцатеричный хэш.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def feature_cache_key(content_hash, fs, lowcut, highcut, order=5):
+    """
+    Ключ кэша: хэш содержимого записи и все параметры, влияющие на признаки.
+
+    Параметры:
+        content_hash (str): SHA-256 содержимого EDF-файла.
+        fs (float): Частота дискретизации.
+        lowcut (float): Нижняя граница полосового фильтра.
+        highcut (float): Верхняя граница полосового фильтра.
+        order (int): Порядок фильтра.
+
+    Возвращает:
+        key (str): Ключ (имя файлов в кэше).
+        params (dict): Параметры, из которых построен ключ.
+    """
+    params = {
+        "content_hash": content_hash,
+        "version": FEATURE_VERSION,
+        "fs": fs,
+        "lowcut": lowcut,
+        "highcut": highcut,
+        "order": order,
+        "window_seconds": WINDOW_SECONDS,
+        "step_seconds": STEP_SECONDS,
+        "channels": IS_CHANNELS,
+    }
+    key = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:40]
+    return key, params
+
+
+def _cache_paths(key, cache_dir):
+    base = os.path.join(cache_dir, key)
+    return f"{base}_features.npy", f"{base}_positions.npy", f"{base}.json"
+
+
+def load_cached_features(key, cache_dir=None):
+    """
+    Загружает признаки из кэша, отображая файлы в память (mmap, только чтение).
+
+    Возвращает:
+        features (ndarray): Признаки или None, если в кэше их нет.
+        positions (ndarray): Позиции окон или None.
+    """
+    features_path, positions_path, _ = _cache_paths(key, cache_dir or FEATURE_CACHE_DIR)
+    if not (os.path.exists(features_path) and os.path.exists(positions_path)):
+        return None, None
+    try:
+        features = np.load(features_path, mmap_mode="r")
+        positions = np.load(positions_path, mmap_mode="r")
+        touch_cache_entry(positions_path)
+        logger.info(f"Признаки загружены из кэша: {features_path}")
+        return features, positions
+    except Exception as e:
+        logger.error(f"Ошибка при чтении кэша признаков {features_path}: {e}")
+        return None, None
+
+
+def save_npy_atomic(path, array):
+    """
+    Сохраняет массив в .npy через временный файл и переименование.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(tmp_path, path)
+
+
+def save_cached_features(key, params, features, positions, cache_dir=None):
+    """
+    Сохраняет признаки в кэш. Файлы пишутся во временные и переименовываются,
+    позиции - последними, поэтому прерванная запись не даёт неполной записи в кэше.
+
+    Возвращает:
+        bool: True при успешной записи, False иначе.
+    """
+    cache_dir = cache_dir or FEATURE_CACHE_DIR
+    features_path, positions_path, params_path = _cache_paths(key, cache_dir)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(params_path, "w", encoding="utf-8") as f:
+            json.dump(dict(params, n_windows=int(len(positions))), f, indent=2)
+        save_npy_atomic(features_path, features)
+        save_npy_atomic(positions_path, positions)
+        logger.info(f"Признаки сохранены в кэш: {features_path}")
+        evict_cache(cache_dir, FEATURE_CACHE_MAX_BYTES, keep=key)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении кэша признаков {features_path}: {e}")
+        return False
+
+
+def touch_cache_entry(path):
+    """
+    Отмечает обращение к записи кэша (время изменения файла): evict_cache удаляет
+    в первую очередь записи, к которым дольше всего не обращались.
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def evict_cache(cache_dir, max_bytes, keep=None):
+    """
+    Ограничивает объём кэша на диске: пока он больше max_bytes, удаляются записи,
+    к которым дольше всего не обращались. Недописанные файлы (.tmp) не трогаются.
+
+    Параметры:
+        cache_dir (str): Директория кэша.
+        max_bytes (int): Предельный объём, байт (0 или None - без ограничения).
+        keep (str): Ключ записи, которую удалять нельзя (только что сохранённой).
+
+    Возвращает:
+        int: Количество удалённых записей.
+    """
+    if not max_bytes or not os.path.isdir(cache_dir):
+        return 0
+    # Ключ -> [объём, время последнего обращения, файлы]
+    entries = {}
+    for name in os.listdir(cache_dir):
+        match = CACHE_ENTRY_PATTERN.match(name)
+        if match is None or name.endswith(".tmp"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entry = entries.setdefault(match.group(1), [0, 0.0, []])
+        entry[0] += stat.st_size
+        entry[1] = max(entry[1], stat.st_mtime)
+        entry[2].append(path)
+
+    total = sum(entry[0] for entry in entries.values())
+    removed = 0
+    for key, (size, _, paths) in sorted(entries.items(), key=lambda item: item[1][1]):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        try:
+            for path in paths:
+                os.remove(path)
+        except OSError as e:
+            # Windows не удаляет файлы, открытые через mmap: запись удалится при следующей очистке
+            logger.error(f"Ошибка при удалении записи кэша {key}: {e}")
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        logger.info(f"Из кэша {cache_dir} удалено записей: {removed}")
+    return removed
@@ -0,0 +1,288 @@
+# inference_service.py
+#
+# Общий исполнитель модели для всех запросов: матрицы признаков из разных загрузок
+# ставятся в очередь, объединяются в один батч (до INFERENCE_MAX_BATCH окон или
+# INFERENCE_MAX_WAIT секунд ожидания), модель вызывается один раз, результаты
+# раздаются обратно по запросам.
+#
+# Исполнитель работает в процессе сервера (InferenceBatcher) или отдельным процессом,
+# общим для всех процессов uvicorn, - тогда модель загружена в память один раз:
+#     python inference_service.py --address 127.0.0.1:8765
+# и у сервера ECOG_INFERENCE_ADDRESS=127.0.0.1:8765 (InferenceClient).
+# Исполнителю на том же хосте матрица признаков передаётся через общую память (shared_arrays):
+# по соединению уходит только описание массива. Новые признаки сразу вычисляются в общей памяти
+# (create_input), признаки из кэша передаются описанием файла кэша - без копирования.
+
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+import numpy as np
+from shared_arrays import SHARED_MIN_BYTES, describe, resolve
+
+logger = logging.getLogger(__name__)
+
+# Максимум окон в объединённом батче и ожидание дополнительных запросов, секунд
+INFERENCE_MAX_BATCH = int(os.environ.get("ECOG_INFERENCE_MAX_BATCH", 8192))
+INFERENCE_MAX_WAIT = float(os.environ.get("ECOG_INFERENCE_MAX_WAIT", 0.02))
+# Размер батча внутри model.predict (по умолчанию у Keras - 32)
+PREDICT_BATCH_SIZE = int(os.environ.get("ECOG_PREDICT_BATCH_SIZE", 512))
+# Адрес отдельного процесса исполнителя (host:port); пусто - модель в процессе сервера
+INFERENCE_ADDRESS = os.environ.get("ECOG_INFERENCE_ADDRESS", "")
+INFERENCE_AUTHKEY = os.environ.get("ECOG_INFERENCE_AUTHKEY", "ecog-inference").encode("utf-8")
+# Сколько ждать запуска отдельного процесса исполнителя, секунд
+CONNECT_TIMEOUT = 120
+# Адреса, при которых исполнитель на том же хосте и видит общую память
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+def parse_address(address):
+    """
+    Разбирает адрес вида 'host:port'.
+    """
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class InferenceBatcher:
+    """
+    Очередь запросов к модели с объединением в батчи в отдельном потоке.
+
+    Параметры:
+        predict_fn (callable): Функция X -> вероятности для объединённого батча.
+        max_batch (int): Максимум окон в объединённом батче.
+        max_wait (float): Сколько ждать следующих запросов после первого, секунд.
+        on_batch (callable): Вызывается с числом окон каждого объединённого батча.
+    """
+
+    def __init__(self, predict_fn, max_batch=INFERENCE_MAX_BATCH, max_wait=INFERENCE_MAX_WAIT, on_batch=None):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.on_batch = on_batch
+        self._queue = queue.Queue()
+        # Запросы, не вошедшие в предыдущий батч (другая форма признаков или превышение размера)
+        self._deferred = deque()
+        self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, X):
+        """
+        Ставит матрицу признаков в очередь.
+
+        Возвращает:
+            Future: Результат - вероятности классов для окон X.
+        """
+        future = Future()
+        self._queue.put((np.asarray(X), future))
+        return future
+
+    def predict(self, X):
+        """
+        Вероятности классов для X (блокирует до выполнения батча с этим запросом).
+        """
+        return self.submit(X).result()
+
+    def create_input(self, shape, dtype=np.float64):
+        """
+        Массив для признаков; модель в том же процессе - обычный массив (см. InferenceClient.create_input).
+        """
+        return None, np.empty(shape, dtype)
+
+    def _next_request(self, timeout=None):
+        if self._deferred:
+            return self._deferred.popleft()
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _collect(self):
+        first = self._next_request()
+        batch = [first]
+        windows = len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        deferred = []
+        while windows < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            request = self._next_request(timeout=remaining)
+            if request is None:
+                break
+            # Объединяются только матрицы той же формы окна, не превышая max_batch
+            if request[0].shape[1:] != first[0].shape[1:] or windows + len(request[0]) > self.max_batch:
+                deferred.append(request)
+                break
+            batch.append(request)
+            windows += len(request[0])
+        self._deferred.extend(deferred)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Отменённые запросы пропускаются
+            batch = [(X, future) for X, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            arrays = [X for X, _ in batch]
+            futures = [future for _, future in batch]
+            try:
+                X = arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+                if self.on_batch:
+                    self.on_batch(len(X))
+                probabilities = self.predict_fn(X)
+            except Exception as e:
+                logger.error(f"Ошибка при предсказании батча из {len(arrays)} запросов: {e}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            # Раздача результатов по запросам в порядке объединения
+            offset = 0
+            for X_part, future in zip(arrays, futures):
+                future.set_result(probabilities[offset:offset + len(X_part)])
+                offset += len(X_part)
+
+
+class InferenceClient:
+    """
+    Клиент отдельного процесса исполнителя; у каждого потока своё соединение.
+
+    Параметры:
+        address (str): Адрес исполнителя 'host:port'.
+        authkey (bytes): Ключ аутентификации соединения.
+        registry (SharedArrayRegistry): Общая память для передачи признаков исполнителю
+            на том же хосте; None - признаки сериализуются в соединение.
+    """
+
+    def __init__(self, address=INFERENCE_ADDRESS, authkey=INFERENCE_AUTHKEY, registry=None):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.registry = registry if self.address[0] in LOCAL_HOSTS else None
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Исполнитель может ещё загружать модель - повторяем подключение
+            deadline = time.perf_counter() + CONNECT_TIMEOUT
+            while True:
+                try:
+                    connection = Client(self.address, authkey=self.authkey)
+                    break
+                except ConnectionRefusedError:
+                    if time.perf_counter() > deadline:
+                        raise
+                    time.sleep(1)
+            self._local.connection = connection
+        return connection
+
+    def create_input(self, shape, dtype=np.float64):
+        """
+        Массив для признаков, который predict передаст исполнителю без копирования.
+
+        Возвращает:
+            tuple: (SharedArray, ndarray) - массив в общей памяти, после предсказания описание
+                освобождается через registry.release; (None, ndarray) - обычный массив
+                (исполнитель на другом хосте, массив меньше SHARED_MIN_BYTES или общая память недоступна).
+        """
+        if self.registry is not None and int(np.prod(shape)) * np.dtype(dtype).itemsize >= SHARED_MIN_BYTES:
+            try:
+                return self.registry.create(shape, dtype)
+            except OSError as e:
+                logger.warning(f"Общая память недоступна, признаки передаются через соединение: {e}")
+        return None, np.empty(shape, dtype)
+
+    def predict(self, X):
+        """
+        Вероятности классов для X, вычисленные исполнителем.
+
+        Массив, целиком лежащий в .npy-файле (create_input или признаки из кэша), передаётся
+        описанием без копирования; остальные копируются в общую память (или сериализуются).
+        """
+        connection = self._connection()
+        X = np.ascontiguousarray(X)
+        handle = describe(X) if self.registry is not None else None
+        leased = None
+        if handle is None:
+            handle = leased = self._share(X)
+        try:
+            connection.send(X if handle is None else handle)
+            status, result = connection.recv()
+        except (EOFError, OSError):
+            # Соединение разорвано (перезапуск исполнителя) - при следующем вызове подключимся заново
+            self._local.connection = None
+            raise
+        finally:
+            # Исполнитель ответил - копия ему больше не нужна
+            if leased is not None:
+                self.registry.release(leased)
+        if status != "ok":
+            raise RuntimeError(f"Ошибка исполнителя модели: {result}")
+        return result
+
+    def _share(self, X):
+        if self.registry is None or X.nbytes < SHARED_MIN_BYTES:
+            return None
+        try:
+            return self.registry.share(X)
+        except OSError as e:
+            logger.warning(f"Общая память недоступна, признаки передаются через соединение: {e}")
+            return None
+
+
+def _serve_connection(connection, batcher):
+    with connection:
+        while True:
+            try:
+                X = connection.recv()
+            except EOFError:
+                return
+            try:
+                # Описание общего массива отображается в память без копирования
+                connection.send(("ok", batcher.predict(resolve(X))))
+            except Exception as e:
+                connection.send(("error", str(e)))
+
+
+def serve(address, model_path, authkey=INFERENCE_AUTHKEY, max_batch=INFERENCE_MAX_BATCH, max_wait=INFERENCE_MAX_WAIT):
+    """
+    Запускает отдельный процесс исполнителя: загружает модель и обслуживает клиентов,
+    объединяя их запросы в батчи.
+    """
+    from model_utils import load_model_keras
+    model = load_model_keras(model_path)
+    if model is None:
+        raise SystemExit(f"Не удалось загрузить модель '{model_path}'")
+
+    def on_batch(windows):
+        logger.info(f"Батч модели: {windows} окон")
+
+    batcher = InferenceBatcher(lambda X: model.predict(X, batch_size=PREDICT_BATCH_SIZE, verbose=0),
+                               max_batch=max_batch, max_wait=max_wait, on_batch=on_batch)
+    with Listener(parse_address(address), authkey=authkey) as listener:
+        logger.info(f"Исполнитель модели ожидает подключений на {address}")
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:
+                logger.error(f"Ошибка при подключении клиента исполнителя: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(connection, batcher), daemon=True).start()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Общий исполнитель модели с объединением запросов в батчи")
+    parser.add_argument("--address", default=INFERENCE_ADDRESS or "127.0.0.1:8765", help="host:port для подключений")
+    parser.add_argument("--model", default="cnn_classifier.h5", help="Путь к файлу модели")
+    parser.add_argument("--max-batch", type=int, default=INFERENCE_MAX_BATCH, help="Максимум окон в батче")
+    parser.add_argument("--max-wait", type=float, default=INFERENCE_MAX_WAIT, help="Ожидание запросов в батч, сек.")
+    args = parser.parse_args()
+    serve(args.address, args.model, max_batch=args.max_batch, max_wait=args.max_wait)
@@ -1,23 +1,43 @@
 # main.py
 
+import asyncio
+import json
 import os
-import uuid
 import numpy as np
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+import time
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from edf_utils import (
-    save_uploaded_file,
+    read_edf_window,
     read_edf_with_annotations,
-    write_edf_with_annotations
+    signals_to_volts
 )
 
 
 from annotation_utils import save_signals_as_json
-from data_processing import bandpass_filter, extract_features, load_edf
+from edf_stream import save_annotations_streaming
+from data_processing import IS_CHANNELS, bandpass_filter, count_windows, extract_features, load_edf
 from model_utils import load_model_keras
-from swd_detection import detect_swd
-from ds_detection import detect_ds
+from resampling import MODEL_RATE, resample, signal_rate
+from feature_cache import (
+    FEATURE_CACHE_DIR,
+    feature_cache_key,
+    file_sha256,
+    load_cached_features,
+    save_cached_features
+)
+from swd_detection import SWD_PRODUCT_PARAMS, detect_swd_from_products, swd_products_from_file, sweep_swd
+from ds_detection import DS_PRODUCT_PARAMS, detect_ds_from_products, ds_products_from_file, sweep_ds
+from detector_cache import DETECTOR_CACHE_DIR, cached_products
+from detector_runner import detector_channels, run_detectors
+from prediction_cache import (
+    PREDICTION_CACHE_DIR,
+    load_probabilities,
+    prediction_cache_key,
+    reannotate_is,
+    save_probabilities
+)
 from annotation_utils import (
     postprocess_predictions,
     convert_swd_annotations_to_tuples,
@@ -27,6 +47,39 @@ from annotation_utils import (
     convert_annotations_from_json,
     validate_annotation_pairs
 )
+from metrics import (
+    CONTENT_TYPE,
+    BYTES_READ,
+    BYTES_WRITTEN,
+    HTTP_IN_PROGRESS,
+    HTTP_REQUEST_SECONDS,
+    HTTP_REQUESTS,
+    INFERENCE_BATCH_SIZE,
+    RECORDINGS_BYTES,
+    RECORDINGS_STORED,
+    SHARED_ARRAYS_BYTES,
+    directory_size,
+    file_size,
+    render_metrics,
+    server_timing_header,
+    stage_timer,
+    start_request_timing
+)
+from profiling import normalize_profile_mode, profile_mode_from_env, profile_run
+from inference_service import INFERENCE_ADDRESS, PREDICT_BATCH_SIZE, InferenceBatcher, InferenceClient
+from streaming import StreamingAnnotator
+from shared_arrays import SharedArrayRegistry, cleanup_orphans
+from state_store import count_recordings, load_recording, save_recording, update_recording
+from uploads import (
+    UPLOAD_CHUNK_SIZE,
+    append_chunk,
+    complete_session,
+    create_session,
+    get_session,
+    locked_session,
+    save_upload,
+    upload_file_id
+)
 
 import logging
 
@@ -53,73 +106,308 @@ JSON_DIR = "data/json"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(JSON_DIR, exist_ok=True)
 
-# Загружаем модель при запуске приложения
-model = load_model_keras('cnn_classifier.h5')
-if model is None:
-    logger.error("Не удалось загрузить модель 'cnn_classifier.h5'")
-    raise Exception("Не удалось загрузить модель")
+# Массивы для других процессов (исполнитель модели) передаются через общую память;
+# файлы аварийно завершившихся процессов удаляются при запуске
+cleanup_orphans()
+shared_arrays = SharedArrayRegistry()
+SHARED_ARRAYS_BYTES.set_function(lambda: shared_arrays.nbytes)
+
+# Запросы к модели из всех загрузок объединяются в батчи (inference_service).
+# С ECOG_INFERENCE_ADDRESS модель загружена один раз в отдельном процессе исполнителя,
+# общем для всех процессов uvicorn; иначе каждый процесс загружает свою копию.
+if INFERENCE_ADDRESS:
+    inference = InferenceClient(INFERENCE_ADDRESS, registry=shared_arrays)
+    logger.info(f"Предсказания выполняет исполнитель модели {INFERENCE_ADDRESS}")
+else:
+    # При нескольких процессах uvicorn ограничиваем потоки TF на процесс (ECOG_TF_THREADS)
+    TF_THREADS = int(os.environ.get("ECOG_TF_THREADS", "0"))
+    if TF_THREADS:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(TF_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    # Загружаем модель при запуске приложения
+    model = load_model_keras('cnn_classifier.h5')
+    if model is None:
+        logger.error("Не удалось загрузить модель 'cnn_classifier.h5'")
+        raise Exception("Не удалось загрузить модель")
+    inference = InferenceBatcher(lambda X: model.predict(X, batch_size=PREDICT_BATCH_SIZE, verbose=0),
+                                 on_batch=INFERENCE_BATCH_SIZE.observe)
+# Хэш файла модели входит в ключ кэша вероятностей
+MODEL_HASH = file_sha256('cnn_classifier.h5')
+
+# Детекторы: вычисление промежуточных данных, детекция и перебор сетки параметров по ним
+DETECTORS = {
+    'swd': {'products': swd_products_from_file, 'params': SWD_PRODUCT_PARAMS, 'detect': detect_swd_from_products, 'sweep': sweep_swd},
+    'ds': {'products': ds_products_from_file, 'params': DS_PRODUCT_PARAMS, 'detect': detect_ds_from_products, 'sweep': sweep_ds},
+}
+# Ограничение размера сетки в /sweep
+MAX_SWEEP_COMBINATIONS = 10000
+
+
+# Объём хранилища записей вычисляется при опросе /metrics: сигналы читаются из загруженных
+# файлов, на диске кроме них только кэши признаков, предсказаний и детекторов
+RECORDINGS_STORED.set_function(count_recordings)
+for directory, path in (("uploads", UPLOAD_DIR), ("features", FEATURE_CACHE_DIR),
+                        ("predictions", PREDICTION_CACHE_DIR), ("detectors", DETECTOR_CACHE_DIR)):
+    RECORDINGS_BYTES.set_function(lambda path=path: directory_size(path), directory=directory)
+
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """
+    Счётчики и длительности запросов по эндпоинтам, заголовок Server-Timing.
+    """
+    timings = start_request_timing()
+    HTTP_IN_PROGRESS.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        HTTP_IN_PROGRESS.dec()
+        # Шаблон пути вместо фактического, чтобы file_id не порождали новые ряды
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=status)
+        HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    response.headers["Server-Timing"] = server_timing_header(timings, total=elapsed)
+    return response
+
+
+# Профилирование всех запросов (ECOG_PROFILE=cprofile|sampling) или одного запроса по заголовку X-Profile
+PROFILE_MODE = profile_mode_from_env()
+
+
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    """
+    Профилирование запроса по требованию; результаты пишутся в ECOG_PROFILE_DIR.
+    Эндпоинты async и выполняются в потоке цикла событий, который и профилируется.
+    """
+    mode = normalize_profile_mode(request.headers.get("X-Profile")) or PROFILE_MODE
+    if mode is None or request.url.path == "/metrics":
+        return await call_next(request)
+    with profile_run(f"{request.method}_{request.url.path}", mode=mode) as paths:
+        response = await call_next(request)
+    logger.info(f"Профиль запроса {request.url.path} сохранён: {', '.join(paths)}")
+    response.headers["X-Profile-Files"] = ", ".join(os.path.basename(path) for path in paths)
+    return response
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
 
-# Хранилище для файлов и данных
-files_data = {}
 
 @app.post("/upload-edf/")
 async def upload_edf(file: UploadFile = File(...)):
-    # Генерация уникального file_id
-    unique_id = str(uuid.uuid4())
-    file_id = f"{unique_id}_{file.filename}"
+    # Генерация уникального file_id, он же имя файла в директории загрузок
+    file_id = upload_file_id(file.filename)
     
-    # Сохранение файла
-    file_location = save_uploaded_file(file, UPLOAD_DIR)
+    # Сохранение файла с подсчётом хэша по ходу записи
+    with stage_timer("save_upload"):
+        file_location, content_hash = await save_upload(file, os.path.join(UPLOAD_DIR, file_id))
     if not file_location:
         logger.error(f"Не удалось сохранить файл: {file.filename}")
         raise HTTPException(status_code=500, detail="Не удалось сохранить файл")
     
-    # Инициализация записи в files_data
-    files_data[file_id] = {'file_path': file_location}
+    return await process_uploaded_edf(file_id, file_location, content_hash)
+
+
+@app.post("/uploads/")
+async def create_upload(params: dict):
+    """
+    Открывает возобновляемую загрузку. Тело: {"filename": "rat1.edf", "size": 123456789}.
+    Далее файл отправляется частями PUT /uploads/{upload_id}?offset=N и завершается
+    POST /uploads/{upload_id}/complete.
+    """
+    try:
+        filename = str(params['filename'])
+        size = int(params['size'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Неверные параметры загрузки: {e}")
+    if size <= 0:
+        raise HTTPException(status_code=400, detail="Размер файла должен быть положительным")
+    session = create_session(UPLOAD_DIR, filename, size)
+    return {'upload_id': session['upload_id'], 'file_id': session['file_id'],
+            'chunk_size': UPLOAD_CHUNK_SIZE, 'received': 0, 'size': size}
+
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    """
+    Сколько байт файла уже принято: с этого смещения клиент продолжает после обрыва.
+    """
+    session = get_session(UPLOAD_DIR, upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Сессия загрузки не найдена")
+    return {'upload_id': upload_id, 'received': session['received'], 'size': session['size']}
+
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: int = 0):
+    """
+    Принимает часть файла (тело запроса - сырые байты), начиная со смещения offset.
+    offset должен совпадать с числом уже принятых байт, иначе 409 с актуальным 'received'.
+    """
+    async with locked_session(UPLOAD_DIR, upload_id) as session:
+        if session is None:
+            raise HTTPException(status_code=404, detail="Сессия загрузки не найдена")
+        if offset != session['received']:
+            return JSONResponse(status_code=409, content={
+                'detail': "Смещение не совпадает с принятой частью файла", 'received': session['received']})
+        try:
+            with stage_timer("save_upload"):
+                received = await append_chunk(session, request.stream())
+        except ValueError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+    return {'upload_id': upload_id, 'received': received, 'size': session['size']}
+
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str):
+    """
+    Завершает загрузку и обрабатывает файл так же, как /upload-edf/.
+    """
+    async with locked_session(UPLOAD_DIR, upload_id) as session:
+        if session is None:
+            raise HTTPException(status_code=404, detail="Сессия загрузки не найдена")
+        if session['received'] != session['size']:
+            return JSONResponse(status_code=409, content={
+                'detail': "Файл принят не полностью", 'received': session['received']})
+        try:
+            with stage_timer("save_upload"):
+                file_location, content_hash = await complete_session(session)
+        except Exception as e:
+            logger.error(f"Не удалось завершить загрузку {upload_id}: {e}")
+            raise HTTPException(status_code=500, detail="Не удалось сохранить файл")
+    return await process_uploaded_edf(session['file_id'], file_location, content_hash)
+
+
+def compute_features(file_id, signals, sfreq, fs, lowcut, highcut):
+    """
+    Передискретизирует каналы IS к частоте модели, фильтрует их и извлекает признаки
+    (синхронно: process_uploaded_edf вызывает её в потоке, не блокируя цикл событий).
+
+    Параметры:
+        file_id (str): Идентификатор файла (для журнала).
+        signals (ndarray): Каналы IS с частотой записи.
+        sfreq (float): Частота дискретизации записи.
+        fs (float): Частота дискретизации модели.
+        lowcut, highcut (float): Границы полосового фильтра.
+
+    Возвращает:
+        tuple: (handle признаков в общей памяти или None, признаки, позиции окон).
+    """
+    # Передискретизация каналов IS к частоте модели (при совпадении частот - без копирования)
+    with stage_timer("resample"):
+        model_signals, _ = resample(signals, sfreq, fs)
+    if sfreq != fs:
+        logger.info(f"Сигналы файла '{file_id}' передискретизированы: {sfreq:g} -> {fs} Гц")
+
+    # Применение фильтра к каждому каналу
+    with stage_timer("bandpass_filter"):
+        filtered_signals = []
+        for i in range(model_signals.shape[0]):
+            filtered_signal = bandpass_filter(model_signals[i], lowcut, highcut, fs)
+            filtered_signals.append(filtered_signal)
+        filtered_signals = np.array(filtered_signals)
+    del model_signals
+
+    logger.info(f"Применён фильтр к сигналам файла '{file_id}'")
+
+    # Извлечение признаков: для исполнителя в другом процессе - сразу в общую память
+    with stage_timer("extract_features"):
+        features_handle, features = inference.create_input(
+            (count_windows(filtered_signals.shape[1], fs), 6 * filtered_signals.shape[0]))
+        features, positions = extract_features(filtered_signals, fs, out=features)
+    del filtered_signals
+    return features_handle, features, positions
+
+
+async def process_uploaded_edf(file_id, file_location, content_hash):
+    """
+    Аннотирует сохранённый EDF-файл (IS моделью, SWD и DS детекторами) и регистрирует его в хранилище записей.
+
+    Параметры:
+        file_id (str): Идентификатор файла.
+        file_location (str): Путь к сохранённому файлу.
+        content_hash (str): SHA-256 содержимого, посчитанный при приёме файла.
+
+    Возвращает:
+        dict: 'file_id' и 'final_file_id'.
+    """
+    # Инициализация записи в хранилище
+    save_recording(file_id, {'file_path': file_location})
     logger.info(f"Файл '{file_id}' загружен и сохранён по пути: {file_location}")
     
-    # Загрузка и обработка EDF-файла
-    signals, signal_labels, header, signal_headers, existing_annotations = read_edf_with_annotations(file_location)
+    BYTES_READ.inc(file_size(file_location), source="upload")
+
+    # Загрузка EDF-файла: декодируются только каналы IS и детекторов. Итоговый EDF копирует
+    # записи данных исходного файла без декодирования, сигналы для просмотра читаются из файла
+    with stage_timer("read_edf"):
+        signals, signal_labels, header, signal_headers, existing_annotations = read_edf_with_annotations(
+            file_location, channels=(IS_CHANNELS, SWD_PRODUCT_PARAMS['channels'], DS_PRODUCT_PARAMS['channels']))
     if signals is None:
         logger.error(f"Не удалось загрузить EDF-файл: {file_location}")
         raise HTTPException(status_code=500, detail="Не удалось загрузить EDF-файл")
     
+    BYTES_READ.inc(file_size(file_location), source="edf")
     logger.info(f"Сигналы загружены для файла '{file_id}'. Каналов: {len(signal_labels)}")
     
-    # Применение фильтра к каждому каналу
-    fs = 400  # Частота дискретизации
+    try:
+        sfreq = signal_rate(signal_headers)  # Частота дискретизации записи
+    except ValueError as e:
+        logger.error(f"Файл '{file_id}': {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    fs = MODEL_RATE  # Частота дискретизации модели
     lowcut = 0.5
     highcut = 100
-    filtered_signals = []
-    for i in range(signals.shape[0]):
-        filtered_signal = bandpass_filter(signals[i], lowcut, highcut, fs)
-        filtered_signals.append(filtered_signal)
-    filtered_signals = np.array(filtered_signals)
-    
-    logger.info(f"Применён фильтр к сигналам файла '{file_id}'")
-    
-    # Извлечение признаков
-    features, positions = extract_features(filtered_signals, fs)
-    if features.size == 0:
-        logger.error(f"Не удалось извлечь признаки из данных файла '{file_id}'")
-        raise HTTPException(status_code=500, detail="Не удалось извлечь признаки из данных")
-    
-    logger.info(f"Признаки извлечены для файла '{file_id}'")
+
+    # Признаки той же записи с теми же параметрами берутся из кэша без фильтрации
+    cache_key, cache_params = feature_cache_key(content_hash, fs, lowcut, highcut)
+    with stage_timer("load_cached_features"):
+        features, positions = await asyncio.to_thread(load_cached_features, cache_key, FEATURE_CACHE_DIR)
+    features_handle = None  # Признаки в общей памяти для исполнителя модели
+
+    if features is None:
+        features_handle, features, positions = await asyncio.to_thread(
+            compute_features, file_id, signals[:IS_CHANNELS], sfreq, fs, lowcut, highcut)
+        if features.size == 0:
+            if features_handle is not None:
+                shared_arrays.release(features_handle)
+            logger.error(f"Не удалось извлечь признаки из данных файла '{file_id}'")
+            raise HTTPException(status_code=500, detail="Не удалось извлечь признаки из данных")
+        await asyncio.to_thread(save_cached_features, cache_key, cache_params, features, positions, FEATURE_CACHE_DIR)
+        logger.info(f"Признаки извлечены для файла '{file_id}'")
+    else:
+        logger.info(f"Признаки для файла '{file_id}' взяты из кэша")
     
     # Подготовка данных для модели
     X = features.reshape((features.shape[0], features.shape[1], 1))
     
-    # Предсказание
+    # Предсказание: пока запрос ждёт общий батч модели, цикл событий обслуживает другие запросы
     try:
-        y_pred_probs = model.predict(X)
+        with stage_timer("predict"):
+            y_pred_probs = await asyncio.to_thread(inference.predict, X)
         y_pred_classes = np.argmax(y_pred_probs, axis=1)
         logger.info(f"Предсказания модели выполнены для файла '{file_id}'")
+        # Вероятности сохраняются для повторной разметки IS с другими порогами
+        prediction_key = prediction_cache_key(cache_key, MODEL_HASH)
+        save_probabilities(prediction_key, y_pred_probs, positions, PREDICTION_CACHE_DIR)
     except Exception as e:
         logger.error(f"Ошибка при предсказании модели для файла '{file_id}': {e}")
         raise HTTPException(status_code=500, detail="Ошибка при предсказании модели")
+    finally:
+        if features_handle is not None:
+            shared_arrays.release(features_handle)
     
     # Постобработка предсказаний для генерации аннотаций
-    annotations_pred = postprocess_predictions(y_pred_classes, positions, fs)
+    with stage_timer("postprocess"):
+        annotations_pred = postprocess_predictions(y_pred_classes, positions, fs)
     
     logger.info(f"Постобработка предсказаний завершена для файла '{file_id}'")
     
@@ -131,39 +419,21 @@ async def upload_edf(file: UploadFile = File(...)):
     
     logger.info(f"Аннотации IS объединены для файла '{file_id}'")
     
-    # Сохранение временного EDF-файла с IS аннотациями
-    temp_edf_path = os.path.join(UPLOAD_DIR, f"temp_{file_id}.edf")
-    success = write_edf_with_annotations(
-        original_file_path=file_location,
-        annotations=all_is_annotations,
-        output_file_path=temp_edf_path,
-        header=header,
-        signal_headers=signal_headers,
-        signals=signals
-    )
-    if not success:
-        logger.error(f"Не удалось сохранить временный EDF-файл с аннотациями IS: {temp_edf_path}")
-        raise HTTPException(status_code=500, detail="Не удалось сохранить временный EDF-файл с аннотациями IS")
-    
-    logger.info(f"Временный EDF-файл с аннотациями IS сохранён: {temp_edf_path}")
-    
-    # Обнаружение SWD на аннотированном EDF-файле с IS аннотациями
-    try:
-        swd_annotations = detect_swd(temp_edf_path)
-        swd_annotation_tuples = convert_swd_annotations_to_tuples(swd_annotations)
-        logger.info(f"SWD аннотации обнаружены для файла '{file_id}'")
-    except Exception as e:
-        logger.error(f"Ошибка при обнаружении SWD аннотаций для файла '{file_id}': {e}")
-        raise HTTPException(status_code=500, detail="Ошибка при обнаружении SWD аннотаций")
-    
-    # Обнаружение DS на аннотированном EDF-файле с IS аннотациями
+    # Обнаружение SWD и DS одновременно по сигналам в памяти (в вольтах, как их читает mne);
+    # время каждого детектора - этапы detect_swd/detect_ds, общее - detect
     try:
-        ds_annotations = detect_ds(temp_edf_path)
-        ds_annotation_tuples = convert_ds_annotations_to_tuples(ds_annotations)
-        logger.info(f"DS аннотации обнаружены для файла '{file_id}'")
+        with stage_timer("detect"):
+            data = signals_to_volts(signals[:detector_channels(len(signals))], signal_headers)
+            detections = await asyncio.to_thread(run_detectors, data, sfreq, signal_labels, content_hash,
+                                                 DETECTOR_CACHE_DIR, timer=lambda kind: stage_timer(f"detect_{kind}"))
+            del data
+        swd_annotation_tuples = convert_swd_annotations_to_tuples(detections['swd']['intervals'])
+        ds_annotation_tuples = convert_ds_annotations_to_tuples(detections['ds']['intervals'])
+        logger.info(f"SWD и DS аннотации обнаружены для файла '{file_id}' ("
+                    + ", ".join(f"{kind}: {result['seconds']:.2f} с" for kind, result in detections.items()) + ")")
     except Exception as e:
-        logger.error(f"Ошибка при обнаружении DS аннотаций для файла '{file_id}': {e}")
-        raise HTTPException(status_code=500, detail="Ошибка при обнаружении DS аннотаций")
+        logger.error(f"Ошибка при обнаружении SWD/DS аннотаций для файла '{file_id}': {e}")
+        raise HTTPException(status_code=500, detail="Ошибка при обнаружении SWD/DS аннотаций")
     
     # Объединение всех аннотаций
     final_annotations = all_is_annotations + swd_annotation_tuples + ds_annotation_tuples
@@ -171,9 +441,10 @@ async def upload_edf(file: UploadFile = File(...)):
     logger.info(f"Все аннотации объединены для файла '{file_id}'")
     
     # Объединение перекрывающихся аннотаций по типам
-    merged_is_annotations = merge_overlapping_annotations(final_annotations, 'is')
-    merged_swd_annotations = merge_overlapping_annotations(final_annotations, 'swd')
-    merged_ds_annotations = merge_overlapping_annotations(final_annotations, 'ds')
+    with stage_timer("merge_annotations"):
+        merged_is_annotations = merge_overlapping_annotations(final_annotations, 'is')
+        merged_swd_annotations = merge_overlapping_annotations(final_annotations, 'swd')
+        merged_ds_annotations = merge_overlapping_annotations(final_annotations, 'ds')
     
     logger.info(f"Перекрывающиеся аннотации объединены для файла '{file_id}'")
     
@@ -191,57 +462,249 @@ async def upload_edf(file: UploadFile = File(...)):
     
     # Запись конечного EDF-файла с всеми аннотациями
     final_edf_path = os.path.join(UPLOAD_DIR, f"final_{file_id}.edf")
-    success = write_edf_with_annotations(
-        original_file_path=file_location,
-        annotations=final_merged_annotations,
-        output_file_path=final_edf_path,
-        header=header,
-        signal_headers=signal_headers,
-        signals=signals
-    )
+    with stage_timer("write_final_edf"):
+        success = await asyncio.to_thread(save_annotations_streaming, file_location, final_edf_path,
+                                          final_merged_annotations)
     if not success:
         logger.error(f"Не удалось сохранить конечный EDF-файл с аннотациями: {final_edf_path}")
         raise HTTPException(status_code=500, detail="Не удалось сохранить конечный EDF-файл с аннотациями")
     
+    BYTES_WRITTEN.inc(file_size(final_edf_path), target="final_edf")
     logger.info(f"Конечный EDF-файл с аннотациями сохранён: {final_edf_path}")
     
-    # Добавление финального файла в files_data
+    # Добавление финального файла в хранилище
     final_file_id = f"final_{file_id}"
-    files_data[final_file_id] = {
+    final_saved = save_recording(final_file_id, {
         'file_path': final_edf_path,
-        'signals': signals,
         'signal_labels': signal_labels,
         'annotations': final_merged_annotations,
         'header': header,
-        'signal_headers': signal_headers
-    }
-    logger.info(f"Файл '{final_file_id}' добавлен в хранилище files_data")
+        'signal_headers': signal_headers,
+        'sfreq': sfreq,
+        'content_hash': content_hash,
+        'prediction_key': prediction_key
+    })
     
     # Сохранение обработанных данных
-    files_data[file_id]['signals'] = signals
-    files_data[file_id]['signal_labels'] = signal_labels
-    files_data[file_id]['annotations'] = final_merged_annotations
-    files_data[file_id]['header'] = header
-    files_data[file_id]['signal_headers'] = signal_headers
-    files_data[file_id]['final_edf_path'] = final_edf_path
+    saved = save_recording(file_id, {
+        'file_path': file_location,
+        'signal_labels': signal_labels,
+        'annotations': final_merged_annotations,
+        'header': header,
+        'signal_headers': signal_headers,
+        'sfreq': sfreq,
+        'final_edf_path': final_edf_path,
+        'content_hash': content_hash,
+        'prediction_key': prediction_key
+    })
+    if not (saved and final_saved):
+        logger.error(f"Не удалось сохранить обработанные данные файла '{file_id}' в хранилище")
+        raise HTTPException(status_code=500, detail="Не удалось сохранить обработанные данные")
+    logger.info(f"Файл '{final_file_id}' добавлен в хранилище записей")
     
     logger.info(f"Обработанные данные сохранены для файла '{file_id}'")
     
     return {"file_id": file_id, "final_file_id": final_file_id}
 
 
+def detector_products(kind, content_hash, edf_path):
+    """
+    Промежуточные данные детектора из кэша или вычисленные по EDF-файлу и сохранённые в кэш.
+
+    Параметры:
+        kind (str): 'swd' или 'ds'.
+        content_hash (str): SHA-256 исходного EDF-файла.
+        edf_path (str): EDF-файл, по которому вычисляются данные при промахе кэша.
+
+    Возвращает:
+        dict: Промежуточные данные или None при ошибке.
+    """
+    detector = DETECTORS[kind]
+
+    def compute():
+        BYTES_READ.inc(file_size(edf_path), source=f"detect_{kind}")
+        return detector['products'](edf_path)
+
+    return cached_products(kind, content_hash, detector['params'], compute, DETECTOR_CACHE_DIR)
+
+
+async def _file_detector_products(file_id, kind):
+    file_info = load_recording(file_id)
+    if not file_info or 'content_hash' not in file_info:
+        logger.warning(f"Файл не найден или не обработан для file_id: {file_id}")
+        raise HTTPException(status_code=404, detail="Файл не найден или не обработан")
+    if kind not in DETECTORS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный детектор: {kind}")
+    # При промахе кэша данные считаются по EDF-файлу - в потоке, цикл событий не блокируется
+    products = await asyncio.to_thread(detector_products, kind, file_info['content_hash'], file_info['file_path'])
+    if products is None:
+        raise HTTPException(status_code=500, detail=f"Не удалось получить промежуточные данные детектора {kind}")
+    return products
+
+
+@app.post("/redetect/{file_id}")
+async def redetect(file_id: str, params: dict):
+    """
+    Повторная детекция с новыми параметрами по кэшированным промежуточным данным.
+    Тело: {"swd": {"amplitude_threshold": 0.0004}, "ds": {...}}; не заданные параметры - по умолчанию.
+    """
+    result = {}
+    for kind, kind_params in params.items():
+        products = await _file_detector_products(file_id, kind)
+        try:
+            with stage_timer(f"redetect_{kind}"):
+                result[kind] = DETECTORS[kind]['detect'](products, **kind_params)
+        except TypeError as e:
+            raise HTTPException(status_code=400, detail=f"Неверные параметры детектора {kind}: {e}")
+    return result
+
+
+@app.post("/sweep/{file_id}")
+async def sweep(file_id: str, grid: dict):
+    """
+    Детекция для всех комбинаций сетки параметров по кэшированным промежуточным данным.
+    Тело: {"swd": {"amplitude_threshold": [0.0003, 0.0005], "min_spikes_per_second": [5, 7]}, "ds": {...}}.
+    """
+    # Сетка проверяется целиком до вычисления промежуточных данных
+    for kind, kind_grid in grid.items():
+        if kind not in DETECTORS:
+            raise HTTPException(status_code=400, detail=f"Неизвестный детектор: {kind}")
+        if not isinstance(kind_grid, dict):
+            raise HTTPException(status_code=400, detail=f"Сетка детектора {kind} должна быть объектом")
+        for name, values in kind_grid.items():
+            if not isinstance(values, list) or not values:
+                raise HTTPException(status_code=400,
+                                    detail=f"Параметр {name} детектора {kind}: нужен непустой список значений")
+        combinations = int(np.prod([len(values) for values in kind_grid.values()])) if kind_grid else 1
+        if combinations > MAX_SWEEP_COMBINATIONS:
+            raise HTTPException(status_code=400, detail=f"Слишком большая сетка: {combinations} комбинаций")
+
+    result = {}
+    for kind, kind_grid in grid.items():
+        products = await _file_detector_products(file_id, kind)
+        try:
+            with stage_timer(f"sweep_{kind}"):
+                runs = DETECTORS[kind]['sweep'](products, kind_grid)
+        except TypeError as e:
+            raise HTTPException(status_code=400, detail=f"Неверные параметры детектора {kind}: {e}")
+        result[kind] = [dict(run, count=len(run['intervals'])) for run in runs]
+    return result
+
+
+@app.post("/rethreshold/{file_id}")
+async def rethreshold(file_id: str, params: dict):
+    """
+    Повторная разметка IS по сохранённым вероятностям классов без запуска модели.
+    Тело: {"thresholds": {"1": 0.6, "2": 0.5}, "smoothing": 3}; без порогов - argmax.
+    Возвращает пары IS в формате /get-annotations.
+    """
+    file_info = load_recording(file_id)
+    if not file_info or 'prediction_key' not in file_info:
+        logger.warning(f"Файл не найден или не обработан для file_id: {file_id}")
+        raise HTTPException(status_code=404, detail="Файл не найден или не обработан")
+    probabilities, positions = load_probabilities(file_info['prediction_key'], PREDICTION_CACHE_DIR)
+    if probabilities is None:
+        raise HTTPException(status_code=404, detail="Вероятности классов для файла не сохранены")
+    try:
+        thresholds = {int(cls): float(value) for cls, value in (params.get('thresholds') or {}).items()}
+        smoothing = int(params.get('smoothing', 1))
+    except (TypeError, ValueError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Неверные параметры: {e}")
+    with stage_timer("rethreshold"):
+        annotations = reannotate_is(probabilities, positions, MODEL_RATE, thresholds, smoothing)
+        merged = merge_overlapping_annotations(annotations, 'is')
+    return {'is': process_annotations_to_pairs(merged)['is']}
+
+
+def is_end_message(text):
+    """
+    Признак конца потока: текстовое сообщение "end" (как есть или строкой JSON) или JSON {"type": "end"}.
+    """
+    if text is None:
+        return False
+    if text.strip() == "end":
+        return True
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return False
+    return message == "end" or (isinstance(message, dict) and message.get('type') == 'end')
+
+
+@app.websocket("/stream")
+async def stream(websocket: WebSocket):
+    """
+    Разметка в реальном времени. Первое сообщение - JSON с параметрами потока:
+    {"sfreq": 400, "channels": ["EEG 1", ...], "dimensions": ["uV", ...], "swd": {...}, "ds": {...}}.
+    Далее бинарные сообщения - блоки сигналов float32 (little-endian) формы (n_channels, n_samples)
+    в порядке C; текстовое сообщение {"type": "end"} (или "end") завершает поток,
+    на другие текстовые сообщения приходит {"type": "error", "detail": ...}.
+    В ответ приходят события {"type": "is"|"swd"|"ds", "event": "start"|"end", "time", "stream_time"}.
+    """
+    await websocket.accept()
+    try:
+        config = await websocket.receive_json()
+        channels = list(config['channels'])
+        annotator = StreamingAnnotator(float(config['sfreq']), channels, inference.predict,
+                                       dimensions=config.get('dimensions'),
+                                       swd_params=config.get('swd'), ds_params=config.get('ds'))
+    except WebSocketDisconnect:
+        return
+    except Exception as e:
+        logger.error(f"Неверные параметры потока: {e}")
+        await websocket.close(code=1003, reason="Неверные параметры потока")
+        return
+    await websocket.send_json({'type': 'ready', 'sfreq': annotator.fs, 'channels': channels})
+    logger.info(f"Открыт поток разметки: {len(channels)} каналов, {annotator.fs} Гц")
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message.get('bytes') is not None:
+                block = np.frombuffer(message['bytes'], dtype='<f4').reshape(len(channels), -1)
+                # Фильтрация, детекция и ожидание батча модели - в потоке, цикл событий не блокируется
+                with stage_timer("stream_block"):
+                    events = await asyncio.to_thread(annotator.push, block)
+            elif is_end_message(message.get('text')):
+                events = annotator.close() + [{'type': 'end', 'stream_time': annotator.stream_time}]
+            else:
+                await websocket.send_json({'type': 'error',
+                                           'detail': 'Ожидались блоки сигналов или {"type": "end"}'})
+                continue
+            for event in events:
+                await websocket.send_json(event)
+            if message.get('bytes') is None:
+                await websocket.close()
+                break
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Ошибка в потоке разметки: {e}")
+        await websocket.close(code=1011, reason=str(e)[:120])
+    logger.info(f"Поток разметки закрыт, обработано {annotator.stream_time:.1f} сек.")
+
+
 @app.get("/get-signals/{file_id}")
 async def get_signals(file_id: str):
-    file_info = files_data.get(file_id)
-    if not file_info or 'signals' not in file_info:
+    file_info = load_recording(file_id)
+    if not file_info or 'signal_labels' not in file_info:
         logger.warning(f"Файл не найден для file_id: {file_id}")
         raise HTTPException(status_code=404, detail="Файл не найден или сигналы не обработаны")
 
-    signals = file_info['signals']
-    labels = file_info.get('signal_labels', [])
+    labels = file_info['signal_labels']
+
+    # Первые 30 минут всех каналов читаются из файла записи: остальная запись не декодируется
+    n_samples = int(30 * 60 * file_info.get('sfreq', MODEL_RATE))
+    with stage_timer("read_signals"):
+        signals = await asyncio.to_thread(read_edf_window, file_info['file_path'], 0, n_samples)
+    if signals is None:
+        raise HTTPException(status_code=500, detail="Не удалось прочитать сигналы")
 
     # Преобразование сигналов в список для JSON
-    signals_data = {str(i): signals[i][:30*60*400].tolist() for i in range(signals.shape[0])}
+    with stage_timer("serialize_signals"):
+        signals_data = {str(i): signals[i][:n_samples].tolist() for i in range(signals.shape[0])}
 
     # Сохранение данных в JSON-файл
     json_path = save_signals_as_json(file_id, signals_data, labels, output_dir=JSON_DIR)
@@ -256,7 +719,7 @@ async def get_signals(file_id: str):
 
 @app.get("/get-annotations/{file_id}")
 async def get_annotations(file_id: str):
-    file_info = files_data.get(file_id)
+    file_info = load_recording(file_id)
     if not file_info or 'annotations' not in file_info:
         logger.warning(f"Файл не найден или аннотации не обработаны для file_id: {file_id}")
         raise HTTPException(status_code=404, detail="Файл не найден или аннотации не обработаны")
@@ -267,7 +730,7 @@ async def get_annotations(file_id: str):
 
 @app.post("/update-annotations/{file_id}")
 async def update_annotations(file_id: str, new_annotations: dict):
-    file_info = files_data.get(file_id)
+    file_info = load_recording(file_id)
     if not file_info:
         logger.warning(f"Файл не найден для обновления аннотаций: {file_id}")
         raise HTTPException(status_code=404, detail="Файл не найден")
@@ -278,25 +741,21 @@ async def update_annotations(file_id: str, new_annotations: dict):
     updated_annotations = convert_annotations_from_json(new_annotations)
 
     # Сохранение EDF-файла с новыми аннотациями
-    success = write_edf_with_annotations(
-        original_file_path,
-        updated_annotations,
-        output_file_path,
-        file_info['header'],
-        file_info['signal_headers'],
-        file_info['signals']
-    )
+    with stage_timer("write_updated_edf"):
+        success = await asyncio.to_thread(save_annotations_streaming, original_file_path, output_file_path,
+                                          updated_annotations)
     if not success:
         logger.error(f"Не удалось обновить EDF-файл: {output_file_path}")
         raise HTTPException(status_code=500, detail="Не удалось обновить EDF-файл")
+    BYTES_WRITTEN.inc(file_size(output_file_path), target="updated_edf")
     # Обновляем информацию о файле
-    files_data[file_id]['updated_file_path'] = output_file_path
+    update_recording(file_id, updated_file_path=output_file_path)
     logger.info(f"EDF-файл обновлён: {output_file_path}")
     return {"message": "EDF-файл успешно обновлён"}
 
 @app.get("/download-edf/{file_id}")
 async def download_edf(file_id: str):
-    file_info = files_data.get(file_id)
+    file_info = load_recording(file_id)
     if file_info:
         updated_file_path = file_info.get('updated_file_path')
         if updated_file_path:
@@ -312,7 +771,7 @@ async def download_edf(file_id: str):
                 media_type='application/octet-stream'
             )
     else:
-        logger.warning(f"file_id {file_id} не найден в files_data")
+        logger.warning(f"file_id {file_id} не найден в хранилище записей")
         raise HTTPException(status_code=404, detail="Обновлённый файл не найден")
     
 
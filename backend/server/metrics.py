@@ -0,0 +1,275 @@
+# metrics.py
+#
+# Метрики сервера в текстовом формате Prometheus (exposition format 0.0.4)
+# и заголовок Server-Timing с длительностями этапов обработки запроса.
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин гистограмм длительностей, сек.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+# Границы корзин размеров батча модели, окон
+BATCH_BUCKETS = (1, 8, 32, 128, 512, 2048, 8192, 32768, 131072)
+
+_registry = []
+_lock = threading.Lock()
+
+# Длительности этапов текущего запроса для заголовка Server-Timing
+_request_timings = ContextVar("request_timings", default=None)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class _Metric:
+    """
+    Базовая метрика с набором меток; значения хранятся по кортежу значений меток.
+    """
+    metric_type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with _lock:
+            return [(self.name, key, None, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for name, key, extra, value in self._samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Монотонно растущий счётчик.
+    """
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение; может вычисляться функцией в момент опроса.
+    """
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        """
+        Значение с метками labels, вычисляемое при каждом опросе /metrics.
+        """
+        self._functions[self._key(labels)] = function
+
+    def _samples(self):
+        if self._functions:
+            samples = []
+            for key, function in list(self._functions.items()):
+                try:
+                    samples.append((self.name, key, None, function()))
+                except Exception:
+                    pass
+            return samples
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма с кумулятивными корзинами, суммой и количеством наблюдений.
+    """
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + ((math.inf,) if buckets[-1] != math.inf else ())
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        samples = []
+        with _lock:
+            for key, state in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, state["counts"]):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key, ("le", _format_value(bound)), cumulative))
+                samples.append((f"{self.name}_sum", key, None, state["sum"]))
+                samples.append((f"{self.name}_count", key, None, state["count"]))
+        return samples
+
+
+def render_metrics():
+    """
+    Формирует текст всех зарегистрированных метрик для эндпоинта /metrics.
+
+    Возвращает:
+        str: Метрики в текстовом формате Prometheus.
+    """
+    with _lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _resident_memory_bytes():
+    """
+    Резидентная память процесса (Linux: /proc/self/statm, иначе пиковое значение из resource).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Метрики сервера
+STAGE_SECONDS = Histogram("ecog_stage_seconds", "Длительность этапов обработки, сек.", ["stage"])
+BYTES_READ = Counter("ecog_bytes_read_total", "Прочитано байт", ["source"])
+BYTES_WRITTEN = Counter("ecog_bytes_written_total", "Записано байт", ["target"])
+RECORDINGS_STORED = Gauge("ecog_recordings_stored", "Записей в общем хранилище")
+RECORDINGS_BYTES = Gauge("ecog_recordings_bytes", "Объём файлов сервера на диске (загрузки и кэши), байт", ["directory"])
+SHARED_ARRAYS_BYTES = Gauge("ecog_shared_arrays_bytes", "Объём массивов процесса в общей памяти, байт")
+INFERENCE_BATCH_SIZE = Histogram("ecog_inference_batch_size", "Размер батча модели, окон", buckets=BATCH_BUCKETS)
+HTTP_REQUESTS = Counter("ecog_http_requests_total", "Количество HTTP-запросов", ["method", "endpoint", "status"])
+HTTP_REQUEST_SECONDS = Histogram("ecog_http_request_seconds", "Длительность HTTP-запросов, сек.", ["endpoint"])
+HTTP_IN_PROGRESS = Gauge("ecog_http_requests_in_progress", "HTTP-запросов в обработке")
+PROCESS_MEMORY = Gauge("process_resident_memory_bytes", "Резидентная память процесса, байт")
+PROCESS_MEMORY.set_function(_resident_memory_bytes)
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Замер этапа: наблюдение в гистограмме ecog_stage_seconds и запись для Server-Timing.
+
+    Параметры:
+        stage (str): Название этапа.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def start_request_timing():
+    """
+    Начинает сбор длительностей этапов для текущего запроса.
+
+    Возвращает:
+        list: Список (этап, сек.), который заполняет stage_timer.
+    """
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings, total=None):
+    """
+    Значение заголовка Server-Timing, длительности в миллисекундах.
+    """
+    parts = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def file_size(path):
+    """
+    Размер файла в байтах или 0, если файл недоступен.
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def directory_size(path):
+    """
+    Суммарный размер файлов директории (с поддиректориями) в байтах; 0, если директории нет.
+    """
+    total = 0
+    for root, _, names in os.walk(path):
+        total += sum(file_size(os.path.join(root, name)) for name in names)
+    return total
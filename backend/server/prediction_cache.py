@@ -0,0 +1,153 @@
+# prediction_cache.py
+#
+# Кэш вероятностей классов модели по окнам записи (float16 или uint8)
+# и повторная разметка IS с другими порогами и сглаживанием без запуска модели.
+
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+from scipy.ndimage import uniform_filter1d
+from annotation_utils import postprocess_predictions
+from feature_cache import evict_cache, save_npy_atomic, touch_cache_entry
+
+logger = logging.getLogger(__name__)
+
+PREDICTION_CACHE_DIR = os.environ.get("ECOG_PREDICTION_CACHE_DIR", "data/predictions")
+# Предельный объём кэша вероятностей, ГБ (0 - без ограничения); час записи занимает около 30 КБ
+PREDICTION_CACHE_MAX_BYTES = int(float(os.environ.get("ECOG_PREDICTION_CACHE_MAX_GB", 1)) * 1024 ** 3)
+
+# Формат хранения вероятностей: 'float16' (погрешность ~1e-3) или 'uint8' (шаг 1/255)
+PROBABILITY_DTYPE = os.environ.get("ECOG_PROBABILITY_DTYPE", "float16")
+
+# Классы модели: 0 - фон, 1 - начало IS (is1), 2 - конец IS (is2)
+IS_CLASSES = (1, 2)
+
+
+def prediction_cache_key(feature_key, model_hash):
+    """
+    Ключ кэша: ключ признаков (запись и параметры DSP) и хэш файла модели.
+    """
+    description = {"feature_key": feature_key, "model_hash": model_hash}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()[:40]
+
+
+def quantize_probabilities(probabilities, dtype=PROBABILITY_DTYPE):
+    """
+    Сжимает вероятности (n_windows, n_classes) для хранения.
+
+    Параметры:
+        probabilities (ndarray): Вероятности классов в диапазоне [0, 1].
+        dtype (str): 'float16' или 'uint8'.
+
+    Возвращает:
+        ndarray: Сжатый массив.
+    """
+    if dtype == "uint8":
+        return np.round(np.clip(probabilities, 0, 1) * 255).astype(np.uint8)
+    return np.asarray(probabilities, dtype=np.float16)
+
+
+def dequantize_probabilities(stored):
+    """
+    Восстанавливает вероятности float32 из сжатого массива.
+    """
+    if stored.dtype == np.uint8:
+        return stored.astype(np.float32) / 255
+    return stored.astype(np.float32)
+
+
+def save_probabilities(key, probabilities, positions, cache_dir=None, dtype=PROBABILITY_DTYPE):
+    """
+    Сохраняет вероятности классов и позиции окон записи.
+
+    Возвращает:
+        bool: True при успешной записи, False иначе.
+    """
+    cache_dir = cache_dir or PREDICTION_CACHE_DIR
+    base = os.path.join(cache_dir, key)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_npy_atomic(f"{base}_positions.npy", positions)
+        # Вероятности пишутся последними и служат признаком полной записи
+        save_npy_atomic(f"{base}_probabilities.npy", quantize_probabilities(probabilities, dtype))
+        logger.info(f"Вероятности классов сохранены: {base}_probabilities.npy")
+        evict_cache(cache_dir, PREDICTION_CACHE_MAX_BYTES, keep=key)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении вероятностей классов {base}: {e}")
+        return False
+
+
+def load_probabilities(key, cache_dir=None):
+    """
+    Загружает вероятности классов и позиции окон записи.
+
+    Возвращает:
+        probabilities (ndarray): Вероятности (n_windows, n_classes), float32, или None.
+        positions (ndarray): Позиции окон или None.
+    """
+    base = os.path.join(cache_dir or PREDICTION_CACHE_DIR, key)
+    if not os.path.exists(f"{base}_probabilities.npy"):
+        return None, None
+    try:
+        probabilities = dequantize_probabilities(np.load(f"{base}_probabilities.npy", mmap_mode="r"))
+        positions = np.load(f"{base}_positions.npy", mmap_mode="r")
+        touch_cache_entry(f"{base}_probabilities.npy")
+        return probabilities, positions
+    except Exception as e:
+        logger.error(f"Ошибка при чтении вероятностей классов {base}: {e}")
+        return None, None
+
+
+def classes_from_probabilities(probabilities, thresholds=None, smoothing=1):
+    """
+    Решающее правило по вероятностям классов.
+
+    Без порогов - argmax, как при обычной разметке. С порогами окно относится к классу
+    IS (1 или 2), если его вероятность не ниже порога (при нескольких - к более вероятному),
+    иначе к фону; для классов без порога используется argmax.
+
+    Параметры:
+        probabilities (ndarray): Вероятности (n_windows, n_classes).
+        thresholds (dict): Класс (1, 2) -> минимальная вероятность.
+        smoothing (int): Ширина скользящего среднего вероятностей по окнам (1 - без сглаживания).
+
+    Возвращает:
+        ndarray: Класс каждого окна.
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    if smoothing and smoothing > 1:
+        probabilities = uniform_filter1d(probabilities, size=int(smoothing), axis=0, mode="nearest")
+    argmax = np.argmax(probabilities, axis=1)
+    if not thresholds:
+        return argmax
+
+    classes = np.zeros(len(probabilities), dtype=argmax.dtype)
+    best = np.full(len(probabilities), -1.0, dtype=np.float32)
+    for cls in IS_CLASSES:
+        threshold = thresholds.get(cls)
+        eligible = argmax == cls if threshold is None else probabilities[:, cls] >= threshold
+        eligible &= probabilities[:, cls] > best
+        classes[eligible] = cls
+        best[eligible] = probabilities[eligible, cls]
+    return classes
+
+
+def reannotate_is(probabilities, positions, fs, thresholds=None, smoothing=1):
+    """
+    Аннотации IS по сохранённым вероятностям с заданными порогами и сглаживанием.
+
+    Параметры:
+        probabilities (ndarray): Вероятности (n_windows, n_classes).
+        positions (ndarray): Позиции окон.
+        fs (float): Частота дискретизации.
+        thresholds (dict): Класс (1, 2) -> минимальная вероятность.
+        smoothing (int): Ширина сглаживания вероятностей, окон.
+
+    Возвращает:
+        list: Аннотации в формате (onset, duration, description).
+    """
+    classes = classes_from_probabilities(probabilities, thresholds, smoothing)
+    return postprocess_predictions(classes, positions, fs)
@@ -0,0 +1,127 @@
+# resampling.py
+#
+# Частота дискретизации записи на входе конвейера: истинная частота берётся из заголовков
+# сигналов EDF, сигналы один раз передискретизируются полифазным фильтром (resample_poly)
+# к частоте, нужной этапу: признаки IS и SWD - частота модели (400 Гц), DS - исходная частота
+# (или ds_detection.DS_RATE, если она задана). Фильтры передискретизации строятся один раз
+# для каждой пары множителей (up, down).
+
+import math
+from fractions import Fraction
+from functools import lru_cache
+import numpy as np
+from scipy.signal import firwin, resample_poly
+
+# Частота дискретизации, с которой обучена модель IS
+MODEL_RATE = 400
+
+
+def signal_rate(signal_headers):
+    """
+    Частота дискретизации записи по заголовкам сигналов pyedflib.
+
+    Возвращает:
+        float: Частота, Гц.
+    """
+    # 'sample_rate' - имя поля в старых версиях pyedflib
+    rates = {float(h.get('sample_frequency', h.get('sample_rate'))) for h in signal_headers}
+    if len(rates) != 1:
+        raise ValueError(f"Каналы записаны с разной частотой дискретизации: {sorted(rates)}")
+    return rates.pop()
+
+
+def resampling_factors(sfreq, rate):
+    """
+    Множители передискретизации sfreq -> rate: rate = sfreq * up / down.
+
+    Возвращает:
+        tuple: (up, down); (1, 1) - частоты совпадают.
+    """
+    ratio = Fraction(rate).limit_denominator(1000) / Fraction(sfreq).limit_denominator(1000)
+    return ratio.numerator, ratio.denominator
+
+
+@lru_cache(maxsize=32)
+def resampling_filter(up, down):
+    """
+    КИХ-фильтр передискретизации (тот же, что resample_poly строит по умолчанию).
+    """
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0))
+
+
+def resampling_margin(sfreq, rate):
+    """
+    Запас исходных отсчётов с каждой стороны отрезка, при котором передискретизация отрезка
+    совпадает с передискретизацией всей записи (кратен down).
+    """
+    up, down = resampling_factors(sfreq, rate)
+    if up == down:
+        return 0
+    half_len = (len(resampling_filter(up, down)) - 1) // 2
+    return math.ceil((half_len / up + 1) / down) * down
+
+
+def resampled_length(n_samples, sfreq, rate):
+    """
+    Количество отсчётов записи длины n_samples после передискретизации.
+    """
+    up, down = resampling_factors(sfreq, rate)
+    return -(-n_samples * up // down)
+
+
+def resample(data, sfreq, rate=MODEL_RATE):
+    """
+    Передискретизирует сигналы к частоте rate полифазным фильтром.
+
+    Отсчёт k результата соответствует отсчёту k * down / up исходных сигналов, поэтому отрезок
+    записи, начинающийся с отсчёта, кратного down, с запасом resampling_margin с обеих сторон
+    даёт те же отсчёты, что и передискретизация всей записи.
+
+    Параметры:
+        data (ndarray): Сигналы формы (..., n_samples).
+        sfreq (float): Частота дискретизации data.
+        rate (float): Требуемая частота.
+
+    Возвращает:
+        tuple: (сигналы с частотой rate, rate); при совпадении частот - data без копирования.
+    """
+    up, down = resampling_factors(sfreq, rate)
+    if up == down:
+        return data, sfreq
+    # resample_poly масштабирует коэффициенты фильтра на месте - передаётся копия
+    window = resampling_filter(up, down).copy()
+    return resample_poly(np.asarray(data, dtype=np.float64), up, down, axis=-1, window=window), float(rate)
+
+
+def resample_segment(data, first, n_samples, sfreq, rate=MODEL_RATE):
+    """
+    Передискретизирует отрезок записи так, чтобы отсчёты совпали с передискретизацией всей записи.
+
+    Отрезок должен начинаться с отсчёта, кратного down; запас resampling_margin у внутренних
+    границ отрезка отбрасывается (у начала и конца записи запас не нужен).
+
+    Параметры:
+        data (ndarray): Сигналы отрезка формы (..., n), начинающегося с отсчёта first.
+        first (int): Первый отсчёт отрезка в записи.
+        n_samples (int): Длина всей записи, отсчётов.
+        sfreq (float): Частота дискретизации записи.
+        rate (float): Требуемая частота.
+
+    Возвращает:
+        tuple: (первый отсчёт результата в записи с частотой rate, сигналы с частотой rate).
+    """
+    up, down = resampling_factors(sfreq, rate)
+    if up == down:
+        return first, data
+    if first % down:
+        raise ValueError(f"Начало отрезка {first} не кратно {down}")
+    margin = resampling_margin(sfreq, rate)
+    last = first + data.shape[-1]
+    lo = first + margin if first > 0 else 0
+    hi = last - margin if last < n_samples else n_samples
+    resampled, _ = resample(data, sfreq, rate)
+    lo_rate, hi_rate = lo * up // down, resampled_length(hi, sfreq, rate)
+    start = first * up // down
+    return lo_rate, resampled[..., lo_rate - start:hi_rate - start]
@@ -0,0 +1,239 @@
+# shared_arrays.py
+#
+# Обмен массивами между процессами без сериализации - матрица признаков для исполнителя модели
+# (inference_service): другому процессу передаётся только описание SharedArray (путь, форма, тип),
+# и он отображает тот же .npy-файл через mmap. Сигналы и огибающие детекторов процесс сервера
+# не покидают (между процессами uvicorn записи общие через state_store).
+#
+# Без копирования передаются массивы, которые уже лежат в .npy-файле целиком (describe):
+# созданные в общей памяти (tmpfs, /dev/shm) через create и заполненные на месте
+# и признаки из кэша, отображённые np.load(mmap_mode=...). Остальные копируются через share.
+#
+# Время жизни - явное, со счётчиком ссылок в процессе-владельце: share/create дают одну ссылку,
+# acquire добавляет, release убирает; с последней ссылкой файл удаляется. Процессы, уже
+# отобразившие файл, дочитывают его и после удаления. Файлы процессов, завершившихся
+# аварийно, удаляет cleanup_orphans при запуске.
+
+import atexit
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Директория общих массивов: tmpfs, если он есть (в docker - размер shm_size)
+SHARED_DIR = os.environ.get("ECOG_SHARED_DIR") or (
+    os.path.join("/dev/shm", "ecog") if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "ecog_shared"))
+# Массивы меньше этого размера дешевле передать сериализацией, байт
+SHARED_MIN_BYTES = int(os.environ.get("ECOG_SHARED_MIN_BYTES", 1 << 20))
+
+
+class SharedArray(namedtuple("SharedArray", ["path", "shape", "dtype"])):
+    """
+    Описание общего массива; передаётся между процессами вместо данных.
+    shape может отличаться от формы в файле (то же число элементов в том же порядке).
+    """
+
+    def open(self, mode="r"):
+        """
+        Отображает массив в память ('r' - только чтение, 'r+' - с записью).
+        """
+        return np.load(self.path, mmap_mode=mode).reshape(self.shape)
+
+
+def describe(array):
+    """
+    Описание массива, который целиком занимает отображённый в память .npy-файл (массив create
+    или np.load(mmap_mode=...)), либо его непрерывного представления другой формы:
+    другой процесс отобразит тот же файл без копирования.
+
+    Возвращает:
+        SharedArray: Описание или None, если массив не отображён из .npy-файла целиком.
+    """
+    root = array if isinstance(array.base, mmap.mmap) else array.base
+    if not isinstance(root, np.memmap) or not isinstance(root.base, mmap.mmap) or root.filename is None:
+        return None
+    if (array.dtype != root.dtype or array.nbytes != root.nbytes or not array.flags.c_contiguous
+            or array.ctypes.data != root.ctypes.data or not root.flags.c_contiguous):
+        return None
+    return SharedArray(root.filename, tuple(array.shape), array.dtype.str)
+
+
+def resolve(value):
+    """
+    Массив по описанию SharedArray; остальные значения возвращаются без изменений.
+    """
+    return value.open() if isinstance(value, SharedArray) else value
+
+
+def _pid_alive(pid):
+    # В Windows os.kill завершает процесс - файлы не удаляются
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def cleanup_orphans(directory=None):
+    """
+    Удаляет общие массивы процессов, которые больше не существуют.
+
+    Возвращает:
+        int: Количество удалённых файлов.
+    """
+    directory = directory or SHARED_DIR
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        owner = name.split("_", 1)[0]
+        if not owner.isdigit() or _pid_alive(int(owner)):
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"Удалено общих массивов завершившихся процессов: {removed}")
+    return removed
+
+
+class SharedArrayRegistry:
+    """
+    Общие массивы, созданные процессом, со счётчиками ссылок.
+
+    Параметры:
+        directory (str): Директория файлов массивов (tmpfs).
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or SHARED_DIR
+        self._refs = {}
+        self._sizes = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    @property
+    def count(self):
+        """Количество живых массивов."""
+        return len(self._refs)
+
+    @property
+    def nbytes(self):
+        """Объём живых массивов, байт."""
+        return sum(self._sizes.values())
+
+    def create(self, shape, dtype=np.float64):
+        """
+        Создаёт общий массив (одна ссылка) для заполнения на месте.
+
+        Место в tmpfs резервируется сразу: при нехватке памяти - OSError,
+        а не SIGBUS при записи в отображение.
+
+        Возвращает:
+            tuple: (SharedArray, ndarray с возможностью записи).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}_{uuid.uuid4().hex}.npy")
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if shutil.disk_usage(self.directory).free < nbytes:
+            raise OSError(f"Недостаточно места в {self.directory} для массива {nbytes} байт")
+        try:
+            array = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=tuple(shape))
+            if hasattr(os, "posix_fallocate"):
+                with open(path, "r+b") as f:
+                    os.posix_fallocate(f.fileno(), 0, os.fstat(f.fileno()).st_size)
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        handle = SharedArray(path, tuple(array.shape), array.dtype.str)
+        with self._lock:
+            self._refs[path] = 1
+            self._sizes[path] = nbytes
+        return handle, array
+
+    def share(self, array):
+        """
+        Копирует массив в общую память (одна ссылка).
+
+        Возвращает:
+            SharedArray: Описание для передачи другому процессу.
+        """
+        array = np.asarray(array)
+        handle, shared = self.create(array.shape, array.dtype)
+        shared[...] = array
+        del shared
+        return handle
+
+    def acquire(self, handle):
+        """
+        Добавляет ссылку на массив.
+        """
+        with self._lock:
+            if handle.path not in self._refs:
+                raise KeyError(f"Общий массив уже освобождён: {handle.path}")
+            self._refs[handle.path] += 1
+        return handle
+
+    def release(self, handle):
+        """
+        Убирает ссылку на массив; с последней ссылкой файл удаляется.
+
+        Возвращает:
+            bool: True, если массив удалён.
+        """
+        with self._lock:
+            refs = self._refs.get(handle.path)
+            if refs is None:
+                return False
+            if refs > 1:
+                self._refs[handle.path] = refs - 1
+                return False
+            del self._refs[handle.path]
+            del self._sizes[handle.path]
+        try:
+            os.remove(handle.path)
+        except OSError as e:
+            logger.warning(f"Не удалось удалить общий массив {handle.path}: {e}")
+        return True
+
+    @contextmanager
+    def lease(self, array):
+        """
+        Общая копия массива на время блока with.
+        """
+        handle = self.share(array)
+        try:
+            yield handle
+        finally:
+            self.release(handle)
+
+    def close(self):
+        """
+        Удаляет все массивы процесса независимо от счётчиков (завершение процесса).
+        """
+        with self._lock:
+            paths = list(self._refs)
+            self._refs.clear()
+            self._sizes.clear()
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
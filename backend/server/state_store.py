@@ -0,0 +1,115 @@
+# state_store.py
+#
+# Общее для всех процессов uvicorn хранилище обработанных записей: метаданные и аннотации - в SQLite,
+# поэтому запись, загруженная через один процесс, доступна в любом другом.
+# Сигналы не хранятся: они читаются из EDF-файла записи ('file_path') по запросу.
+
+import logging
+import os
+import pickle
+import sqlite3
+import time
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+STATE_DB = os.environ.get("ECOG_STATE_DB", "data/state.sqlite3")
+
+# Ожидание блокировки базы другим процессом, секунд
+DB_TIMEOUT = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    file_id TEXT PRIMARY KEY,
+    fields BLOB NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def _connect(db_path=None):
+    db_path = db_path or STATE_DB
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    connection = sqlite3.connect(db_path, timeout=DB_TIMEOUT, isolation_level=None)
+    # WAL: чтение из одних процессов не блокируется записью из других
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(_SCHEMA)
+    return connection
+
+
+def save_recording(file_id, info):
+    """
+    Сохраняет (или заменяет) запись в хранилище.
+
+    Параметры:
+        file_id (str): Идентификатор файла.
+        info (dict): Поля записи.
+
+    Возвращает:
+        bool: True при успешной записи, False иначе.
+    """
+    try:
+        with closing(_connect()) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO recordings (file_id, fields, updated_at) VALUES (?, ?, ?)",
+                (file_id, pickle.dumps(dict(info)), time.time()))
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении записи {file_id} в хранилище: {e}")
+        return False
+
+
+def load_recording(file_id):
+    """
+    Загружает запись из хранилища.
+
+    Возвращает:
+        dict: Поля записи или None, если записи нет.
+    """
+    try:
+        with closing(_connect()) as connection:
+            row = connection.execute("SELECT fields FROM recordings WHERE file_id = ?", (file_id,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+    except Exception as e:
+        logger.error(f"Ошибка при чтении записи {file_id} из хранилища: {e}")
+        return None
+
+
+def update_recording(file_id, **fields):
+    """
+    Обновляет отдельные поля записи в одной транзакции.
+
+    Возвращает:
+        bool: True, если запись найдена и обновлена, False иначе.
+    """
+    try:
+        with closing(_connect()) as connection:
+            # IMMEDIATE: параллельное обновление той же записи другим процессом ждёт этой транзакции
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT fields FROM recordings WHERE file_id = ?", (file_id,)).fetchone()
+            if row is None:
+                connection.execute("ROLLBACK")
+                return False
+            info = pickle.loads(row[0])
+            info.update(fields)
+            connection.execute("UPDATE recordings SET fields = ?, updated_at = ? WHERE file_id = ?",
+                               (pickle.dumps(info), time.time(), file_id))
+            connection.execute("COMMIT")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении записи {file_id} в хранилище: {e}")
+        return False
+
+
+def count_recordings():
+    """
+    Количество записей в хранилище (0 при ошибке чтения).
+    """
+    try:
+        with closing(_connect()) as connection:
+            return connection.execute("SELECT COUNT(*) FROM recordings").fetchone()[0]
+    except Exception as e:
+        logger.error(f"Ошибка при чтении хранилища записей: {e}")
+        return 0
@@ -0,0 +1,115 @@
+# stream_replay.py
+#
+# Проверка разметки в реальном времени: EDF-файл передаётся в /stream блоками
+# с темпом записи (или быстрее), полученные события печатаются с задержками:
+#   detection - сколько сигнала прошло от времени события до его выдачи (stream_time - time);
+#   processing - сколько прошло от отправки блока до получения события, сек.
+#
+# Запуск из директории backend/server при работающем сервере:
+#     python stream_replay.py data/uploads/rat1.edf --speed 1
+#     python stream_replay.py data/uploads/rat1.edf --speed 0 --json events.json
+
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+import websockets
+from data_processing import load_edf
+
+
+async def replay(edf_path, url, speed=1.0, block_seconds=0.25, max_seconds=None):
+    """
+    Передаёт запись в поток разметки и собирает события.
+
+    Параметры:
+        edf_path (str): Путь к EDF-файлу.
+        url (str): Адрес эндпоинта, например ws://localhost:8000/stream.
+        speed (float): Темп относительно реального времени (0 - без пауз).
+        block_seconds (float): Длительность блока, сек.
+        max_seconds (float): Передать только начало записи, сек.
+
+    Возвращает:
+        list: События с полями 'processing_latency' и 'detection_delay'.
+    """
+    signals, signal_labels, _, signal_headers = load_edf(edf_path)
+    if signals is None:
+        return []
+    fs = int(signal_headers[0].get('sample_frequency') or signal_headers[0].get('sample_rate'))
+    if max_seconds:
+        signals = signals[:, :int(max_seconds * fs)]
+    block_size = max(1, int(block_seconds * fs))
+    sent_at = {}
+    events = []
+
+    async with websockets.connect(url, max_size=None) as websocket:
+        await websocket.send(json.dumps({
+            'sfreq': fs,
+            'channels': signal_labels,
+            'dimensions': [header.get('dimension', '') for header in signal_headers],
+        }))
+        ready = json.loads(await websocket.recv())
+        print(f"Поток открыт: {ready}")
+
+        async def send():
+            started = time.perf_counter()
+            for start in range(0, signals.shape[1], block_size):
+                block = np.ascontiguousarray(signals[:, start:start + block_size], dtype='<f4')
+                if speed:
+                    # Темп записи: блок отправляется, когда он "записан"
+                    delay = started + (start + block.shape[1]) / fs / speed - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                sent_at[round((start + block.shape[1]) / fs, 6)] = time.perf_counter()
+                await websocket.send(block.tobytes())
+            await websocket.send(json.dumps({'type': 'end'}))
+
+        async def receive():
+            async for message in websocket:
+                event = json.loads(message)
+                if event['type'] == 'end':
+                    return
+                received = time.perf_counter()
+                event['processing_latency'] = received - sent_at.get(round(event['stream_time'], 6), received)
+                event['detection_delay'] = event['stream_time'] - event['time']
+                events.append(event)
+                print(f"{event['type'].upper():>3} {event['event']:<5} {event['time']:10.2f} с "
+                      f"(выдано на {event['stream_time']:.2f} с, обработка {event['processing_latency'] * 1000:.0f} мс)")
+
+        await asyncio.gather(send(), receive())
+    return events
+
+
+def summarize(events):
+    """
+    Печатает число событий и наибольшие задержки по типам.
+    """
+    for kind in ('is', 'swd', 'ds'):
+        kind_events = [event for event in events if event['type'] == kind]
+        if not kind_events:
+            continue
+        starts = [event['detection_delay'] for event in kind_events if event['event'] == 'start']
+        print(f"{kind.upper()}: событий {len(kind_events)}, "
+              f"задержка начала до {max(starts, default=0):.2f} с, "
+              f"обработка до {max(event['processing_latency'] for event in kind_events) * 1000:.0f} мс")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Воспроизведение EDF-файла через поток разметки /stream")
+    parser.add_argument("edf", help="EDF-файл")
+    parser.add_argument("--url", default="ws://localhost:8000/stream", help="Адрес эндпоинта /stream")
+    parser.add_argument("--speed", type=float, default=1.0, help="Темп относительно реального времени (0 - без пауз)")
+    parser.add_argument("--block", type=float, default=0.25, help="Длительность блока, сек.")
+    parser.add_argument("--seconds", type=float, default=None, help="Передать только начало записи, сек.")
+    parser.add_argument("--json", default=None, help="Сохранить события в JSON-файл")
+    args = parser.parse_args(argv)
+
+    events = asyncio.run(replay(args.edf, args.url, args.speed, args.block, args.seconds))
+    summarize(events)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(events, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# streaming.py
+#
+# Разметка записи в реальном времени: сигналы поступают блоками произвольной длины,
+# состояние фильтров, окно признаков IS и серии секунд детекторов SWD/DS хранятся
+# между блоками, события начала и конца IS/SWD/DS выдаются, как только они определены.
+#
+# Задержки относительно поступления сигнала:
+#   IS  - окно признаков (WINDOW_SECONDS) и время предсказания;
+#   SWD - текущая секунда, половина длины FIR-фильтра (~0.8 с), STREAM_SWD_LOOKAHEAD для огибающей
+#         и min_duration для начала серии;
+#   DS  - текущая секунда и min_duration для начала серии.
+# Признаки IS совпадают с обработкой файла (OnlineFeatureExtractor).
+# SWD использует тот же FIR-фильтр, что mne.filter.filter_data, с компенсацией задержки,
+# огибающая считается по отрезку с контекстом вокруг секунды. DS сглаживается причинным
+# фильтром вместо filtfilt, поэтому границы серий DS могут отличаться от обработки файла.
+
+import mne
+import numpy as np
+from scipy.signal import butter, find_peaks, hilbert
+from data_processing import IS_CHANNELS, OnlineFilter, OnlineFeatureExtractor
+from swd_detection import SWD_CHANNELS, SWD_FREQ_LOW, SWD_FREQ_HIGH, SWD_PARAMS
+from ds_detection import DS_CUTOFF, DS_ORDER, DS_CHANNELS, DS_PARAMS
+from edf_utils import UNIT_SCALES
+
+# Полоса фильтра признаков IS (как при обработке загруженного файла)
+IS_LOWCUT = 0.5
+IS_HIGHCUT = 100
+IS_ORDER = 5
+
+# Контекст огибающей SWD до и после обрабатываемой секунды, сек.
+STREAM_SWD_CONTEXT = 1.0
+STREAM_SWD_LOOKAHEAD = 0.5
+
+
+class StreamingAnnotator:
+    """
+    Состояние разметки одного потока.
+
+    Параметры:
+        sfreq (float): Частота дискретизации.
+        ch_names (list): Имена каналов.
+        predict_fn (callable): Модель: X (n_windows, n_features, 1) -> вероятности классов.
+        dimensions (list): Физические единицы каналов ('uV', 'mV', ...) для перевода в вольты.
+        swd_params (dict): Параметры SWD (см. SWD_PARAMS).
+        ds_params (dict): Параметры DS (см. DS_PARAMS).
+    """
+
+    def __init__(self, sfreq, ch_names, predict_fn, dimensions=None, swd_params=None, ds_params=None):
+        self.fs = int(sfreq)
+        self.ch_names = list(ch_names)
+        self.predict_fn = predict_fn
+        n_channels = len(self.ch_names)
+        dimensions = dimensions or ['V'] * n_channels
+        self.scales = np.array([UNIT_SCALES.get(d.strip(), 1.0) for d in dimensions])[:, np.newaxis]
+        self.swd_params = dict(SWD_PARAMS, **(swd_params or {}))
+        self.ds_params = dict(DS_PARAMS, **(ds_params or {}))
+        self.received = 0  # Отсчётов получено
+
+        # IS: признаки окон по мере их заполнения (первые IS_CHANNELS каналов)
+        self.is_channels = min(IS_CHANNELS, n_channels)
+        self.is_features = OnlineFeatureExtractor(self.is_channels, self.fs, IS_LOWCUT, IS_HIGHCUT, IS_ORDER)
+        self.is_open = False
+
+        # SWD: отфильтрованный сигнал в вольтах начиная с отсчёта swd_offset.
+        # FIR-фильтр mne с линейной фазой: выход запаздывает на половину длины фильтра
+        fir = mne.filter.create_filter(None, self.fs, SWD_FREQ_LOW, SWD_FREQ_HIGH, verbose=False)
+        swd_channels = min(SWD_CHANNELS, n_channels)
+        self.swd_filter = OnlineFilter(swd_channels, fir, np.array([1.0]))
+        self.swd_delay = (len(fir) - 1) // 2
+        self.swd_buffer = np.zeros((swd_channels, 0))
+        self.swd_offset = 0
+        self.swd_second = 0
+        # Серии активных секунд по каналам: [начало, последняя секунда, всплесков, достигла min_duration]
+        self.swd_runs = [None] * swd_channels
+        self.swd_open = False
+        self.swd_end = 0.0
+
+        # DS: сглаженный сигнал первых DS_CHANNELS каналов
+        nyq = 0.5 * self.fs
+        ds_channels = min(DS_CHANNELS, n_channels)
+        # В вольты переводятся только каналы детекторов
+        self.scales = self.scales[:max(swd_channels, ds_channels)]
+        b, a = butter(DS_ORDER, DS_CUTOFF / nyq, btype='low')
+        self.ds_filter = OnlineFilter(ds_channels, b, a)
+        self.ds_buffer = np.zeros((ds_channels, 0))
+        self.ds_offset = 0
+        self.ds_second = 0
+        self.ds_run = None  # [начало, последняя секунда, событие начала выдано]
+
+    @property
+    def stream_time(self):
+        """Длительность полученного сигнала, сек."""
+        return self.received / self.fs
+
+    def _event(self, kind, event, time, **extra):
+        return dict({'type': kind, 'event': event, 'time': float(time), 'stream_time': self.stream_time}, **extra)
+
+    def push(self, block):
+        """
+        Обрабатывает очередной блок сигналов.
+
+        Параметры:
+            block (ndarray): Сигналы формы (n_channels, n_samples) в единицах dimensions.
+
+        Возвращает:
+            list: События {'type': 'is'|'swd'|'ds', 'event': 'start'|'end', 'time', 'stream_time'}.
+        """
+        block = np.asarray(block, dtype=np.float64)
+        self.received += block.shape[1]
+        events = self._push_is(block[:self.is_channels])
+        volts = block[:len(self.scales)] * self.scales
+        events += self._push_swd(volts[:self.swd_buffer.shape[0]])
+        events += self._push_ds(volts[:self.ds_buffer.shape[0]])
+        return sorted(events, key=lambda event: event['time'])
+
+    def close(self):
+        """
+        Завершает поток: закрывает незавершённые серии SWD/DS.
+
+        Возвращает:
+            list: События конца.
+        """
+        events = []
+        for ch, run in enumerate(self.swd_runs):
+            if run is not None:
+                events += self._end_swd_run(ch)
+        if self.ds_run is not None and self.ds_run[2]:
+            events.append(self._event('ds', 'end', self.ds_run[1]))
+        self.ds_run = None
+        return events
+
+    def _push_is(self, block):
+        X, positions = self.is_features.push(block)
+        if not len(X):
+            return []
+        probabilities = self.predict_fn(X.reshape((X.shape[0], X.shape[1], 1)))
+        events = []
+        # is1 открывает интервал IS, is2 закрывает открытый (повторные is1 внутри интервала не учитываются,
+        # при обработке файла интервал начинается с is1, ближайшего к is2)
+        for pred, position in zip(np.argmax(probabilities, axis=1), positions):
+            if pred == 1 and not self.is_open:
+                self.is_open = True
+                events.append(self._event('is', 'start', position / self.fs))
+            elif pred == 2 and self.is_open:
+                self.is_open = False
+                events.append(self._event('is', 'end', (position + self.is_features.window_size) / self.fs))
+        return events
+
+    def _push_swd(self, volts):
+        filtered = self.swd_filter(volts)
+        # Первые swd_delay отсчётов выхода относятся к моментам до начала записи
+        if self.swd_delay:
+            skip = min(self.swd_delay, filtered.shape[1])
+            filtered = filtered[:, skip:]
+            self.swd_delay -= skip
+        self.swd_buffer = np.concatenate([self.swd_buffer, filtered], axis=1)
+        fs = self.fs
+        context = int(STREAM_SWD_CONTEXT * fs)
+        lookahead = int(STREAM_SWD_LOOKAHEAD * fs)
+        threshold = self.swd_params['amplitude_threshold']
+        min_spikes = self.swd_params['min_spikes_per_second']
+        events = []
+        while (self.swd_second + 1) * fs + lookahead <= self.swd_offset + self.swd_buffer.shape[1]:
+            second_start = self.swd_second * fs
+            # Огибающая по отрезку с контекстом, берётся только текущая секунда
+            segment_start = max(second_start - context, self.swd_offset)
+            segment = self.swd_buffer[:, segment_start - self.swd_offset:second_start + fs + lookahead - self.swd_offset]
+            envelope = np.abs(hilbert(segment, axis=1))[:, second_start - segment_start:second_start - segment_start + fs]
+            counts = np.count_nonzero(envelope > threshold, axis=1)
+            for ch, count in enumerate(counts):
+                if count > min_spikes:
+                    events += self._extend_swd_run(ch, int(count))
+                elif self.swd_runs[ch] is not None:
+                    events += self._end_swd_run(ch)
+            self.swd_second += 1
+        drop = self.swd_second * fs - context - self.swd_offset
+        if drop > 0:
+            self.swd_buffer = self.swd_buffer[:, drop:]
+            self.swd_offset += drop
+        return events
+
+    def _extend_swd_run(self, ch, count):
+        run = self.swd_runs[ch]
+        if run is None:
+            run = self.swd_runs[ch] = [self.swd_second, self.swd_second, 0, False]
+        run[1] = self.swd_second
+        run[2] += count
+        # Серия засчитывается, когда её длительность превышает min_duration (как в _group_swd_intervals)
+        end_second = run[1] + (self.fs - 1) / self.fs
+        if not run[3] and end_second - run[0] > self.swd_params['min_duration']:
+            run[3] = True
+            if not self.swd_open:
+                self.swd_open = True
+                return [self._event('swd', 'start', run[0], channel=self.ch_names[ch])]
+        return []
+
+    def _end_swd_run(self, ch):
+        run = self.swd_runs[ch]
+        self.swd_runs[ch] = None
+        if not run[3]:
+            return []
+        self.swd_end = max(self.swd_end, run[1] + (self.fs - 1) / self.fs)
+        # SWD продолжается, пока засчитанная серия есть хотя бы на одном канале
+        if any(other is not None and other[3] for other in self.swd_runs):
+            return []
+        self.swd_open = False
+        return [self._event('swd', 'end', self.swd_end, total_spikes=run[2])]
+
+    def _push_ds(self, volts):
+        self.ds_buffer = np.concatenate([self.ds_buffer, self.ds_filter(volts)], axis=1)
+        fs = self.fs
+        params = self.ds_params
+        events = []
+        while (self.ds_second + 1) * fs <= self.ds_offset + self.ds_buffer.shape[1]:
+            start = self.ds_second * fs - self.ds_offset
+            match = True
+            for segment in self.ds_buffer[:, start:start + fs]:
+                peaks, _ = find_peaks(segment)
+                heights = segment[peaks]
+                count = np.count_nonzero(heights >= params['lower_amplitude_threshold'])
+                if not (params['min_peaks_per_sec'] <= count <= params['max_peaks_per_sec']) \
+                        or np.any(heights > params['upper_amplitude_threshold']):
+                    match = False
+                    break
+            if match:
+                if self.ds_run is None:
+                    self.ds_run = [self.ds_second, self.ds_second, False]
+                self.ds_run[1] = self.ds_second
+                if not self.ds_run[2] and self.ds_run[1] - self.ds_run[0] + 1 >= params['min_duration']:
+                    self.ds_run[2] = True
+                    events.append(self._event('ds', 'start', self.ds_run[0]))
+            elif self.ds_run is not None:
+                if self.ds_run[2]:
+                    events.append(self._event('ds', 'end', self.ds_run[1]))
+                self.ds_run = None
+            self.ds_second += 1
+        drop = self.ds_second * fs - self.ds_offset
+        if drop > 0:
+            self.ds_buffer = self.ds_buffer[:, drop:]
+            self.ds_offset += drop
+        return events
@@ -1,103 +1,354 @@
 # swd_detection.py
 
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
 import mne
 import numpy as np
+from scipy.fft import next_fast_len
 from scipy.signal import hilbert
 from annotation_utils import seconds_to_hms
+from resampling import resample
 
-def detect_swd(file_path):
+# Полоса фильтра перед огибающей, Гц
+SWD_FREQ_LOW = 7
+SWD_FREQ_HIGH = 20
+# Каналов (первых в записи), по которым ищутся SWD
+SWD_CHANNELS = 3
+# Частота, к которой передискретизируется запись перед детекцией, Гц:
+# min_spikes_per_second - количество отсчётов огибающей выше порога за секунду при этой частоте
+SWD_RATE = 400
+
+# Параметры поиска по умолчанию
+SWD_PARAMS = {
+    'amplitude_threshold': 0.5e-3,  # Порог амплитуды (в мВ)
+    'min_spikes_per_second': 7,  # Минимальное количество всплесков в секунду
+    'min_duration': 2,  # Минимальная длительность интервала в секундах
+}
+
+# Сколько наибольших значений огибающей каждой секунды хранится в таблице пиков
+SWD_TABLE_DEPTH = 32
+# Секунд записи, обрабатываемых за раз при построении таблицы
+TABLE_BLOCK_SECONDS = 3600
+
+# Огибающая считается блоками: длина блока и перекрытие с соседними с каждой стороны, отсчётов.
+# Перекрытие (~20 с при 400 Гц) убирает краевые эффекты преобразования Гильберта в блоке
+ENVELOPE_BLOCK_SIZE = 1 << 18
+ENVELOPE_OVERLAP = 8192
+# Потоков для блоков огибающей (scipy.fft отпускает GIL)
+ENVELOPE_THREADS = int(os.environ.get("ECOG_ENVELOPE_THREADS", 0)) or os.cpu_count() or 1
+
+# Параметры, от которых зависят промежуточные данные (ключ кэша)
+SWD_PRODUCT_PARAMS = {'freq_low': SWD_FREQ_LOW, 'freq_high': SWD_FREQ_HIGH, 'depth': SWD_TABLE_DEPTH,
+                      'rate': SWD_RATE, 'channels': SWD_CHANNELS}
+
+
+def detect_swd(file_path, **params):
     """
     Обнаруживает интервалы SWD в EDF-файле.
 
     Параметры:
         file_path (str): Путь к EDF-файлу.
+        **params: Параметры поиска (см. SWD_PARAMS).
 
     Возвращает:
         grouped_intervals_filtered (list): Список обнаруженных SWD интервалов.
     """
-    # Параметры поиска
-    freq_low = 7
-    freq_high = 20
-    amplitude_threshold = 0.5e-3  # Порог амплитуды (в мВ)
-    min_spikes_per_second = 7  # Минимальное количество всплесков в секунду
-    min_duration = 2  # Минимальная длительность интервала в секундах
-
+    products = swd_products_from_file(file_path)
+    if products is None:
+        return []
     try:
-        # Чтение данных из EDF файла
-        raw = mne.io.read_raw_edf(file_path, preload=True, verbose=False)
-        sfreq = raw.info['sfreq']
-        data, times = raw[:, :]  # Получение всех данных
-
-        # Фильтрация данных
-        filtered_data = mne.filter.filter_data(data, sfreq, freq_low, freq_high, verbose=False)
-
-        # Вычисление огибающей сигнала
-        analytic_signal = hilbert(filtered_data)
-        amplitude_envelope = np.abs(analytic_signal)
-
-        detected_intervals = []
-        samples_per_second = int(sfreq)  # Количество отсчетов за секунду
-
-        for ch in range(data.shape[0]):
-            for start in range(0, amplitude_envelope.shape[1] - samples_per_second + 1, samples_per_second):
-                end = start + samples_per_second
-                # Поиск всплесков в текущей секунде
-                spikes = np.where(amplitude_envelope[ch, start:end] > amplitude_threshold)[0]
-                num_spikes = len(spikes)
-
-                # Проверка количества всплесков
-                if num_spikes > min_spikes_per_second:
-                    detected_intervals.append({
-                        'channel': raw.ch_names[ch],
-                        'start_time': times[start],
-                        'end_time': times[end - 1],
-                        'num_spikes': num_spikes
-                    })
-
-        # Группировка последовательных интервалов
-        grouped_intervals = []
-        current_group = []
-
-        for interval in detected_intervals:
-            if not current_group:
-                current_group.append(interval)
-            else:
-                # Проверка, что текущий интервал следует непосредственно за предыдущим
-                if (interval['start_time'] - current_group[-1]['end_time']) <= 1:
-                    current_group.append(interval)
-                else:
-                    # Сохранение текущей группы
-                    grouped_intervals.append({
-                        'channel': current_group[0]['channel'],
-                        'start_time': seconds_to_hms(current_group[0]['start_time']),
-                        'end_time': seconds_to_hms(current_group[-1]['end_time']),
-                        'start_second': current_group[0]['start_time'],  # Добавляем числовое время начала
-                        'end_second': current_group[-1]['end_time'],    # Добавляем числовое время конца
-                        'total_spikes': sum([item['num_spikes'] for item in current_group])
-                    })
-                    # Начало новой группы
-                    current_group = [interval]
-
-        # Добавление последней группы
-        if current_group:
-            grouped_intervals.append({
-                'channel': current_group[0]['channel'],
-                'start_time': seconds_to_hms(current_group[0]['start_time']),
-                'end_time': seconds_to_hms(current_group[-1]['end_time']),
-                'start_second': current_group[0]['start_time'],  # Добавляем числовое время начала
-                'end_second': current_group[-1]['end_time'],    # Добавляем числовое время конца
-                'total_spikes': sum([item['num_spikes'] for item in current_group])
-            })
-
-        # Фильтрация интервалов по минимальной длительности
-        grouped_intervals_filtered = [
-            group for group in grouped_intervals
-            if (group['end_second'] - group['start_second']) > min_duration
-        ]
+        return detect_swd_from_products(products, verbose=True, **params)
+    except Exception as e:
+        print(f"Ошибка при обнаружении SWD интервалов: {e}")
+        return []
 
-        print(f"Найдено {len(grouped_intervals_filtered)} SWD интервалов.")
-        return grouped_intervals_filtered
+def detect_swd_in_data(data, sfreq, ch_names, **params):
+    """
+    Обнаруживает интервалы SWD в сигналах, уже загруженных в память.
 
+    Параметры:
+        data (ndarray): Сигналы формы (n_channels, n_samples) в вольтах.
+        sfreq (float): Частота дискретизации.
+        ch_names (list): Имена каналов.
+        **params: Параметры поиска (см. SWD_PARAMS).
+
+    Возвращает:
+        grouped_intervals_filtered (list): Список обнаруженных SWD интервалов.
+    """
+    products = swd_products(data, sfreq, ch_names)
+    if products is None:
+        return []
+    try:
+        return detect_swd_from_products(products, verbose=True, **params)
     except Exception as e:
         print(f"Ошибка при обнаружении SWD интервалов: {e}")
         return []
+
+def swd_products_from_file(file_path):
+    """
+    Читает EDF-файл и вычисляет промежуточные данные детектора SWD (см. swd_products).
+    """
+    try:
+        # Читаются только каналы детектора (без preload сигналы декодируются при get_data)
+        raw = mne.io.read_raw_edf(file_path, preload=False, verbose=False)
+        ch_names = raw.ch_names[:SWD_CHANNELS]
+        data = raw.get_data(picks=ch_names)
+    except Exception as e:
+        print(f"Ошибка при обнаружении SWD интервалов: {e}")
+        return None
+    return swd_products(data, raw.info['sfreq'], ch_names)
+
+def hilbert_envelope(data, block_size=ENVELOPE_BLOCK_SIZE, overlap=ENVELOPE_OVERLAP, threads=ENVELOPE_THREADS,
+                     start=0, stop=None):
+    """
+    Огибающая (модуль аналитического сигнала) по последней оси, вычисляемая блоками.
+
+    Каждый блок берётся с перекрытием overlap отсчётов с обеих сторон и дополняется нулями
+    до длины next_fast_len, поэтому время БПФ не зависит от разложения длины записи
+    на множители (простая длина не замедляет расчёт). Комплексный сигнал существует
+    только для блоков, обрабатываемых в данный момент; результат - float32.
+
+    start/stop ограничивают результат отрезком data, остальное служит контекстом перекрытия.
+    Границы блоков отсчитываются от start, поэтому часть записи, прочитанная с запасом
+    не меньше overlap и начинающаяся с границы блока всей записи, даёт ту же огибающую,
+    что и расчёт по всей записи.
+
+    Параметры:
+        data (ndarray): Сигналы формы (..., n_samples).
+        block_size (int): Длина блока, отсчётов.
+        overlap (int): Перекрытие с соседними блоками с каждой стороны, отсчётов.
+        threads (int): Количество потоков для блоков.
+        start (int): Первый отсчёт результата.
+        stop (int): Конец результата (по умолчанию - конец data).
+
+    Возвращает:
+        ndarray: Огибающая формы (..., stop - start), float32.
+    """
+    n_samples = data.shape[-1]
+    stop = n_samples if stop is None else stop
+    envelope = np.empty(data.shape[:-1] + (stop - start,), dtype=np.float32)
+
+    def process(block_start):
+        block_stop = min(block_start + block_size, stop)
+        first = max(block_start - overlap, 0)
+        last = min(block_stop + overlap, n_samples)
+        analytic_signal = hilbert(data[..., first:last], N=next_fast_len(last - first), axis=-1)
+        envelope[..., block_start - start:block_stop - start] = \
+            np.abs(analytic_signal[..., block_start - first:block_stop - first])
+
+    starts = range(start, stop, block_size)
+    if threads > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=min(threads, len(starts))) as pool:
+            list(pool.map(process, starts))
+    else:
+        for block_start in starts:
+            process(block_start)
+    return envelope
+
+def swd_envelope(data, sfreq, freq_low=SWD_FREQ_LOW, freq_high=SWD_FREQ_HIGH):
+    """
+    Огибающая сигнала в полосе freq_low-freq_high: FIR-фильтр mne и модуль аналитического сигнала
+    (hilbert_envelope).
+
+    Параметры:
+        data (ndarray): Сигналы формы (n_channels, n_samples) в вольтах.
+        sfreq (float): Частота дискретизации.
+        freq_low (float): Нижняя граница полосы, Гц.
+        freq_high (float): Верхняя граница полосы, Гц.
+
+    Возвращает:
+        ndarray: Огибающая той же формы, float32.
+    """
+    # Фильтрация данных
+    filtered_data = mne.filter.filter_data(data, sfreq, freq_low, freq_high, verbose=False)
+
+    # Вычисление огибающей сигнала
+    return hilbert_envelope(filtered_data)
+
+def swd_products(data, sfreq, ch_names, freq_low=SWD_FREQ_LOW, freq_high=SWD_FREQ_HIGH, depth=SWD_TABLE_DEPTH,
+                 rate=SWD_RATE, channels=SWD_CHANNELS):
+    """
+    Вычисляет промежуточные данные детектора SWD, не зависящие от параметров поиска:
+    огибающую сигнала в полосе freq_low-freq_high и таблицу пиков - по каждому каналу
+    и каждой секунде depth наибольших значений огибающей по убыванию.
+
+    Параметры:
+        data (ndarray): Сигналы формы (n_channels, n_samples) в вольтах.
+        sfreq (float): Частота дискретизации.
+        ch_names (list): Имена каналов.
+        freq_low (float): Нижняя граница полосы, Гц.
+        freq_high (float): Верхняя граница полосы, Гц.
+        depth (int): Глубина таблицы пиков.
+        rate (float): Частота детекции; запись с другой частотой передискретизируется.
+        channels (int): Количество первых каналов, по которым ищутся SWD.
+
+    Возвращает:
+        dict: 'envelope' (n_channels, n_samples), 'table' (n_channels, n_seconds, depth),
+            'sfreq' (частота детекции), 'ch_names' или None при ошибке.
+    """
+    try:
+        data, ch_names = data[:channels], ch_names[:channels]
+        data, sfreq = resample(data, sfreq, rate)
+        amplitude_envelope = swd_envelope(data, sfreq, freq_low, freq_high)
+        return {
+            'envelope': amplitude_envelope,
+            'table': swd_peak_table(amplitude_envelope, sfreq, depth),
+            'sfreq': float(sfreq),
+            'ch_names': list(ch_names),
+        }
+    except Exception as e:
+        print(f"Ошибка при обнаружении SWD интервалов: {e}")
+        return None
+
+def swd_peak_table(envelope, sfreq, depth=SWD_TABLE_DEPTH):
+    """
+    Таблица пиков: depth наибольших значений огибающей каждой секунды по убыванию.
+
+    Условие детектора "в секунде больше k отсчётов выше порога" равносильно
+    "(k+1)-е по величине значение секунды выше порога", поэтому для k < depth
+    решение принимается по таблице без обращения к огибающей.
+
+    Возвращает:
+        ndarray: Таблица формы (n_channels, n_seconds, depth).
+    """
+    samples_per_second = int(sfreq)  # Количество отсчетов за секунду
+    n_channels = envelope.shape[0]
+    n_seconds = envelope.shape[1] // samples_per_second
+    depth = min(depth, samples_per_second)
+    table = np.empty((n_channels, n_seconds, depth), dtype=envelope.dtype)
+    for ch in range(n_channels):
+        for first in range(0, n_seconds, TABLE_BLOCK_SECONDS):
+            last = min(first + TABLE_BLOCK_SECONDS, n_seconds)
+            seconds = envelope[ch, first * samples_per_second:last * samples_per_second].reshape(last - first, samples_per_second)
+            top = np.partition(seconds, samples_per_second - depth, axis=1)[:, samples_per_second - depth:]
+            table[ch, first:last] = np.sort(top, axis=1)[:, ::-1]
+    return table
+
+def _count_above(products, threshold, channels, seconds):
+    """
+    Количество отсчётов огибающей выше порога в заданных (канал, секунда).
+    Без огибающей (не сохранена) - оценка снизу по таблице пиков.
+    """
+    table = products['table']
+    envelope = products.get('envelope')
+    if envelope is None:
+        return np.count_nonzero(table[channels, seconds] > threshold, axis=1)
+    samples_per_second = int(products['sfreq'])
+    n_seconds = table.shape[1]
+    per_second = envelope[:, :n_seconds * samples_per_second].reshape(envelope.shape[0], n_seconds, samples_per_second)
+    counts = np.empty(len(channels), dtype=np.int64)
+    # Блоками, чтобы из огибающей на диске читались только нужные секунды
+    for i in range(0, len(channels), 4096):
+        counts[i:i + 4096] = np.count_nonzero(per_second[channels[i:i + 4096], seconds[i:i + 4096]] > threshold, axis=1)
+    return counts
+
+def detect_swd_from_products(products, amplitude_threshold=SWD_PARAMS['amplitude_threshold'],
+                             min_spikes_per_second=SWD_PARAMS['min_spikes_per_second'],
+                             min_duration=SWD_PARAMS['min_duration'], verbose=False):
+    """
+    Обнаруживает интервалы SWD по промежуточным данным (см. swd_products) с заданными параметрами.
+
+    Параметры:
+        products (dict): Результат swd_products или загруженный из кэша.
+        amplitude_threshold (float): Порог амплитуды огибающей, В.
+        min_spikes_per_second (float): В секунде должно быть больше стольких отсчётов выше порога.
+        min_duration (float): Минимальная длительность интервала в секундах.
+        verbose (bool): Печатать количество найденных интервалов.
+
+    Возвращает:
+        grouped_intervals_filtered (list): Список обнаруженных SWD интервалов.
+    """
+    table = products['table']
+    sfreq = products['sfreq']
+    ch_names = products['ch_names']
+    samples_per_second = int(sfreq)
+    n_channels, n_seconds, depth = table.shape
+
+    # Решение по секундам: больше min_spikes_per_second отсчётов выше порога
+    k = int(np.floor(min_spikes_per_second))
+    if k < 0:
+        active = np.ones((n_channels, n_seconds), dtype=bool)
+    elif k < depth:
+        active = table[:, :, k] > amplitude_threshold
+    else:
+        channels, seconds = np.nonzero(np.ones((n_channels, n_seconds), dtype=bool))
+        counts = _count_above(products, amplitude_threshold, channels, seconds)
+        active = (counts > min_spikes_per_second).reshape(n_channels, n_seconds)
+
+    # Секунды в порядке исходного перебора: по каналам, внутри канала по времени
+    channels, seconds = np.nonzero(active)
+    counts = _count_above(products, amplitude_threshold, channels, seconds) if len(channels) else []
+    starts = seconds * samples_per_second
+    detected_intervals = [
+        {
+            'channel': ch_names[ch],
+            'start_time': start / sfreq,
+            'end_time': (start + samples_per_second - 1) / sfreq,
+            'num_spikes': int(count)
+        }
+        for ch, start, count in zip(channels, starts, counts)
+    ]
+
+    grouped_intervals_filtered = _group_swd_intervals(detected_intervals, min_duration)
+    if verbose:
+        print(f"Найдено {len(grouped_intervals_filtered)} SWD интервалов.")
+    return grouped_intervals_filtered
+
+def _group_swd_intervals(detected_intervals, min_duration):
+    """
+    Группирует последовательные секунды в интервалы и отбрасывает короткие.
+    """
+    grouped_intervals = []
+    current_group = []
+
+    for interval in detected_intervals:
+        if not current_group:
+            current_group.append(interval)
+        else:
+            # Проверка, что текущий интервал следует непосредственно за предыдущим
+            if (interval['start_time'] - current_group[-1]['end_time']) <= 1:
+                current_group.append(interval)
+            else:
+                # Сохранение текущей группы
+                grouped_intervals.append(_swd_group(current_group))
+                # Начало новой группы
+                current_group = [interval]
+
+    # Добавление последней группы
+    if current_group:
+        grouped_intervals.append(_swd_group(current_group))
+
+    # Фильтрация интервалов по минимальной длительности
+    return [
+        group for group in grouped_intervals
+        if (group['end_second'] - group['start_second']) > min_duration
+    ]
+
+def _swd_group(current_group):
+    return {
+        'channel': current_group[0]['channel'],
+        'start_time': seconds_to_hms(current_group[0]['start_time']),
+        'end_time': seconds_to_hms(current_group[-1]['end_time']),
+        'start_second': current_group[0]['start_time'],  # Добавляем числовое время начала
+        'end_second': current_group[-1]['end_time'],    # Добавляем числовое время конца
+        'total_spikes': sum([item['num_spikes'] for item in current_group])
+    }
+
+def sweep_swd(products, grid):
+    """
+    Перебор сетки параметров SWD по одним и тем же промежуточным данным.
+
+    Параметры:
+        products (dict): Результат swd_products или загруженный из кэша.
+        grid (dict): Имя параметра -> список значений; отсутствующие берутся из SWD_PARAMS.
+
+    Возвращает:
+        list: Словари {'params': {...}, 'intervals': [...]} для каждой комбинации.
+    """
+    names = list(grid)
+    results = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = dict(SWD_PARAMS, **dict(zip(names, values)))
+        results.append({'params': params, 'intervals': detect_swd_from_products(products, **params)})
+    return results
@@ -0,0 +1,273 @@
+# uploads.py
+#
+# Приём EDF-файлов: запись на диск частями в отдельном потоке (цикл событий не блокируется),
+# SHA-256 считается по ходу записи, у каждого файла уникальное имя.
+# Возобновляемая загрузка: клиент создаёт сессию, отправляет файл частями по смещениям
+# и после обрыва связи продолжает с последнего принятого байта.
+# Состояние сессии хранится на диске, поэтому части могут приходить в разные процессы uvicorn.
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from contextlib import asynccontextmanager
+from feature_cache import file_sha256
+
+try:
+    import fcntl
+except ImportError:  # Windows: сервер запускается одним процессом, межпроцессная блокировка не нужна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Размер части, который сервер предлагает клиенту, и размер блока записи на диск
+UPLOAD_CHUNK_SIZE = int(os.environ.get("ECOG_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+# Незавершённые сессии старше этого срока удаляются, секунд
+UPLOAD_SESSION_TTL = 24 * 3600
+
+SESSIONS_SUBDIR = "sessions"
+
+# SHA-256 принятых этим процессом частей: upload_id -> (состояние хэша, число захэшированных байт).
+# Если часть сессии принял другой процесс, хэш считается один раз при завершении загрузки.
+_digests = {}
+# Блокировки сессий внутри процесса (между процессами - flock)
+_locks = {}
+
+
+def upload_file_id(filename):
+    """
+    Уникальный идентификатор загружаемого файла: <uuid>_<имя без пути и спецсимволов>.
+    Он же имя файла в директории загрузок, поэтому одинаковые имена у разных пользователей не конфликтуют.
+    """
+    name = re.sub(r"[^\w.\- ]", "_", os.path.basename(filename or "")) or "recording.edf"
+    return f"{uuid.uuid4()}_{name}"
+
+
+def _write_block(f, digest, data):
+    # Выполняется в потоке: hashlib и запись в файл отпускают GIL на больших блоках
+    f.write(data)
+    if digest is not None:
+        digest.update(data)
+
+
+async def save_upload(file, file_location):
+    """
+    Сохраняет файл из multipart-запроса, считая SHA-256 по ходу записи.
+
+    Параметры:
+        file (UploadFile): Загруженный файл.
+        file_location (str): Путь для сохранения.
+
+    Возвращает:
+        file_location (str): Путь к сохранённому файлу или None в случае ошибки.
+        content_hash (str): SHA-256 содержимого или None.
+    """
+    digest = hashlib.sha256()
+    try:
+        f = await asyncio.to_thread(open, file_location, "wb")
+        try:
+            while True:
+                data = await file.read(UPLOAD_CHUNK_SIZE)
+                if not data:
+                    break
+                await asyncio.to_thread(_write_block, f, digest, data)
+        finally:
+            await asyncio.to_thread(f.close)
+        logger.info(f"Файл сохранён в: {file_location}")
+        return file_location, digest.hexdigest()
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении файла {file.filename}: {e}")
+        return None, None
+
+
+def _session_path(upload_dir, upload_id):
+    return os.path.join(upload_dir, SESSIONS_SUBDIR, f"{upload_id}.json")
+
+
+def _save_session(session):
+    state = {name: session[name] for name in ("upload_id", "file_id", "filename", "size", "received", "updated_at")}
+    path = _session_path(session["upload_dir"], session["upload_id"])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def cleanup_sessions(upload_dir, ttl=UPLOAD_SESSION_TTL):
+    """
+    Удаляет незавершённые сессии загрузки (и их части файлов), не обновлявшиеся дольше ttl секунд.
+    """
+    sessions_dir = os.path.join(upload_dir, SESSIONS_SUBDIR)
+    if not os.path.isdir(sessions_dir):
+        return
+    now = time.time()
+    for name in os.listdir(sessions_dir):
+        path = os.path.join(sessions_dir, name)
+        if not name.endswith(".json") or now - os.path.getmtime(path) < ttl:
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            part_path = os.path.join(upload_dir, f"{state['file_id']}.part")
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            os.remove(path)
+            if os.path.exists(f"{path}.lock"):
+                os.remove(f"{path}.lock")
+            _digests.pop(state["upload_id"], None)
+            _locks.pop(state["upload_id"], None)
+            logger.info(f"Удалена устаревшая сессия загрузки {state['upload_id']}")
+        except Exception as e:
+            logger.error(f"Ошибка при удалении сессии загрузки {path}: {e}")
+
+
+def create_session(upload_dir, filename, size):
+    """
+    Открывает сессию возобновляемой загрузки.
+
+    Параметры:
+        upload_dir (str): Директория загрузок.
+        filename (str): Исходное имя файла.
+        size (int): Полный размер файла в байтах.
+
+    Возвращает:
+        dict: Состояние сессии.
+    """
+    cleanup_sessions(upload_dir)
+    os.makedirs(os.path.join(upload_dir, SESSIONS_SUBDIR), exist_ok=True)
+    file_id = upload_file_id(filename)
+    session = {
+        "upload_id": uuid.uuid4().hex,
+        "file_id": file_id,
+        "filename": filename,
+        "size": int(size),
+        "received": 0,
+        "updated_at": time.time(),
+        "upload_dir": upload_dir,
+        "part_path": os.path.join(upload_dir, f"{file_id}.part"),
+    }
+    open(session["part_path"], "wb").close()
+    _save_session(session)
+    _digests[session["upload_id"]] = (hashlib.sha256(), 0)
+    logger.info(f"Открыта сессия загрузки {session['upload_id']} для файла {filename} ({size} байт)")
+    return session
+
+
+def _valid_upload_id(upload_id):
+    return re.fullmatch(r"[0-9a-f]{32}", upload_id or "") is not None
+
+
+def get_session(upload_dir, upload_id):
+    """
+    Читает состояние сессии загрузки с диска (сессию мог открыть и дополнить любой процесс).
+
+    Возвращает:
+        dict: Состояние сессии или None, если сессии нет.
+    """
+    path = _session_path(upload_dir, upload_id)
+    if not _valid_upload_id(upload_id) or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        part_path = os.path.join(upload_dir, f"{state['file_id']}.part")
+        state["received"] = min(state["received"], os.path.getsize(part_path))
+        return dict(state, upload_dir=upload_dir, part_path=part_path)
+    except Exception as e:
+        logger.error(f"Ошибка при чтении сессии загрузки {upload_id}: {e}")
+        return None
+
+
+@asynccontextmanager
+async def locked_session(upload_dir, upload_id):
+    """
+    Монопольный доступ к сессии загрузки среди корутин процесса и процессов сервера.
+    Возвращает актуальное состояние сессии (или None, если сессии нет).
+    """
+    session_path = _session_path(upload_dir, upload_id)
+    if not _valid_upload_id(upload_id) or not os.path.exists(session_path):
+        yield None
+        return
+    async with _locks.setdefault(upload_id, asyncio.Lock()):
+        lock_file = None
+        if fcntl is not None:
+            lock_file = open(f"{session_path}.lock", "a")
+            await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+        try:
+            yield get_session(upload_dir, upload_id)
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+
+async def append_chunk(session, stream):
+    """
+    Дописывает тело запроса в конец принятой части файла по мере поступления данных.
+    При обрыве соединения принятое до обрыва сохраняется, клиент продолжает с session['received'].
+    Вызывается внутри locked_session.
+
+    Параметры:
+        session (dict): Сессия загрузки.
+        stream: Асинхронный итератор блоков тела запроса (Request.stream()).
+
+    Возвращает:
+        int: Количество принятых байт файла.
+    """
+    digest, hashed = _digests.get(session["upload_id"], (None, 0))
+    if hashed != session["received"]:
+        digest = None
+    f = await asyncio.to_thread(open, session["part_path"], "r+b")
+    try:
+        await asyncio.to_thread(f.truncate, session["received"])
+        await asyncio.to_thread(f.seek, session["received"])
+        pending = []
+        pending_size = 0
+        async for data in stream:
+            if session["received"] + pending_size + len(data) > session["size"]:
+                raise ValueError("Размер данных превышает объявленный размер файла")
+            pending.append(data)
+            pending_size += len(data)
+            # Мелкие блоки тела запроса собираются, чтобы не переключаться в поток на каждый
+            if pending_size >= UPLOAD_CHUNK_SIZE:
+                await asyncio.to_thread(_write_block, f, digest, b"".join(pending))
+                session["received"] += pending_size
+                pending, pending_size = [], 0
+        if pending:
+            await asyncio.to_thread(_write_block, f, digest, b"".join(pending))
+            session["received"] += pending_size
+    finally:
+        await asyncio.to_thread(f.close)
+        session["updated_at"] = time.time()
+        await asyncio.to_thread(_save_session, session)
+        _digests[session["upload_id"]] = (digest, session["received"])
+    return session["received"]
+
+
+async def complete_session(session):
+    """
+    Завершает загрузку: принятая часть переименовывается в итоговый файл без копирования.
+    Вызывается внутри locked_session.
+
+    Возвращает:
+        file_location (str): Путь к файлу.
+        content_hash (str): SHA-256 содержимого.
+    """
+    digest, hashed = _digests.pop(session["upload_id"], (None, 0))
+    if digest is not None and hashed == session["size"]:
+        content_hash = digest.hexdigest()
+    else:
+        content_hash = await asyncio.to_thread(file_sha256, session["part_path"])
+    file_location = os.path.join(session["upload_dir"], session["file_id"])
+    await asyncio.to_thread(os.replace, session["part_path"], file_location)
+    session_path = _session_path(session["upload_dir"], session["upload_id"])
+    await asyncio.to_thread(os.remove, session_path)
+    if os.path.exists(f"{session_path}.lock"):
+        os.remove(f"{session_path}.lock")
+    _locks.pop(session["upload_id"], None)
+    logger.info(f"Загрузка {session['upload_id']} завершена, файл сохранён в: {file_location}")
+    return file_location, content_hash
@@ -0,0 +1,56 @@
+# conftest.py
+#
+# Тесты запускаются из корня репозитория: python -m pytest backend/tests
+# Модули сервера импортируются как есть (swd_detection), модули приложения - из пакета model
+# (model.sharded), генератор синтетических записей - из backend/benchmarks.
+# Реальные записи для сравнения берутся из ECOG_REFERENCE_RECORDINGS (директория с EDF-файлами).
+
+import glob
+import os
+import sys
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("server", "app", "benchmarks"):
+    path = os.path.join(BACKEND_DIR, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from synthetic_edf import generate_edf
+
+# Синтетические записи (часы, зерно): запись 1 ч. с зерном 0 - та, на которой прореживание DS теряло 7 с интервала
+SYNTHETIC_RECORDINGS = [(1.0, 0), (0.5, 1)]
+REFERENCE_DIR = os.environ.get("ECOG_REFERENCE_RECORDINGS", "")
+
+
+def reference_recordings():
+    """
+    Реальные EDF-файлы из ECOG_REFERENCE_RECORDINGS (пустой список, если переменная не задана).
+    """
+    return sorted(glob.glob(os.path.join(REFERENCE_DIR, "*.edf"))) if REFERENCE_DIR else []
+
+
+@pytest.fixture(scope="session")
+def synthetic_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp("synthetic")
+
+
+def synthetic_recording(directory, hours, seed):
+    """
+    Синтетическая запись в directory; создаётся один раз за сессию.
+    """
+    path = os.path.join(str(directory), f"synthetic_{hours:g}h_{seed}.edf")
+    if not os.path.exists(path):
+        generate_edf(path, hours=hours, seed=seed)
+    return path
+
+
+@pytest.fixture(scope="session", params=SYNTHETIC_RECORDINGS + reference_recordings(),
+                ids=lambda param: f"synthetic_{param[0]:g}h_{param[1]}" if isinstance(param, tuple) else os.path.basename(param))
+def recording(request, synthetic_dir):
+    """
+    Путь к EDF-файлу: синтетические записи и реальные записи из ECOG_REFERENCE_RECORDINGS.
+    """
+    if isinstance(request.param, tuple):
+        return synthetic_recording(synthetic_dir, *request.param)
+    return request.param
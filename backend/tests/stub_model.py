@@ -0,0 +1,28 @@
+# stub_model.py
+#
+# Модель IS для тестов вместо cnn_classifier.h5: детерминированная и гладкая функция признаков,
+# поэтому различия признаков на уровне погрешности округления не меняют предсказанный класс.
+# Сохраняется joblib и загружается процессами-обработчиками (model_utils.load_model_file).
+
+import numpy as np
+
+
+class BandPowerModel:
+    """
+    Вероятности классов - softmax от относительных мощностей дельта- и тета-диапазонов окна
+    (последние 6 признаков): класс 1 - преобладает дельта, класс 2 - тета, класс 0 - ни то, ни другое.
+    """
+
+    def __init__(self, delta_threshold=0.5, theta_threshold=0.25, scale=10.0):
+        self.delta_threshold = delta_threshold
+        self.theta_threshold = theta_threshold
+        self.scale = scale
+
+    def predict(self, X, verbose=0, batch_size=None):
+        features = np.asarray(X).reshape(len(X), -1)
+        delta = features[:, -6:-3].mean(axis=1)
+        theta = features[:, -3:].mean(axis=1)
+        logits = self.scale * np.stack([np.zeros(len(features)), delta - self.delta_threshold,
+                                        theta - self.theta_threshold], axis=1)
+        probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
@@ -0,0 +1,48 @@
+# test_batch.py
+#
+# Пакетная аннотация (model.batch): одноимённые файлы из разных поддиректорий, найденные
+# рекурсивным шаблоном, сохраняются в разные файлы с той же структурой поддиректорий.
+
+import os
+import shutil
+import pytest
+
+pytest.importorskip("tensorflow")  # model.batch импортирует model.main и model_utils
+
+import joblib
+from conftest import synthetic_recording
+from model.batch import collect_files, common_root, output_path_for, run_batch
+from stub_model import BandPowerModel
+
+
+def test_output_paths_keep_subdirectories(tmp_path):
+    files = [str(tmp_path / "in" / "a" / "rec.edf"), str(tmp_path / "in" / "b" / "rec.edf")]
+    root = common_root(files)
+    outputs = [output_path_for(f, str(tmp_path / "out"), root) for f in files]
+    assert outputs == [str(tmp_path / "out" / "a" / "rec_annotated.edf"),
+                       str(tmp_path / "out" / "b" / "rec_annotated.edf")]
+    # Файлы одной директории, как и раньше, кладутся прямо в директорию результатов
+    assert output_path_for(files[0], str(tmp_path / "out"), common_root(files[:1])) == \
+        str(tmp_path / "out" / "rec_annotated.edf")
+
+
+def test_run_batch_duplicate_basenames(synthetic_dir, tmp_path):
+    source = synthetic_recording(synthetic_dir, 0.5, 1)
+    input_dir = tmp_path / "in"
+    for subdirectory in ("a", "b"):
+        os.makedirs(input_dir / subdirectory)
+        shutil.copy(source, input_dir / subdirectory / "rec.edf")
+    model_path = str(tmp_path / "stub_model.joblib")
+    joblib.dump(BandPowerModel(), model_path)
+
+    pattern = str(input_dir / "**" / "*.edf")
+    assert len(collect_files(pattern)) == 2
+    manifest = run_batch(pattern, str(tmp_path / "out"), workers=2, model_path=model_path,
+                         feature_cache_dir=None, detector_cache_dir=None)
+
+    entries = manifest["files"]
+    assert len(entries) == 2 and all(entry["status"] == "done" for entry in entries.values())
+    outputs = sorted(entry["output"] for entry in entries.values())
+    assert outputs == [str(tmp_path / "out" / "a" / "rec_annotated.edf"),
+                       str(tmp_path / "out" / "b" / "rec_annotated.edf")]
+    assert all(os.path.getsize(path) > 0 for path in outputs)
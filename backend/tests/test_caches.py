@@ -0,0 +1,68 @@
+# test_caches.py
+#
+# Ограничение объёма кэшей признаков, детекторов и вероятностей на диске (evict_cache): при превышении предела удаляются записи,
+# к которым дольше всего не обращались; только что сохранённая запись остаётся.
+
+import os
+import time
+import numpy as np
+from model import detector_cache, prediction_cache
+from model.feature_cache import evict_cache, load_cached_features, save_cached_features
+
+
+def entry_keys(cache_dir):
+    return sorted({name[:40] for name in os.listdir(cache_dir)})
+
+
+def test_evict_cache_removes_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path)
+    keys = [f"{i:040x}" for i in range(3)]
+    features, positions = np.zeros((1000, 18)), np.arange(1000)
+    for age, key in zip((30, 20), keys[:2]):
+        save_cached_features(key, {}, features, positions, cache_dir)
+        stamp = time.time() - age
+        for name in os.listdir(cache_dir):
+            if name.startswith(key):
+                os.utime(os.path.join(cache_dir, name), (stamp, stamp))
+    entry_size = sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir)) // 2
+
+    # Чтение из кэша делает самую старую запись последней использованной
+    loaded, _ = load_cached_features(keys[0], cache_dir)
+    assert loaded is not None
+    save_cached_features(keys[2], {}, features, positions, cache_dir)
+
+    assert evict_cache(cache_dir, int(2.5 * entry_size), keep=keys[2]) == 1
+    assert entry_keys(cache_dir) == [keys[0], keys[2]]
+    # Только что сохранённая запись не удаляется, даже если предел меньше её объёма
+    assert evict_cache(cache_dir, 1, keep=keys[2]) == 1
+    assert entry_keys(cache_dir) == [keys[2]]
+
+
+def test_evict_cache_skips_unfinished_files(tmp_path):
+    cache_dir = str(tmp_path)
+    unfinished = tmp_path / f"swd_{'a' * 40}_envelope.npy.tmp"
+    unfinished.write_bytes(b"\0" * 1024)
+    assert evict_cache(cache_dir, 1) == 0
+    assert unfinished.exists()
+
+
+def test_detector_cache_is_capped(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path)
+    monkeypatch.setattr(detector_cache, "DETECTOR_CACHE_MAX_BYTES", 1)
+    for content_hash in ("first", "second"):
+        key = detector_cache.detector_cache_key("swd", content_hash, {})
+        assert detector_cache.save_products(key, {"envelope": np.ones(1000), "total": 1}, cache_dir)
+    # При пределе меньше одной записи в кэше остаётся только последняя сохранённая
+    assert detector_cache.load_products(key, cache_dir) is not None
+    assert entry_keys(cache_dir) == [key[:40]]
+
+
+def test_prediction_cache_is_capped(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path)
+    monkeypatch.setattr(prediction_cache, "PREDICTION_CACHE_MAX_BYTES", 1)
+    for feature_key in ("first", "second"):
+        key = prediction_cache.prediction_cache_key(feature_key, "model")
+        assert prediction_cache.save_probabilities(key, np.full((100, 3), 1 / 3), np.arange(100), cache_dir)
+    probabilities, _ = prediction_cache.load_probabilities(key, cache_dir)
+    assert probabilities is not None
+    assert entry_keys(cache_dir) == [key]
@@ -0,0 +1,106 @@
+# test_ds_detection.py
+#
+# Детектор DS (промежуточные данные + детекция по ним) сравнивается с исходным detect_ds:
+# поиск пиков отдельно в каждой секунде каждого канала сглаженного сигнала на исходной частоте.
+
+import importlib
+import mne
+import numpy as np
+import pytest
+from scipy.signal import butter, filtfilt, find_peaks
+
+# Копии модуля на сервере и в приложении
+DS_MODULES = ["ds_detection", "model.ds_detection"]
+
+
+def baseline_detect_ds(data, sfreq, cutoff=8.0, order=3, min_peaks_per_sec=1, max_peaks_per_sec=8,
+                       lower_amplitude_threshold=0.00008, upper_amplitude_threshold=0.00030, min_duration=7):
+    """
+    Исходный алгоритм detect_ds по сигналам в памяти; возвращает [(start_second, end_second)].
+    """
+    b, a = butter(order, cutoff / (0.5 * sfreq), btype='low')
+    smoothed_data = np.array([filtfilt(b, a, channel) for channel in data])
+
+    intervals = []
+    current = None
+    total_seconds = int(smoothed_data.shape[1] / sfreq)
+    for sec in range(total_seconds):
+        all_channels_match = True
+        for channel_data in smoothed_data:
+            segment = channel_data[int(sec * sfreq):int((sec + 1) * sfreq)]
+            peaks, properties = find_peaks(segment, height=lower_amplitude_threshold)
+            if (len(peaks) < min_peaks_per_sec or len(peaks) > max_peaks_per_sec
+                    or np.any(properties['peak_heights'] > upper_amplitude_threshold)):
+                all_channels_match = False
+                break
+        if all_channels_match:
+            current = [sec, sec] if current is None else [current[0], sec]
+        else:
+            if current is not None and current[1] - current[0] + 1 >= min_duration:
+                intervals.append(tuple(current))
+            current = None
+    if current is not None and current[1] - current[0] + 1 >= min_duration:
+        intervals.append(tuple(current))
+    return intervals
+
+
+def baseline_second_heights(data, sfreq, cutoff=8.0, order=3):
+    """
+    Высоты пиков каждой секунды каждого канала, как их находит исходный detect_ds (по убыванию).
+    """
+    b, a = butter(order, cutoff / (0.5 * sfreq), btype='low')
+    heights = []
+    for channel in data:
+        smoothed = filtfilt(b, a, channel)
+        for sec in range(int(smoothed.shape[0] / sfreq)):
+            segment = smoothed[int(sec * sfreq):int((sec + 1) * sfreq)]
+            peaks, _ = find_peaks(segment)
+            heights.append(np.sort(segment[peaks])[::-1])
+    return heights
+
+
+def as_pairs(intervals):
+    return [(interval['start_second'], interval['end_second']) for interval in intervals]
+
+
+@pytest.fixture(scope="module")
+def recording_data(recording):
+    raw = mne.io.read_raw_edf(recording, preload=False, verbose=False)
+    data = raw.get_data(picks=raw.ch_names[:3])
+    sfreq = raw.info['sfreq']
+    return recording, data, sfreq, baseline_detect_ds(data, sfreq)
+
+
+@pytest.mark.parametrize("module_name", DS_MODULES)
+def test_products_match_baseline(module_name, recording_data):
+    ds_detection = importlib.import_module(module_name)
+    _, data, sfreq, expected = recording_data
+    products = ds_detection.ds_products(data, sfreq, **ds_detection.DS_PRODUCT_PARAMS)
+    assert as_pairs(ds_detection.detect_ds_from_products(products)) == expected
+
+
+@pytest.mark.parametrize("module_name", DS_MODULES)
+def test_detect_ds_from_file_matches_baseline(module_name, recording_data):
+    ds_detection = importlib.import_module(module_name)
+    path, _, _, expected = recording_data
+    assert as_pairs(ds_detection.detect_ds(path)) == expected
+
+
+def test_synthetic_recording_has_ds(recording_data):
+    # Сравнение имеет смысл, только если в записи есть интервалы DS
+    path, _, _, expected = recording_data
+    if "synthetic" in path:
+        assert len(expected) > 5
+
+
+@pytest.mark.parametrize("module_name", DS_MODULES)
+def test_products_heights_match_baseline(module_name, recording_data):
+    # Промежуточные данные по умолчанию - те же пики секунд с теми же высотами, что у исходного алгоритма
+    ds_detection = importlib.import_module(module_name)
+    _, data, sfreq, _ = recording_data
+    products = ds_detection.ds_products(data, sfreq, **ds_detection.DS_PRODUCT_PARAMS)
+    expected = baseline_second_heights(data[:products['n_channels']], sfreq)
+    offsets = products['offsets']
+    assert len(offsets) == len(expected) + 1
+    for i, heights in enumerate(expected):
+        np.testing.assert_array_equal(products['heights'][offsets[i]:offsets[i + 1]], heights)
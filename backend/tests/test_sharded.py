@@ -0,0 +1,87 @@
+# test_sharded.py
+#
+# Параллельная обработка по отрезкам (model.sharded) против обработки записи целиком (model.main):
+# события на границах отрезков должны собираться так же, как без разбиения. Сравниваются итоговые
+# аннотации и промежуточные данные: признаки IS, огибающая и таблица пиков SWD совпадают точно,
+# высоты пиков DS - с точностью до погрешности округления filtfilt.
+
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")  # model.main импортирует model_utils
+
+import joblib
+from model.detector_cache import detector_cache_key, load_products
+from model.ds_detection import DS_PRODUCT_PARAMS
+from model.feature_cache import feature_cache_key, load_cached_features
+from model.main import LOWCUT, HIGHCUT, annotate_edf
+from model.resampling import MODEL_RATE, resampled_length
+from model.sharded import annotate_edf_sharded, shard_bounds
+from model.swd_detection import SWD_PRODUCT_PARAMS
+from stub_model import BandPowerModel
+
+# Короче блока огибающей не бывает: отрезок округляется до ENVELOPE_BLOCK_SIZE (655 с при 400 Гц)
+SHARD_SECONDS = 600
+
+
+@pytest.fixture(scope="module")
+def stub_model_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("model") / "stub_model.joblib")
+    joblib.dump(BandPowerModel(), path)
+    return path
+
+
+def run_both(recording, model_path, cache_dir):
+    results = {}
+    for name in ("whole", "sharded"):
+        feature_cache_dir = os.path.join(cache_dir, name, "features")
+        detector_cache_dir = os.path.join(cache_dir, name, "detectors")
+        if name == "whole":
+            status, result = annotate_edf(recording, model=joblib.load(model_path), feature_cache_dir=feature_cache_dir,
+                                          detector_cache_dir=detector_cache_dir, prediction_cache_dir=None)
+        else:
+            status, result = annotate_edf_sharded(recording, model_path, workers=2, shard_seconds=SHARD_SECONDS,
+                                                  feature_cache_dir=feature_cache_dir,
+                                                  detector_cache_dir=detector_cache_dir, prediction_cache_dir=None)
+        assert status == "success"
+        results[name] = (result, feature_cache_dir, detector_cache_dir)
+    return results
+
+
+def test_shard_bounds_cover_recording():
+    n_samples = 3 * 3600 * MODEL_RATE + 123
+    bounds = shard_bounds(n_samples, MODEL_RATE, SHARD_SECONDS)
+    assert bounds[0][0] == 0 and bounds[-1][1] == n_samples
+    assert all(stop == start for (_, stop), (start, _) in zip(bounds, bounds[1:]))
+
+
+def test_sharded_matches_whole_file(recording, stub_model_path, tmp_path):
+    results = run_both(recording, stub_model_path, str(tmp_path))
+    whole, whole_features, whole_detectors = results["whole"]
+    sharded, sharded_features, sharded_detectors = results["sharded"]
+    n_model = resampled_length(whole['n_samples'], whole['sfreq'], MODEL_RATE)
+    assert len(shard_bounds(n_model, MODEL_RATE, SHARD_SECONDS)) > 1
+
+    # Признаки IS: полосовой фильтр отрезка продолжается с состояния всей записи - те же окна и значения
+    key, _ = feature_cache_key(whole['content_hash'], MODEL_RATE, LOWCUT, HIGHCUT)
+    features, positions = load_cached_features(key, whole_features)
+    sharded_features, sharded_positions = load_cached_features(key, sharded_features)
+    np.testing.assert_array_equal(sharded_positions, positions)
+    np.testing.assert_allclose(sharded_features, features, rtol=1e-12, atol=1e-15)
+
+    # SWD: огибающая и таблица пиков совпадают точно
+    swd_key = detector_cache_key('swd', whole['content_hash'], SWD_PRODUCT_PARAMS)
+    swd, sharded_swd = load_products(swd_key, whole_detectors), load_products(swd_key, sharded_detectors)
+    np.testing.assert_array_equal(sharded_swd['envelope'], swd['envelope'])
+    np.testing.assert_array_equal(sharded_swd['table'], swd['table'])
+
+    # DS: те же пики в каждой секунде, высоты - с точностью до погрешности filtfilt
+    ds_key = detector_cache_key('ds', whole['content_hash'], DS_PRODUCT_PARAMS)
+    ds, sharded_ds = load_products(ds_key, whole_detectors), load_products(ds_key, sharded_detectors)
+    np.testing.assert_array_equal(sharded_ds['offsets'], ds['offsets'])
+    np.testing.assert_allclose(sharded_ds['heights'], ds['heights'], rtol=1e-9, atol=1e-15)
+
+    if "synthetic" in recording:
+        assert {'is1', 'is2', 'swd1', 'ds1'} <= {description for _, _, description in whole['annotations']}
+    assert sharded['annotations'] == whole['annotations']
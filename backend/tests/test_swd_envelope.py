@@ -0,0 +1,53 @@
+# test_swd_envelope.py
+#
+# Блочная огибающая SWD (hilbert_envelope): совпадение с модулем аналитического сигнала
+# по всей записи и сшивка отрезков, прочитанных с запасом, с расчётом по всей записи.
+
+import importlib
+import mne
+import numpy as np
+import pytest
+from scipy.signal import hilbert
+
+# Копии модуля на сервере и в приложении
+SWD_MODULES = ["swd_detection", "model.swd_detection"]
+
+
+@pytest.fixture(scope="module")
+def filtered(synthetic_dir):
+    from conftest import synthetic_recording
+    raw = mne.io.read_raw_edf(synthetic_recording(synthetic_dir, 0.5, 1), preload=False, verbose=False)
+    data = raw.get_data(picks=raw.ch_names[:3])
+    swd_detection = importlib.import_module("swd_detection")
+    return mne.filter.filter_data(data, raw.info['sfreq'], swd_detection.SWD_FREQ_LOW, swd_detection.SWD_FREQ_HIGH,
+                                  verbose=False)
+
+
+@pytest.mark.parametrize("module_name", SWD_MODULES)
+@pytest.mark.parametrize("n_samples", [None, 719_993])  # длина записи и простая длина
+def test_envelope_matches_hilbert(module_name, n_samples, filtered):
+    swd_detection = importlib.import_module(module_name)
+    data = filtered[:, :n_samples]
+    assert data.shape[-1] > 2 * swd_detection.ENVELOPE_BLOCK_SIZE
+    reference = np.abs(hilbert(data, axis=-1))
+    envelope = swd_detection.hilbert_envelope(data)
+    assert envelope.dtype == np.float32 and envelope.shape == reference.shape
+    # У краёв записи огибающая всей записи и блоков различаются (эффект края БПФ)
+    inner = slice(swd_detection.ENVELOPE_OVERLAP, -swd_detection.ENVELOPE_OVERLAP)
+    error = np.abs(envelope[:, inner] - reference[:, inner]).max() / reference.max()
+    assert error < 1e-4
+
+
+@pytest.mark.parametrize("module_name", SWD_MODULES)
+def test_envelope_segments_stitch(module_name, filtered):
+    swd_detection = importlib.import_module(module_name)
+    block, overlap = swd_detection.ENVELOPE_BLOCK_SIZE, swd_detection.ENVELOPE_OVERLAP
+    n_samples = filtered.shape[-1]
+    whole = swd_detection.hilbert_envelope(filtered)
+    # Отрезки начинаются с границ блоков всей записи и читаются с запасом overlap, как в model.sharded
+    for start in range(0, n_samples, block):
+        stop = min(start + block, n_samples)
+        first, last = max(start - overlap, 0), min(stop + overlap, n_samples)
+        segment = swd_detection.hilbert_envelope(filtered[:, first:last], threads=1, start=start - first,
+                                                 stop=stop - first)
+        np.testing.assert_array_equal(segment, whole[:, start:stop])